@@ -19,6 +19,7 @@ def _utc_iso():
 import os, secrets
 from datetime import datetime, timedelta
 from database import get_connection
+from models_saas import invalidate_user_cache
 from mailer import send_email_smtp  # whatever your SMTP sender is
 
 def _gen_otp6() -> str:
@@ -41,6 +42,7 @@ def send_verification_code(uid: int, email: str, minutes: int = 15) -> None:
     """, (code, exp, now.isoformat(), int(uid)))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(uid))
 
     app_name = os.getenv("APP_NAME", "Your App")
     subject = f"{app_name} verification code: {code}"
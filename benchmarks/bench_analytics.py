@@ -0,0 +1,155 @@
+# benchmarks/bench_analytics.py
+"""
+/analytics as history grows, up to --events send events.
+
+  before   the old get_analytics_data: GROUP BY substr(last_sent_at, 1, 10)
+           over every followup (global, latest send per followup only)
+  after    get_analytics_data(user_id, ...): rollup rows for the range plus
+           the not-yet-rolled-up tail of send_events
+
+History is added in --steps equal chunks (timestamps spread over --days of
+history, --sends-per-followup events per followup row). After each chunk
+the rollup job folds the new events (timed), then both reads are timed for
+random users: the default 90-day range by day, a full year by day, and one
+week by hour. A last run leaves --tail events un-rolled, as if the job
+were a minute behind.
+
+    python benchmarks/bench_analytics.py --events 10000000 --users 1000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=10_000_000)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=3 * 365, help="history spread over this many days")
+    ap.add_argument("--steps", type=int, default=4)
+    ap.add_argument("--sends-per-followup", type=int, default=10)
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--tail", type=int, default=20000, help="un-rolled events in the last run")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_analytics_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    with database.session() as conn:
+        conn.executemany(
+            "INSERT INTO users (id, name, email, password_hash, created_at) VALUES (?, ?, ?, 'x', '2026-01-01')",
+            ((i, f"U{i}", f"u{i}@example.com") for i in range(1, args.users + 1)),
+        )
+
+    today = date(2026, 10, 17)
+    first = today - timedelta(days=args.days - 1)
+
+    def add_history(n: int) -> None:
+        # generated in SQL: random user, event mix ~85% sent / 10% failed / 5% replied,
+        # timestamp uniform over the history window
+        with database.session() as conn:
+            conn.execute(
+                f"""
+                WITH RECURSIVE k(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM k WHERE i < ?)
+                INSERT INTO send_events (user_id, followup_id, event, channel, created_at)
+                SELECT
+                    1 + abs(random()) % {args.users},
+                    NULL,
+                    CASE WHEN abs(random()) % 100 < 85 THEN 'sent'
+                         WHEN abs(random()) % 3 < 2 THEN 'failed' ELSE 'replied' END,
+                    'email',
+                    strftime('%Y-%m-%dT%H:%M:%S', julianday(?) + (abs(random()) % ({args.days} * 86400)) / 86400.0)
+                FROM k
+                """,
+                (n, first.isoformat()),
+            )
+            conn.execute(
+                f"""
+                WITH RECURSIVE k(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM k WHERE i < ?)
+                INSERT INTO followups (user_id, client_name, email, followup_type, due_date, created_at, status, last_sent_at)
+                SELECT
+                    1 + abs(random()) % {args.users}, 'Client', 'c@example.com', 'invoice', '2026-01-01', '2026-01-01', 'sent',
+                    strftime('%Y-%m-%dT%H:%M:%S', julianday(?) + (abs(random()) % ({args.days} * 86400)) / 86400.0)
+                FROM k
+                """,
+                (max(n // args.sends_per_followup, 1), first.isoformat()),
+            )
+
+    def before() -> list:
+        conn = database.get_connection()
+        rows = conn.execute(
+            """
+            SELECT substr(last_sent_at, 1, 10) AS day, COUNT(*)
+            FROM followups
+            WHERE last_sent_at IS NOT NULL AND TRIM(last_sent_at) <> ''
+            GROUP BY substr(last_sent_at, 1, 10)
+            ORDER BY day ASC
+            """
+        ).fetchall()
+        conn.close()
+        return rows
+
+    rnd = random.Random(11)
+    end = today.isoformat()
+    reads = [
+        ("90 days by day", lambda u: models_saas.get_analytics_data(u, end=end)),
+        ("365 days by day", lambda u: models_saas.get_analytics_data(u, (today - timedelta(days=364)).isoformat(), end)),
+        ("7 days by hour", lambda u: models_saas.get_analytics_data(u, (today - timedelta(days=6)).isoformat(), end, "hour")),
+    ]
+
+    def time_reads(label: str) -> None:
+        t0 = time.perf_counter()
+        before()
+        b = (time.perf_counter() - t0) * 1e3
+        cols = []
+        for _, fn in reads:
+            lat = []
+            for _ in range(args.calls):
+                u = rnd.randint(1, args.users)
+                t0 = time.perf_counter()
+                fn(u)
+                lat.append((time.perf_counter() - t0) * 1e3)
+            cols.append(f"{_pct(lat, 0.5):6.2f}/{_pct(lat, 0.99):6.2f}")
+        print(f"{label:<22} {b:10.0f}ms   " + "   ".join(f"{c:>15}" for c in cols))
+
+    print(f"{args.users} users, history over {args.days} days; after = p50/p99 ms per call")
+    print(f"{'events':<22} {'before':>12}   " + "   ".join(f"{name:>15}" for name, _ in reads))
+    total = 0
+    chunk = args.events // args.steps
+    for step in range(args.steps):
+        add_history(chunk)
+        total += chunk
+        t0 = time.perf_counter()
+        folded = models_saas.roll_up_send_events()
+        took = time.perf_counter() - t0
+        time_reads(f"{total:,}")
+        print(f"{'':<22} rollup folded {folded:,} events in {took:.1f}s ({folded / max(took, 1e-9):,.0f}/s)")
+
+    add_history(args.tail)
+    time_reads(f"+{args.tail:,} un-rolled")
+
+    with database.session() as conn:
+        rows = {t: conn.execute(f"SELECT COUNT(*) FROM analytics_{t}").fetchone()[0] for t in ("hourly", "daily")}
+    print(f"rollup rows: {rows}, db size {os.path.getsize(os.environ['DB_PATH']) / 2**30:.2f}GB")
+
+
+if __name__ == "__main__":
+    main()
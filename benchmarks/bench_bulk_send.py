@@ -0,0 +1,129 @@
+# benchmarks/bench_bulk_send.py
+"""
+Bulk send of one user's template to --recipients followups, through a fake
+transport (builds the MIME message and base64 body the Gmail path sends,
+then drops it):
+
+  before   per followup: get_scheduler_template + get_branding +
+           render_scheduler_html (what build_branded_email_html did)
+  cached   per followup: build_branded_email_html, renderer from the
+           per-user cache (the outbox send handlers)
+  batch    one BrandedRenderer built up front, reused for every followup
+           (the upper bound for the cached path: no cache lookups)
+
+Checks all three send the same bodies.
+
+    python benchmarks/bench_bulk_send.py --recipients 5000
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeTransport:
+    def __init__(self) -> None:
+        self.sent = 0
+        self.bodies: list[str] = []
+
+    def send(self, user: dict, to_email: str, subject: str, html_body: str) -> None:
+        msg = EmailMessage()
+        msg["To"] = to_email
+        msg["Subject"] = subject
+        msg["From"] = user.get("email") or "me"
+        msg.set_content("This email contains an HTML message.")
+        msg.add_alternative(html_body, subtype="html")
+        base64.urlsafe_b64encode(msg.as_bytes())
+        self.sent += 1
+        self.bodies.append(html_body)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--recipients", type=int, default=5000)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_bulk_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+    import scheduler_render
+    from email_scheduler import build_branded_email_html
+    from scheduler_render import BrandedRenderer, DEFAULT_SCHEDULER_TEMPLATE, render_scheduler_html
+
+    database.init_db()
+    uid = models_saas.create_user("Bench", "bench@example.com", "x")
+    models_saas.set_branding(uid, "https://example.com/logo.png", "#0f766e", "Acme", "help@example.com")
+    models_saas.upsert_scheduler_template(uid, DEFAULT_SCHEDULER_TEMPLATE)
+    user = models_saas.get_user_by_id(uid)
+
+    followups = []
+    for i in range(args.recipients):
+        followups.append({
+            "id": i + 1,
+            "client_name": f"Client {i}",
+            "email": f"client{i}@example.com",
+            "followup_type": "invoice",
+            "description": f"Invoice #{1000 + i} is due.\nThanks!",
+            "due_date": "2026-03-25",
+            "email_format": "html",
+            # a campaign message for most, a personal note for some
+            "message_override": "Quick reminder about <b>your invoice</b>." if i % 10 else f"Hi {i}, see attached.",
+        })
+
+    def subject(f: dict) -> str:
+        return f"{f['followup_type'].title()} for {f['client_name']}"
+
+    def before(t: FakeTransport) -> None:
+        for f in followups:
+            tmpl = (models_saas.get_scheduler_template(uid) or "").strip() or DEFAULT_SCHEDULER_TEMPLATE
+            branding = models_saas.get_branding(uid) or {}
+            html_body = render_scheduler_html(tmpl=tmpl, user=user, followup=f, branding=branding).strip()
+            t.send(user, f["email"], subject(f), html_body)
+
+    def cached(t: FakeTransport) -> None:
+        for f in followups:
+            t.send(user, f["email"], subject(f), build_branded_email_html(user, f))
+
+    def batch(t: FakeTransport) -> None:
+        tmpl = (models_saas.get_scheduler_template(uid) or "").strip() or DEFAULT_SCHEDULER_TEMPLATE
+        renderer = BrandedRenderer(tmpl, user, models_saas.get_branding(uid) or {})
+        for f in followups:
+            t.send(user, f["email"], subject(f), (renderer.render(f) or "").strip())
+
+    # rendering only (transport cost left out), then end to end
+    results = {}
+    for label, run in (("before", before), ("cached", cached), ("batch", batch)):
+        render_only = FakeTransport()
+        render_only.send = lambda user, to, subj, html_body, t=render_only: t.bodies.append(html_body)
+        t0 = time.perf_counter()
+        run(render_only)
+        render_took = time.perf_counter() - t0
+
+        t = FakeTransport()
+        t0 = time.perf_counter()
+        run(t)
+        took = time.perf_counter() - t0
+        results[label] = (render_took, took, t.bodies)
+        print(
+            f"{label:<8} recipients={t.sent:<6} render {render_took:6.2f}s {t.sent / render_took:8.0f}/s   "
+            f"render+send {took:6.2f}s {t.sent / took:8.0f}/s"
+        )
+
+    b, c, a = results["before"], results["cached"], results["batch"]
+    print(f"render speedup: {b[0] / c[0]:.1f}x cached, {b[0] / a[0]:.1f}x batch; "
+          f"end to end: {b[1] / c[1]:.1f}x cached, {b[1] / a[1]:.1f}x batch")
+    print("same bodies:", b[2] == c[2] == a[2], "| template cache:", scheduler_render.template_cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# benchmarks/bench_counters.py
+"""
+Badge / count reads before and after user_counters.
+
+  before   count_done: COUNT(*) over the user's done followups
+           stats_overview: four COUNT(*) scans over users and followups
+           /api/notifications/count: load every unread notification, len()
+  after    primary-key reads of user_counters (kept by triggers)
+
+Also prices the triggers on the write side (the same writes with the
+triggers dropped) and times the repair job's full recount.
+
+    python benchmarks/bench_counters.py --users 200 --followups 2000 --notifications 300
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STATUSES = ["draft", "pending", "scheduled", "sent", "failed", "done", "replied", "passed"]
+
+
+def _per_call(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--followups", type=int, default=2000, help="per user")
+    ap.add_argument("--notifications", type=int, default=300, help="unread per user")
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--writes", type=int, default=5000)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_counters_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    rnd = random.Random(7)
+    uids = [models_saas.create_user(f"U{i}", f"u{i}@example.com", "x") for i in range(args.users)]
+    with database.session() as conn:
+        conn.executemany(
+            """
+            INSERT INTO followups (user_id, client_name, email, followup_type, due_date, created_at, status)
+            VALUES (?, 'Client', 'c@example.com', 'invoice', '2026-03-01', '2026-01-01T00:00:00', ?)
+            """,
+            ((uid, rnd.choice(STATUSES)) for uid in uids for _ in range(args.followups)),
+        )
+        conn.executemany(
+            "INSERT INTO notifications (user_id, message, created_at) VALUES (?, 'Reply received from a client', '2026-01-01T00:00:00')",
+            ((uid,) for uid in uids for _ in range(args.notifications)),
+        )
+        conn.execute("ANALYZE")
+
+    def before_done(uid: int) -> int:
+        conn = database.get_connection()
+        n = conn.execute("SELECT COUNT(*) FROM followups WHERE user_id=? AND status='done'", (uid,)).fetchone()[0]
+        conn.close()
+        return n
+
+    def before_overview() -> dict:
+        conn = database.get_connection()
+        out = {
+            "users": conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "paid": conn.execute("SELECT COUNT(*) FROM users WHERE is_subscribed=1").fetchone()[0],
+            "pending": conn.execute("SELECT COUNT(*) FROM followups WHERE status='pending'").fetchone()[0],
+            "done": conn.execute("SELECT COUNT(*) FROM followups WHERE status='done'").fetchone()[0],
+        }
+        conn.close()
+        return out
+
+    def before_unread(uid: int) -> int:
+        return len(models_saas.get_notifications(uid, unread_only=True))
+
+    uid = uids[len(uids) // 2]
+    assert before_done(uid) == models_saas.count_done(uid)
+    assert before_overview() == models_saas.stats_overview()
+    assert before_unread(uid) == models_saas.count_unread_notifications(uid)
+
+    print(f"{args.users} users x {args.followups} followups ({args.users * args.followups} rows), "
+          f"{args.notifications} unread notifications each")
+    print(f"{'read':<28} {'before':>12} {'after':>12}")
+    for label, old, new in [
+        ("count_done", lambda: before_done(uid), lambda: models_saas.count_done(uid)),
+        ("stats_overview", before_overview, models_saas.stats_overview),
+        ("notifications count", lambda: before_unread(uid), lambda: models_saas.count_unread_notifications(uid)),
+        ("all badges (get_user_counters)", lambda: (before_done(uid), before_unread(uid)),
+         lambda: models_saas.get_user_counters(uid)),
+    ]:
+        calls = max(args.calls // 20, 5) if label == "stats_overview" else args.calls
+        b, a = _per_call(old, calls), _per_call(new, args.calls)
+        print(f"{label:<28} {b:10.0f}us {a:10.0f}us  ({b / a:.0f}x)")
+
+    # write side: status flips through the same UPDATE the send paths use
+    flips = [(rnd.choice(uids), rnd.choice(STATUSES)) for _ in range(args.writes)]
+
+    def write_flips() -> float:
+        conn = database.get_connection()
+        t0 = time.perf_counter()
+        for u, status in flips:
+            conn.execute(
+                "UPDATE followups SET status=? WHERE id=(SELECT id FROM followups WHERE user_id=? LIMIT 1)",
+                (status, u),
+            )
+            conn.commit()
+        took = time.perf_counter() - t0
+        conn.close()
+        return took / len(flips) * 1e6
+
+    def write_inserts() -> float:
+        conn = database.get_connection()
+        t0 = time.perf_counter()
+        conn.executemany(
+            """
+            INSERT INTO followups (user_id, client_name, email, followup_type, due_date, created_at, status)
+            VALUES (?, 'Import', 'i@example.com', 'invoice', '2026-03-01', '2026-01-01T00:00:00', 'draft')
+            """,
+            ((u,) for u, _ in flips),
+        )
+        conn.commit()
+        took = time.perf_counter() - t0
+        conn.close()
+        return took / len(flips) * 1e6
+
+    with_flip, with_insert = write_flips(), write_inserts()
+    t0 = time.perf_counter()
+    fixes = models_saas.repair_user_counters()
+    repair_took = time.perf_counter() - t0
+
+    with database.session() as conn:
+        triggers = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_counters_%'")]
+        for name in triggers:
+            conn.execute(f"DROP TRIGGER {name}")
+    without_flip, without_insert = write_flips(), write_inserts()
+
+    print(f"{'write':<28} {'no triggers':>12} {'triggers':>12}")
+    print(f"{'status UPDATE + commit':<28} {without_flip:10.1f}us {with_flip:10.1f}us")
+    print(f"{'import-style INSERT':<28} {without_insert:10.1f}us {with_insert:10.1f}us")
+    print(f"repair_user_counters: {repair_took * 1e3:.0f}ms full recount, {len(fixes)} drifted counters")
+
+
+if __name__ == "__main__":
+    main()
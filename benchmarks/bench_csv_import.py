@@ -0,0 +1,183 @@
+# benchmarks/bench_csv_import.py
+"""
+CSV import throughput: the old per-row path (line-count pass, then one
+connection + INSERT + commit per row, as add_followup did) vs
+import_csv.import_followups_from_csv (one pass, executemany per chunk).
+
+The per-row path runs twice: with a fresh connection per row (sqlite3
+connect + pragmas, the original cost) and with a pooled one (the cheapest
+the per-row shape gets). Then the same file is uploaded again in each
+dedupe mode (skip / update), which should add no rows, and a file with blank
+due dates is imported on two different days, which should keep one row per
+record.
+
+    python benchmarks/bench_csv_import.py --rows 100000
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MAPPING = {
+    "client_name": "Name",
+    "email": "Email",
+    "phone": "Phone",
+    "description": "Notes",
+    "due_date": "Due Date",
+    "preferred_channel": "email",
+}
+
+
+def write_csv(path: str, rows: int) -> None:
+    rnd = random.Random(3)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["Name", "Email", "Phone", "Notes", "Due Date"])
+        for i in range(rows):
+            w.writerow([
+                f"Client {i}",
+                f"client{i}@example.com" if i % 50 else "",  # some rows without email
+                f"+23480{rnd.randint(10000000, 99999999)}" if i % 3 else "",
+                "Invoice follow-up, net 30",
+                f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}" if i % 97 else "not a date",
+            ])
+
+
+def import_per_row(file_path: str, user_id: int, progress_cb, pooled: bool) -> dict:
+    # the previous engine, with add_followup's connection-per-row insert inlined
+    import database
+    import models_saas
+
+    with open(file_path, "r", newline="", encoding="utf-8-sig") as f:
+        total = max(sum(1 for _ in f) - 1, 0)
+
+    imported = skipped = done = 0
+    errors = []
+    with open(file_path, "r", newline="", encoding="utf-8-sig") as f:
+        for i, row in enumerate(csv.DictReader(f), start=2):
+            done += 1
+            try:
+                email = (row.get("Email") or "").strip()
+                due_raw = (row.get("Due Date") or "").strip()
+                try:
+                    due = datetime.strptime(due_raw[:10], "%Y-%m-%d").date().isoformat()
+                except Exception:
+                    raise ValueError(f"Invalid due date '{due_raw}' (expected YYYY-MM-DD)")
+                if not email:
+                    skipped += 1
+                    continue
+                phone = models_saas._clean_phone(row.get("Phone") or "")
+                conn = database.get_connection() if pooled else database._connect()
+                conn.execute(
+                    """
+                    INSERT INTO followups (user_id, client_name, email, phone, preferred_channel,
+                        followup_type, description, due_date, status, created_at)
+                    VALUES (?, ?, ?, ?, ?, 'other', ?, ?, 'pending', ?)
+                    """,
+                    (user_id, row["Name"].strip(), email.lower(), phone,
+                     models_saas.resolve_channel("email", email, phone),
+                     row["Notes"].strip(), due, models_saas._utc_iso()),
+                )
+                conn.commit()
+                conn.close()
+                imported += 1
+            except Exception as e:
+                skipped += 1
+                errors.append(f"Row {i}: {e}")
+            finally:
+                if done % 5 == 0 or done == total:
+                    progress_cb(done, total)
+    return {"imported": imported, "skipped": skipped, "errors": errors}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_import_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    csv_path = os.path.join(tmp, "contacts.csv")
+    write_csv(csv_path, args.rows)
+
+    import database
+    import models_saas
+    import import_csv
+
+    database.init_db()
+    uid = models_saas.create_user("Bench", "bench@example.com", "x")
+
+    results = {}
+    for label, run in (
+        ("before (new conn per row)", lambda cb: import_per_row(csv_path, uid, cb, pooled=False)),
+        ("before (pooled, row commit)", lambda cb: import_per_row(csv_path, uid, cb, pooled=True)),
+        ("after (chunked executemany)", lambda cb: import_csv.import_followups_from_csv(csv_path, uid, MAPPING, progress_cb=cb)),
+    ):
+        with database.session() as conn:
+            conn.execute("DELETE FROM followups")
+        calls = []
+        t0 = time.perf_counter()
+        result = run(lambda done, total: calls.append((done, total)))
+        took = time.perf_counter() - t0
+        results[label] = took
+        print(
+            f"{label:<30} rows={args.rows:<7} {took:8.2f}s {args.rows / took:10.0f} rows/s  "
+            f"imported={result['imported']} skipped={result['skipped']} errors={result.get('error_count', len(result['errors']))} "
+            f"progress_calls={len(calls)} last={calls[-1] if calls else None}"
+        )
+
+    fresh, pooled, after = results.values()
+    print(f"speedup: {fresh / after:.1f}x vs new conn per row, {pooled / after:.1f}x vs pooled per row")
+
+    for mode in ("skip", "update"):
+        t0 = time.perf_counter()
+        result = import_csv.import_followups_from_csv(csv_path, uid, MAPPING, mode=mode)
+        took = time.perf_counter() - t0
+        with database.session() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM followups").fetchone()[0]
+        print(
+            f"{'re-upload (' + mode + ')':<30} rows={args.rows:<7} {took:8.2f}s {args.rows / took:10.0f} rows/s  "
+            f"inserted={result['inserted']} updated={result['updated']} skipped={result['skipped']} followups={count}"
+        )
+
+    # blank due dates default to the import day; a re-upload the next day
+    # must still hit the same keys
+    blank_path = os.path.join(tmp, "no_due.csv")
+    with open(blank_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["Name", "Email", "Phone", "Notes", "Due Date"])
+        for i in range(100):
+            w.writerow([f"Blank {i}", f"blank{i}@example.com", "", "No due date", ""])
+
+    class Tomorrow(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + timedelta(days=1)
+
+    with database.session() as conn:
+        conn.execute("DELETE FROM followups")
+    import_csv.import_followups_from_csv(blank_path, uid, MAPPING)
+    import_csv.datetime = Tomorrow
+    try:
+        result = import_csv.import_followups_from_csv(blank_path, uid, MAPPING)
+    finally:
+        import_csv.datetime = datetime
+    with database.session() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM followups").fetchone()[0]
+    print(
+        f"{'re-upload next day (blank due)':<30} rows=100     inserted={result['inserted']} "
+        f"skipped={result['skipped']} followups={count} one_row_per_record={count == 100}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_csv_pipeline.py
+"""
+Large-import pipeline: import_followups_from_csv validating inline (one
+process) vs through the validation process pool, on a file with a share of
+bad rows written to a rejected-rows CSV. Reports rows/s and peak RSS of the
+importing process (a running max), which should stay flat with file size:
+chunks in flight are bounded and rejected rows go to disk, not a list.
+
+    python benchmarks/bench_csv_pipeline.py --rows 1000000 --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MAPPING = {
+    "client_name": "Name",
+    "email": "Email",
+    "phone": "Phone",
+    "description": "Notes",
+    "due_date": "Due Date",
+    "preferred_channel": "email",
+}
+
+
+def write_csv(path: str, rows: int) -> None:
+    rnd = random.Random(5)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["Name", "Email", "Phone", "Notes", "Due Date"])
+        for i in range(rows):
+            w.writerow([
+                f"Client {i}",
+                f" Client{i}@Example.com " if i % 50 else "",
+                f"+23480{rnd.randint(10000000, 99999999)}" if i % 3 else ("0803 123" if i % 7 == 0 else ""),
+                "Invoice follow-up, net 30",
+                f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}" if i % 97 else "31/02/2026",
+            ])
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    csv_path = os.path.join(tmp, "contacts.csv")
+    write_csv(csv_path, args.rows)
+    print(f"{args.rows} rows, {os.path.getsize(csv_path) / 1e6:.0f} MB, cpus={os.cpu_count()}")
+
+    import database
+    import import_csv
+    import models_saas
+
+    database.init_db()
+
+    for label, workers in (("inline", 1), (f"pool ({args.workers} workers)", args.workers)):
+        import_csv.IMPORT_WORKERS = workers
+        import_csv.IMPORT_MAX_INFLIGHT = 2 * workers
+        import_csv.IMPORT_PARALLEL_MIN_BYTES = 0
+        # a fresh user per run instead of a big DELETE, which would inflate peak RSS
+        uid = models_saas.create_user("Bench", f"bench{workers}@example.com", "x")
+
+        rejected_path = os.path.join(tmp, f"rejected_{workers}.csv")
+        t0 = time.perf_counter()
+        result = import_csv.import_followups_from_csv(
+            csv_path, uid, MAPPING, mode="insert", errors_path=rejected_path
+        )
+        took = time.perf_counter() - t0
+        print(
+            f"{label:<20} {took:8.2f}s {args.rows / took:10.0f} rows/s  "
+            f"inserted={result['inserted']} rejected={result['rejected']} errors={result['error_count']} "
+            f"sample={len(result['errors'])} rejected_csv={os.path.getsize(rejected_path) / 1e3:.0f}KB "
+            f"peak_rss={_peak_rss_mb():.0f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
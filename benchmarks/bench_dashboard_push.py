@@ -0,0 +1,164 @@
+# benchmarks/bench_dashboard_push.py
+"""
+DB load of open dashboard tabs over one simulated minute.
+
+  before   every tab reloads /dashboard every 30s: the user lookup behind
+           the gates (get_user_cached), list_followups_page, count_done
+  after    tabs sit in their user's Socket.IO room; models_saas publishes
+           status changes (web/live_updates.py) and a tab re-fetches only
+           the changed rows it shows (get_followups_by_ids, one query per
+           500ms batch), like dashboard.html does
+
+Runs "after" twice: idle (no status changes) and with --changes sends
+spread over the minute. SQL statements are counted with a trace callback
+on every connection (pragmas excluded); the mark_* UPDATEs themselves are
+counted separately since they happen with or without tabs open.
+
+    python benchmarks/bench_dashboard_push.py --tabs 500 --users 50
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RELOAD_SECONDS = 30
+BATCH_SECONDS = 0.5
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.n = 0
+
+    def __call__(self, sql: str) -> None:
+        if not sql.lstrip().upper().startswith("PRAGMA"):
+            self.n += 1
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tabs", type=int, default=500)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--followups", type=int, default=200, help="per user")
+    ap.add_argument("--changes", type=int, default=120, help="status changes in the minute")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_dashboard_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    rnd = random.Random(5)
+    uids = [models_saas.create_user(f"U{i}", f"u{i}@example.com", "x") for i in range(args.users)]
+    with database.session() as conn:
+        conn.executemany(
+            """
+            INSERT INTO followups (user_id, client_name, email, followup_type, due_date, created_at, status)
+            VALUES (?, ?, ?, 'invoice', ?, '2026-01-01T00:00:00', ?)
+            """,
+            [
+                (uid, f"Client {i}", f"c{i}@example.com",
+                 f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", rnd.choice(["pending", "scheduled"]))
+                for uid in uids for i in range(args.followups)
+            ],
+        )
+        conn.execute("ANALYZE")
+        fids = defaultdict(list)
+        for fid, uid in conn.execute("SELECT id, user_id FROM followups"):
+            fids[uid].append(fid)
+
+    counter = QueryCounter()
+    connect = database._connect
+
+    def traced_connect(*a, **k):
+        conn = connect(*a, **k)
+        conn.set_trace_callback(counter)
+        return conn
+
+    database._connect = traced_connect
+    database._pool.clear()
+
+    tabs_of = defaultdict(int)
+    for t in range(args.tabs):
+        tabs_of[uids[t % len(uids)]] += 1
+
+    def dashboard(uid: int) -> dict:
+        models_saas.get_user_cached(uid)
+        page = models_saas.list_followups_page(uid)
+        models_saas.count_done(uid)
+        return page
+
+    # rows each user's tabs have on screen (first page)
+    models_saas.invalidate_user_cache()
+    shown = {uid: {f["id"] for f in dashboard(uid)["items"]} for uid in uids}
+
+    # before: every tab reloads twice a minute
+    models_saas.invalidate_user_cache()
+    counter.n = 0
+    t0 = time.perf_counter()
+    requests = 0
+    for _ in range(60 // RELOAD_SECONDS):
+        for uid, n in tabs_of.items():
+            for _ in range(n):
+                dashboard(uid)
+                requests += 1
+    before_took = time.perf_counter() - t0
+    before = counter.n
+
+    # after: tabs only act on pushed changes; one fetch per tab per batch
+    batches: dict[tuple[int, int], set[int]] = defaultdict(set)
+    pushed = [0]
+
+    def tabs_listener(user_id: int, changes: list[dict]) -> None:
+        pushed[0] += 1
+        batches[(user_id, int(clock[0] / BATCH_SECONDS))].update(c["id"] for c in changes)
+
+    models_saas.register_status_listener(tabs_listener)
+    clock = [0.0]
+
+    def run_minute(n_changes: int) -> tuple[int, int, int, float]:
+        batches.clear()
+        pushed[0] = 0
+        counter.n = 0
+        t0 = time.perf_counter()
+        for i in range(n_changes):
+            clock[0] = 60.0 * i / max(n_changes, 1)
+            uid = rnd.choice(uids)
+            models_saas.mark_send_success(rnd.choice(fids[uid]), uid)
+        writes = counter.n
+
+        counter.n = 0
+        fetches = 0
+        for (uid, _), ids in batches.items():
+            visible = ids & shown[uid]
+            if not visible:
+                continue
+            for _ in range(tabs_of[uid]):
+                models_saas.get_followups_by_ids(uid, sorted(visible))
+                fetches += 1
+        return counter.n, writes, fetches, time.perf_counter() - t0
+
+    idle_q, _, _, _ = run_minute(0)
+    push_q, writes, fetches, push_took = run_minute(args.changes)
+    models_saas._status_listeners.remove(tabs_listener)
+    database._connect = connect
+
+    print(f"{args.tabs} tabs over {args.users} users, {args.followups} followups each, one minute")
+    print(f"{'before (reload every 30s)':<34} {requests:6} dashboard loads {before:8} queries/min  "
+          f"({before / requests:.1f}/load, {before_took:.2f}s DB time)")
+    print(f"{'after, idle':<34} {0:6} dashboard loads {idle_q:8} queries/min")
+    print(f"{'after, ' + str(args.changes) + ' status changes':<34} {fetches:6} row fetches    {push_q:8} queries/min  "
+          f"({pushed[0]} events pushed, {writes} mark_* statements not counted, {push_took:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/bench_db_pool.py
+"""
+Connection setup cost + p99 latency, bare sqlite3.connect() vs the pooled
+database.get_connection().
+
+Scenario per "request": the three auth lookups (gate_auth_and_verify,
+gate_billing, inject_globals -> get_user_by_id) plus get_user_followups.
+Requests run back to back in one thread, then each in a fresh thread, or a
+fresh greenlet with --gevent (monkey-patched, as under the
+GeventWebSocketWorker in the Procfile), which is where a per-thread pool
+never gets reused. "connects" counts connections actually opened.
+
+    python benchmarks/bench_db_pool.py --followups 2000 --requests 2000 [--gevent]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _pct(samples: list[float], p: float) -> float:
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+def _report(label: str, samples: list[float]) -> None:
+    print(
+        f"{label:<36} n={len(samples):<6} "
+        f"mean={statistics.mean(samples) * 1e3:8.3f}ms "
+        f"p50={_pct(samples, 0.50) * 1e3:8.3f}ms "
+        f"p99={_pct(samples, 0.99) * 1e3:8.3f}ms"
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--followups", type=int, default=2000)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--gevent", action="store_true", help="one greenlet per request (needs gevent)")
+    args = ap.parse_args()
+
+    if args.gevent:
+        from gevent import monkey
+
+        monkey.patch_all()
+    import threading
+
+    tmp = tempfile.mkdtemp(prefix="bench_db_pool_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    database.ensure_followup_reply_columns()
+
+    uid = models_saas.create_user("Bench", "bench@example.com", "x")
+    with database.session() as conn:
+        conn.executemany(
+            """
+            INSERT INTO followups (user_id, client_name, email, followup_type, due_date, status, created_at)
+            VALUES (?, ?, ?, 'other', '2026-01-01', 'pending', '2026-01-01T00:00:00')
+            """,
+            [(uid, f"Client {i}", f"c{i}@example.com") for i in range(args.followups)],
+        )
+
+    def legacy_connection():
+        # what database.get_connection() used to do
+        return sqlite3.connect(database.DB_PATH)
+
+    def one_request():
+        for _ in range(3):
+            models_saas.get_user_by_id(uid)
+        models_saas.get_user_followups(uid)
+
+    connects = [0]
+    real_connect = database._connect
+
+    def counting_connect(*a, **kw):
+        connects[0] += 1
+        return real_connect(*a, **kw)
+
+    database._connect = counting_connect
+
+    def per_request_worker(fn) -> None:
+        # a fresh thread (a greenlet under --gevent) per request, like the web worker
+        t = threading.Thread(target=fn)
+        t.start()
+        t.join()
+
+    def run(label: str, factory) -> None:
+        models_saas.get_connection = factory
+        database._pool.clear()
+
+        setup = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            factory().close()
+            setup.append(time.perf_counter() - t0)
+
+        lat = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            one_request()
+            lat.append(time.perf_counter() - t0)
+
+        spawned = []
+        before = connects[0]
+
+        def timed_request():
+            t0 = time.perf_counter()
+            one_request()
+            spawned.append(time.perf_counter() - t0)
+
+        for _ in range(args.requests):
+            per_request_worker(timed_request)
+
+        _report(f"{label} connect+close", setup)
+        _report(f"{label} request", lat)
+        _report(f"{label} request, new {'greenlet' if args.gevent else 'thread'}", spawned)
+        if factory is database.get_connection:
+            print(f"{'':<36} pooled connects across {args.requests} fresh workers: {connects[0] - before}")
+
+    original = models_saas.get_connection
+    try:
+        run("before (bare connect)", legacy_connection)
+        run("after (pooled)", database.get_connection)
+    finally:
+        models_saas.get_connection = original
+        database._connect = real_connect
+        database._pool.clear()
+
+
+if __name__ == "__main__":
+    main()
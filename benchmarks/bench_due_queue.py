@@ -0,0 +1,142 @@
+# benchmarks/bench_due_queue.py
+"""
+Scheduler tick DB cost: per-user polling (N+1) vs the global due queue.
+
+Seeds --users users and --followups followups (about --due-pct percent of
+them due now), then times the DB side of one tick both ways:
+
+  before: get_all_users() + per-user due query + per-user mark_schedule_passed
+  after:  get_due_queue() + mark_schedule_passed_all()
+
+    python benchmarks/bench_due_queue.py --users 10000 --followups 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+NOW = "2026-06-01T09:00:00"
+CUTOFF = "2026-06-01T08:58:00"
+
+
+def _seed(database, users: int, followups: int, due_pct: float) -> None:
+    rnd = random.Random(7)
+    with database.session() as conn:
+        conn.executemany(
+            """
+            INSERT INTO users (id, name, email, password_hash, created_at, gmail_token)
+            VALUES (?, ?, ?, 'x', ?, ?)
+            """,
+            [
+                (i, f"User {i}", f"user{i}@example.com", NOW, '{"token": "t"}' if i % 4 == 0 else None)
+                for i in range(1, users + 1)
+            ],
+        )
+
+        batch = []
+        for i in range(followups):
+            due = rnd.random() * 100 < due_pct
+            scheduled = due or rnd.random() < 0.3
+            batch.append((
+                rnd.randint(1, users),
+                f"Client {i}",
+                f"c{i}@example.com",
+                "scheduled" if scheduled else "sent",
+                1 if scheduled else 0,
+                ("2026-06-01T08:30:00" if due else "2026-07-01T09:00:00") if scheduled else None,
+            ))
+            if len(batch) >= 50_000:
+                _insert_followups(conn, batch)
+                batch.clear()
+        if batch:
+            _insert_followups(conn, batch)
+
+        conn.execute("ANALYZE")
+
+
+def _insert_followups(conn, batch) -> None:
+    conn.executemany(
+        """
+        INSERT INTO followups (
+            user_id, client_name, email, followup_type, due_date, created_at,
+            status, schedule_enabled, next_send_at, schedule_repeat
+        )
+        VALUES (?, ?, ?, 'other', '2026-06-01', '2026-01-01T00:00:00', ?, ?, ?, 'daily')
+        """,
+        batch,
+    )
+
+
+def _tick_before(database, models_saas) -> int:
+    due = 0
+    for u in models_saas.get_all_users():
+        conn = database.get_connection()
+        rows = conn.execute(
+            """
+            SELECT *
+            FROM followups
+            WHERE user_id=?
+              AND schedule_enabled=1
+              AND next_send_at IS NOT NULL
+              AND next_send_at <= ?
+              AND status IN ('pending','scheduled')
+            ORDER BY next_send_at ASC
+            LIMIT 50
+            """,
+            (int(u["id"]), NOW),
+        ).fetchall()
+        conn.close()
+        due += len(rows)
+        models_saas.mark_schedule_passed(int(u["id"]), CUTOFF)
+    return due
+
+
+def _tick_after(models_saas) -> int:
+    due = models_saas.get_due_queue(NOW)
+    models_saas.mark_schedule_passed_all(CUTOFF, {int(f["user_id"]) for f in due})
+    return len(due)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--followups", type=int, default=1_000_000)
+    ap.add_argument("--due-pct", type=float, default=0.2)
+    ap.add_argument("--ticks", type=int, default=5)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_due_queue_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    database.ensure_followup_reply_columns()
+
+    t0 = time.perf_counter()
+    _seed(database, args.users, args.followups, args.due_pct)
+    print(f"seeded {args.users} users / {args.followups} followups in {time.perf_counter() - t0:.1f}s")
+
+    for label, tick in (
+        ("before (per-user polling)", lambda: _tick_before(database, models_saas)),
+        ("after (global due queue)", lambda: _tick_after(models_saas)),
+    ):
+        times = []
+        for _ in range(args.ticks):
+            t0 = time.perf_counter()
+            due = tick()
+            times.append(time.perf_counter() - t0)
+        times.sort()
+        print(f"{label:<28} due={due:<6} best={times[0] * 1e3:9.1f}ms median={times[len(times) // 2] * 1e3:9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
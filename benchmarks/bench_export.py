@@ -0,0 +1,163 @@
+# benchmarks/bench_export.py
+"""
+CSV export of --rows followups for one user, peak RSS per approach.
+
+  before   what export_analytics_csv did: fetchall(), csv.writer into a
+           StringIO, one Response(si.getvalue())
+  after    /followups/export/csv: csv_export.response over
+           iter_followups_export (fetchmany cursor, ~64KB chunks), plain
+           and gzip=1, consumed chunk by chunk through the Flask test client
+
+Each approach runs in its own process (ru_maxrss only goes up), and RSS
+growth over the process's baseline is what's reported. The
+streaming runs must stay under --rss-ceiling-mb or the benchmark exits 1.
+
+    python benchmarks/bench_export.py --rows 1000000 --rss-ceiling-mb 64
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _maxrss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def _child(mode: str, uid: int) -> None:
+    import csv
+    from io import StringIO
+
+    from flask import Flask, Response, request
+
+    import database
+    import models_saas
+    from web import csv_export
+
+    app = Flask(__name__)
+
+    @app.route("/before")
+    def before():
+        conn = database.get_connection()
+        rows = conn.execute(
+            f"SELECT {', '.join(models_saas.FOLLOWUP_EXPORT_COLUMNS)} FROM followups WHERE user_id=? ORDER BY created_at, id",
+            (uid,),
+        ).fetchall()
+        conn.close()
+        si = StringIO()
+        cw = csv.writer(si)
+        cw.writerow(models_saas.FOLLOWUP_EXPORT_COLUMNS)
+        for row in rows:
+            cw.writerow(row)
+        return Response(si.getvalue(), mimetype="text/csv")
+
+    @app.route("/after")
+    def after():
+        rows = models_saas.iter_followups_export(uid)
+        return csv_export.response("followups.csv", models_saas.FOLLOWUP_EXPORT_COLUMNS, rows,
+                                   gzip=request.args.get("gzip") == "1")
+
+    @app.route("/ping")
+    def ping():
+        return "ok"
+
+    client = app.test_client()
+    path = {"before": "/before", "after": "/after", "after-gzip": "/after?gzip=1"}[mode]
+
+    # warm up the app, the connection and the first page of the cursor, then take the baseline
+    client.get("/ping")
+    rows = models_saas.iter_followups_export(uid)
+    next(rows)
+    rows.close()
+    base_peak, base = _maxrss_mb(), _rss_mb()
+
+    # growth = the larger of: peak RSS over the baseline peak (catches a
+    # response built in one go), current RSS sampled per chunk over the
+    # baseline (catches growth that stays under an earlier import-time peak)
+    t0 = time.perf_counter()
+    resp = client.get(path, buffered=False)
+    size = chunks = 0
+    high = base
+    for chunk in resp.response:
+        size += len(chunk)
+        chunks += 1
+        high = max(high, _rss_mb())
+    resp.close()
+    took = time.perf_counter() - t0
+    growth = max(_maxrss_mb() - base_peak, high - base)
+    print(f"{took:.3f} {size} {chunks} {base:.1f} {growth:.1f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--rss-ceiling-mb", type=float, default=64, help="max peak RSS growth for streaming exports")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--uid", type=int, default=1, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        _child(args.child, args.uid)
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_export_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    uid = models_saas.create_user("U", "u@example.com", "x")
+    t0 = time.perf_counter()
+    with database.session() as conn:
+        conn.execute(
+            """
+            WITH RECURSIVE k(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM k WHERE i < ?)
+            INSERT INTO followups (user_id, client_name, email, phone, followup_type, description,
+                                   due_date, created_at, status, sent_count, last_sent_at)
+            SELECT
+                ?, 'Client ' || i, 'client' || i || '@example.com', '+23480' || (10000000 + i), 'invoice',
+                'Invoice #' || i || ' for services rendered, "net 30", see attached',
+                date('2024-01-01', '+' || (i % 900) || ' days'),
+                strftime('%Y-%m-%dT%H:%M:%S', julianday('2024-01-01') + i / 1000.0),
+                CASE i % 4 WHEN 0 THEN 'pending' WHEN 1 THEN 'sent' WHEN 2 THEN 'scheduled' ELSE 'done' END,
+                i % 5,
+                CASE WHEN i % 4 = 1 THEN strftime('%Y-%m-%dT%H:%M:%S', julianday('2024-06-01') + i / 1000.0) END
+            FROM k
+            """,
+            (args.rows, uid),
+        )
+    print(f"{args.rows:,} followups generated in {time.perf_counter() - t0:.1f}s; ceiling +{args.rss_ceiling_mb:.0f}MB")
+    print(f"{'mode':<12} {'seconds':>8} {'rows/s':>10} {'bytes':>14} {'chunks':>8} {'base RSS':>10} {'RSS growth':>12}")
+
+    failed = False
+    for mode in ("before", "after", "after-gzip"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--uid", str(uid)],
+            env=dict(os.environ), capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        took, size, chunks, base, growth = out.split()
+        took, growth = float(took), float(growth)
+        over = mode != "before" and growth > args.rss_ceiling_mb
+        failed |= over
+        print(f"{mode:<12} {took:8.2f} {args.rows / took:10,.0f} {int(size):14,} {int(chunks):8,} "
+              f"{float(base):8.1f}MB {growth:+10.1f}MB{'  OVER CEILING' if over else ''}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
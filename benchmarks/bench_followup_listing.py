@@ -0,0 +1,112 @@
+# benchmarks/bench_followup_listing.py
+"""
+Dashboard listing for a large account: get_user_followups (every row, CASE/
+COALESCE sort) vs list_followups_page (one keyset page, index seek), for the
+first page and for a page deep in the list. Also walks every page and checks
+it returns the same rows, in order, as one unbounded query.
+
+    python benchmarks/bench_followup_listing.py --followups 50000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _ms(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1e3 / repeat
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--followups", type=int, default=50000)
+    ap.add_argument("--page-size", type=int, default=50)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_listing_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+
+    database.init_db()
+    uid = models_saas.create_user("Bench", "bench@example.com", "x")
+    other = models_saas.create_user("Other", "other@example.com", "x")
+
+    rnd = random.Random(7)
+    statuses = ["draft", "pending", "scheduled", "sent", "failed", "replied", "done"]
+    rows = []
+    for i in range(args.followups):
+        owner = uid if i % 5 else other
+        next_send = f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T09:00:00" if rnd.random() < 0.5 else None
+        rows.append((
+            owner, f"Client {i}", f"c{i}@example.com", rnd.choice(["invoice", "proposal", "other"]),
+            f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", "2026-01-01T00:00:00",
+            rnd.choice(statuses), next_send, rnd.choice(["email", "whatsapp"]),
+        ))
+    with database.session() as conn:
+        conn.executemany(
+            """
+            INSERT INTO followups (
+                user_id, client_name, email, followup_type, due_date, created_at,
+                status, next_send_at, preferred_channel
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        conn.execute("ANALYZE")
+
+    full = models_saas.get_user_followups(uid)
+
+    # cursor for a page ~90% of the way down
+    page = models_saas.list_followups_page(uid, limit=models_saas.LIST_MAX_PAGE_SIZE)
+    walked = list(page["items"])
+    deep_cursor = None
+    while page["next_cursor"]:
+        if deep_cursor is None and len(walked) >= len(full) * 0.9:
+            deep_cursor = page["next_cursor"]
+        page = models_saas.list_followups_page(uid, cursor=page["next_cursor"], limit=models_saas.LIST_MAX_PAGE_SIZE)
+        walked.extend(page["items"])
+
+    def expected_order(f):
+        return (0 if f["status"] == "draft" else 1, f["next_send_at"] or f["due_date"], f["id"])
+
+    same = [f["id"] for f in walked] == [f["id"] for f in sorted(full, key=expected_order)]
+
+    with database.session() as conn:
+        plan = conn.execute(
+            """
+            EXPLAIN QUERY PLAN
+            SELECT id FROM followups
+            WHERE user_id=? AND (list_rank, list_due, id) > (1, '2026-06', 0)
+            ORDER BY list_rank, list_due, id LIMIT 50
+            """,
+            (uid,),
+        ).fetchall()
+
+    print(f"user rows={len(full)} (of {args.followups}), page size={args.page_size}")
+    print(f"{'get_user_followups (all rows)':<36} {_ms(lambda: models_saas.get_user_followups(uid), args.repeat):9.2f}ms")
+    print(f"{'list_followups_page (first page)':<36} "
+          f"{_ms(lambda: models_saas.list_followups_page(uid, limit=args.page_size), args.repeat):9.2f}ms")
+    print(f"{'list_followups_page (90% down)':<36} "
+          f"{_ms(lambda: models_saas.list_followups_page(uid, cursor=deep_cursor, limit=args.page_size), args.repeat):9.2f}ms")
+    print(f"{'list_followups_page (status=failed)':<36} "
+          f"{_ms(lambda: models_saas.list_followups_page(uid, statuses=['failed'], limit=args.page_size), args.repeat):9.2f}ms")
+    print("plan:", plan[0][-1])
+    print("walked all pages in order:", same, f"({len(walked)} rows)")
+
+
+if __name__ == "__main__":
+    main()
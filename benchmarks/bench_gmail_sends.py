@@ -0,0 +1,109 @@
+# benchmarks/bench_gmail_sends.py
+"""
+Gmail sends/sec: build("gmail", "v1") + save token per message (old path)
+vs the cached per-user service in gmail_sync.
+
+Runs against a local fake Gmail HTTP server, so it measures client overhead
+(discovery parsing, credential setup, token writes), not Google.
+
+    python benchmarks/bench_gmail_sends.py --sends 500 --threads 4
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class _FakeGmail(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    counter = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with _FakeGmail.lock:
+            _FakeGmail.counter += 1
+            n = _FakeGmail.counter
+        body = json.dumps({"id": f"m{n}", "threadId": f"t{n}"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sends", type=int, default=500)
+    ap.add_argument("--threads", type=int, default=4)
+    args = ap.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeGmail)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tmp = tempfile.mkdtemp(prefix="bench_gmail_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    os.environ["GMAIL_API_ENDPOINT"] = f"http://127.0.0.1:{server.server_port}/"
+
+    import database
+    import models_saas
+    import gmail_sync
+    from googleapiclient.discovery import build_from_document
+
+    database.init_db()
+    uid = models_saas.create_user("Bench", "bench@example.com", "x")
+    token = {
+        "token": "fake-access-token",
+        "refresh_token": "fake-refresh-token",
+        "client_id": "bench",
+        "client_secret": "bench",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "expiry": "2099-01-01T00:00:00Z",
+    }
+    models_saas.save_gmail_token(uid, json.dumps(token))
+    user = models_saas.get_user_by_id(uid)
+
+    endpoint = {"api_endpoint": os.environ["GMAIL_API_ENDPOINT"]}
+
+    def send_before(i: int) -> None:
+        # what send_email_gmail used to do: fetch discovery + build + save per message
+        # (build() would hit the network for discovery; the static doc is the
+        # best case for it, so this understates the old cost)
+        creds = gmail_sync._creds_from_user(user)
+        doc = gmail_sync.discovery_cache.get_static_doc("gmail", "v1")
+        service = build_from_document(doc, credentials=creds, client_options=endpoint)
+        service.users().messages().send(userId="me", body={"raw": "eA"}).execute()
+        gmail_sync._save_refreshed_token(uid, creds)
+
+    def send_after(i: int) -> None:
+        service = gmail_sync._service_for_user(user)
+        service.users().messages().send(userId="me", body={"raw": "eA"}).execute()
+        gmail_sync.persist_refreshed_token(user)
+
+    for label, fn in (("before (build per send)", send_before), ("after (cached service)", send_after)):
+        fn(0)  # warm up
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(fn, range(args.sends)))
+        took = time.perf_counter() - t0
+        print(f"{label:<28} sends={args.sends:<6} {args.sends / took:9.1f} sends/s  ({took * 1e3 / args.sends:.2f}ms/send)")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# benchmarks/bench_outbox.py
+"""
+Outbox throughput and recovery with a fake sender (no Gmail, no followups).
+
+  throughput: --items sends of --latency ms each, drained with 1/4/8/16 workers
+  recovery:   a "crashed" worker leaves half the items leased (some after the
+              provider already accepted them); once the lease runs out they
+              are reclaimed, and every item is sent and completed exactly once
+  retries:    a flaky sender fails the first attempts; permanently failing
+              items end up dead with fail() called once
+  skipped:    an item whose handler had nothing to send is enqueued again
+              under the same key (followup reopened) and is sent this time
+
+    python benchmarks/bench_outbox.py --items 2000 --latency 20
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeSender:
+    def __init__(self, latency: float, fail_first: int = 0, always_fail: set[int] | None = None):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.always_fail = always_fail or set()
+        self.lock = threading.Lock()
+        self.sends: Counter = Counter()
+        self.attempts: Counter = Counter()
+        self.completed: Counter = Counter()
+        self.failed: Counter = Counter()
+
+    def send(self, item):
+        n = item["payload"]["n"]
+        with self.lock:
+            self.attempts[n] += 1
+            attempt = self.attempts[n]
+        time.sleep(self.latency)
+        if n in self.always_fail or attempt <= self.fail_first:
+            raise RuntimeError("fake provider error")
+        with self.lock:
+            self.sends[n] += 1
+        return {"message_id": f"m{n}"}
+
+    def complete(self, item, result):
+        with self.lock:
+            self.completed[item["payload"]["n"]] += 1
+
+    def fail(self, item, error):
+        with self.lock:
+            self.failed[item["payload"]["n"]] += 1
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=2000)
+    ap.add_argument("--latency", type=float, default=20, help="fake send latency, ms")
+    ap.add_argument("--users", type=int, default=200)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_outbox_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    from flask import Flask
+    from web import outbox
+
+    logging.getLogger("outbox").setLevel(logging.ERROR)  # the retry run fails on purpose
+    database.init_db()
+    with database.session() as conn:
+        conn.executemany(
+            "INSERT INTO users (id, name, email, password_hash, created_at) VALUES (?, ?, ?, 'x', '2026-01-01T00:00:00')",
+            [(i, f"User {i}", f"user{i}@example.com") for i in range(1, args.users + 1)],
+        )
+    app = Flask("bench_outbox")
+    latency = args.latency / 1000.0
+    outbox.OUTBOX_PER_USER = 4
+
+    def fresh(prefix: str, sender: FakeSender, n: int) -> None:
+        with database.session() as conn:
+            conn.execute("DELETE FROM outbox")
+        outbox.register_handler(
+            "bench", send=sender.send, complete=sender.complete, fail=sender.fail, rate_limited=False
+        )
+        for i in range(n):
+            outbox.enqueue(1 + i % args.users, None, "bench", {"n": i}, f"{prefix}:{i}")
+
+    def drain_all(max_seconds: float = 600) -> float:
+        t0 = time.perf_counter()
+        while outbox.drain(app, max_seconds=max_seconds):
+            pass
+        return time.perf_counter() - t0
+
+    # ---- throughput ----
+    print(f"inline baseline (1 send at a time): ~{1 / latency:.0f} sends/s")
+    for workers in (1, 4, 8, 16):
+        sender = FakeSender(latency)
+        fresh(f"tp{workers}", sender, args.items)
+        outbox.OUTBOX_WORKERS = workers
+        outbox._pool = outbox.ThreadPoolExecutor(max_workers=workers)
+        took = drain_all()
+        print(
+            f"workers={workers:<3} items={args.items:<6} {args.items / took:8.1f} sends/s  "
+            f"sent_once={all(v == 1 for v in sender.sends.values()) and len(sender.sends) == args.items}"
+        )
+
+    # ---- recovery after a crash ----
+    outbox.OUTBOX_VISIBILITY_SECONDS = 1.0
+    sender = FakeSender(latency / 4)
+    n = min(args.items, 1000)
+    fresh("crash", sender, n)
+
+    crashed = outbox.claim(n // 2, worker_id="crashed-worker")
+    for item in crashed[: len(crashed) // 2]:
+        # provider accepted these, then the worker died before completing
+        sender.sends[item["payload"]["n"]] += 1
+        outbox.record_result(item, {"message_id": "accepted-before-crash"})
+
+    drain_all()  # leased items are invisible until the lease expires
+    time.sleep(outbox.OUTBOX_VISIBILITY_SECONDS + 0.1)
+    drain_all()
+
+    st = outbox.stats()
+    print(
+        f"recovery: crashed_leases={len(crashed)} done={st.get('done', 0)}/{n} "
+        f"double_sends={sum(1 for v in sender.sends.values() if v > 1)} "
+        f"completed_once={all(sender.completed[i] == 1 for i in range(n))}"
+    )
+
+    # ---- retries / dead letters ----
+    outbox.OUTBOX_BACKOFF_SECONDS = 0.05
+    outbox.OUTBOX_BACKOFF_MAX_SECONDS = 0.2
+    always = set(range(0, 100, 10))
+    sender = FakeSender(0, fail_first=2, always_fail=always)
+    fresh("retry", sender, 100)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        drain_all()
+        st = outbox.stats()
+        if not st.get("queued") and not st.get("inflight"):
+            break
+        time.sleep(0.05)
+
+    print(
+        f"retries: done={st.get('done', 0)} dead={st.get('dead', 0)} "
+        f"fail_called_once={all(sender.failed[i] == 1 for i in always) and len(sender.failed) == len(always)} "
+        f"max_attempts_seen={max(sender.attempts.values())}"
+    )
+
+    # ---- skipped, then the same key again ----
+    nothing = {"send": False}
+
+    def maybe_send(item):
+        return sender.send(item) if nothing["send"] else None
+
+    sender = FakeSender(0)
+    fresh("skip", sender, 0)
+    outbox.register_handler("bench", send=maybe_send, complete=sender.complete, rate_limited=False)
+    outbox.enqueue(1, None, "bench", {"n": 0}, "skip:0")
+    drain_all()
+    first = outbox.stats().get("skipped", 0)
+    nothing["send"] = True
+    item_id = outbox.enqueue(1, None, "bench", {"n": 0}, "skip:0")
+    drain_all()
+    print(
+        f"skipped: first_run_skipped={first == 1} requeued_and_sent={sender.sends[0] == 1} "
+        f"status={outbox.get_item(item_id)['status']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
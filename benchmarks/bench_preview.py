@@ -0,0 +1,152 @@
+# benchmarks/bench_preview.py
+"""
+Live preview under many concurrent editors: what /preview/<fid>/render-email
+did per request (get_followup + build_branded_email_html, reading template
+and branding each time, full document back) vs web/preview_cache (cached
+followup row and renderer, render cache by content hash with single flight,
+diff against the client's document).
+
+Each editor is a thread that, after an exponential pause (--think, the
+debounced keystroke rate), types a few characters into message_override
+(new content), undoes the last edit (content seen before), or toggles
+html/raw and back. Latency is per request, server side; bytes is what the
+response would carry.
+
+    python benchmarks/bench_preview.py --editors 300 --seconds 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--editors", type=int, default=300)
+    ap.add_argument("--users", type=int, default=60)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--think", type=float, default=1.0, help="mean seconds between an editor's requests")
+    args = ap.parse_args()
+
+    warnings.simplefilter("ignore")  # raw policy allows style without a css_sanitizer, as it always has
+
+    tmp = tempfile.mkdtemp(prefix="bench_preview_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+    from email_scheduler import branded_renderer, build_branded_email_html
+    from scheduler_render import DEFAULT_SCHEDULER_TEMPLATE, render_scheduler_html
+    from web import preview_cache
+
+    database.init_db()
+    users = []
+    for i in range(args.users):
+        uid = models_saas.create_user(f"U{i}", f"u{i}@example.com", "x")
+        models_saas.set_branding(uid, "https://example.com/logo.png", "#0f766e", f"Company {i}", "help@example.com")
+        users.append(models_saas.get_user_by_id(uid))
+    with database.session() as conn:
+        for u in users:
+            conn.execute(
+                """
+                INSERT INTO followups (user_id, client_name, email, followup_type, description, due_date, created_at, status)
+                VALUES (?, 'Client', 'client@example.com', 'invoice', 'Invoice #1042', '2026-03-25', '2026-01-01', 'pending')
+                """,
+                (u["id"],),
+            )
+        fid_of = {r[1]: r[0] for r in conn.execute("SELECT id, user_id FROM followups")}
+
+    def preview_f(f: dict, data: dict) -> dict:
+        out = dict(f)
+        out["message_override"] = data["message_override"]
+        out["email_format"] = data["email_format"]
+        out["preferred_channel"] = "email"
+        return out
+
+    def before(user: dict, data: dict) -> int:
+        fid = fid_of[user["id"]]
+        f = models_saas.get_followup(fid, user["id"])
+        tmpl = (models_saas.get_scheduler_template(user["id"]) or "").strip() or DEFAULT_SCHEDULER_TEMPLATE
+        branding = models_saas.get_branding(user["id"]) or {}
+        html_doc = render_scheduler_html(tmpl, user, preview_f(f, data), branding).strip()
+        return len(html_doc.encode())
+
+    def after(user: dict, data: dict) -> int:
+        fid = fid_of[user["id"]]
+        f = preview_cache.followup_row(user["id"], fid, lambda: models_saas.get_followup(fid, user["id"]))
+        pf = preview_f(f, data)
+        renderer = branded_renderer(user)
+        etag, html_doc = preview_cache.render(
+            user["id"], fid, preview_cache.content_key(renderer.key, pf),
+            lambda: build_branded_email_html(user, pf, renderer),
+        )
+        out = preview_cache.body(user["id"], etag, html_doc, data["base"])
+        data["base"] = etag
+        return len(json.dumps(out).encode())
+
+    words = "thanks for your patience, the invoice is attached and due on friday".split()
+
+    def run(label: str, handler) -> None:
+        latencies: list[float] = []
+        sizes: list[int] = []
+        lock = threading.Lock()
+        stop = time.monotonic() + args.seconds
+
+        def editor(n: int) -> None:
+            rnd = random.Random(n)
+            user = users[n % len(users)]
+            history = [f"Hi, editor {n} here."]
+            data = {"message_override": history[-1], "email_format": "html", "base": None}
+            while True:
+                time.sleep(rnd.expovariate(1 / args.think))
+                if time.monotonic() > stop:
+                    return
+                r = rnd.random()
+                if r < 0.7:
+                    history.append(history[-1] + " " + rnd.choice(words))
+                elif r < 0.9 and len(history) > 1:
+                    history.pop()
+                else:
+                    data["email_format"] = "raw" if data["email_format"] == "html" else "html"
+                data["message_override"] = history[-1]
+                t0 = time.perf_counter()
+                size = handler(user, data)
+                took = time.perf_counter() - t0
+                with lock:
+                    latencies.append(took * 1e3)
+                    sizes.append(size)
+
+        threads = [threading.Thread(target=editor, args=(n,)) for n in range(args.editors)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        print(
+            f"{label:<8} requests={len(latencies):<6} p50={_pct(latencies, 0.5):6.2f}ms p95={_pct(latencies, 0.95):6.2f}ms "
+            f"p99={_pct(latencies, 0.99):6.2f}ms  avg response={sum(sizes) / max(len(sizes), 1) / 1024:5.1f}KB"
+        )
+
+    print(f"{args.editors} editors over {args.users} users, ~{args.editors / args.think:.0f} req/s offered, {args.seconds:.0f}s each")
+    run("before", before)
+    run("after", after)
+    print("cache:", preview_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# benchmarks/bench_reply_detection.py
+"""
+Reply detection HTTP round-trips: one threads.get(format="full") per tracked
+followup (old path) vs check_replies_for_user's batched metadata fetch, and
+then the history-delta check that follows once a checkpoint exists.
+
+Runs against a local fake Gmail server that answers both single calls and
+multipart /batch calls. Every --reply-every'th thread has a reply from the
+recipient; the script checks both paths find the same replies.
+
+    python benchmarks/bench_reply_detection.py --followups 500
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER_EMAIL = "owner@example.com"
+BODY_PADDING = "x" * 4000  # stand-in for message bodies in format=full
+
+
+def _thread(thread_id: str, fmt: str, reply_every: int) -> dict:
+    n = int(thread_id[1:])
+    messages = [{
+        "id": f"sent{n}",
+        "payload": {"headers": [{"name": "From", "value": USER_EMAIL}, {"name": "Subject", "value": "Hi"}]},
+    }]
+    if n % reply_every == 0:
+        messages.append({
+            "id": f"reply{n}",
+            "payload": {"headers": [
+                {"name": "From", "value": f"Client {n} <c{n}@example.com>"},
+                {"name": "Subject", "value": "Re: Hi"},
+                {"name": "Date", "value": "Mon, 1 Jun 2026 09:00:00 +0000"},
+            ]},
+        })
+    if fmt == "full":
+        for m in messages:
+            m["payload"]["body"] = {"data": BODY_PADDING}
+    return {"id": thread_id, "messages": messages}
+
+
+class _FakeGmail(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    reply_every = 10
+    changed: list[int] = []
+    http_calls = 0
+    thread_gets = 0
+    lock = threading.Lock()
+
+    def _count(self, gets: int) -> None:
+        with _FakeGmail.lock:
+            _FakeGmail.http_calls += 1
+            _FakeGmail.thread_gets += gets
+
+    def _reply(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _thread_for_path(self, path: str) -> dict:
+        url = urlparse(path)
+        thread_id = url.path.rsplit("/", 1)[-1]
+        fmt = (parse_qs(url.query).get("format") or ["full"])[0]
+        return _thread(thread_id, fmt, self.reply_every)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith("/profile"):
+            body = {"emailAddress": USER_EMAIL, "historyId": "1000"}
+            self._count(0)
+        elif url.path.endswith("/history"):
+            # the --changed most recent reply threads are "new since the checkpoint"
+            body = {
+                "history": [
+                    {"id": "1001", "messagesAdded": [{"message": {"id": f"reply{n}", "threadId": f"t{n}"}}]}
+                    for n in self.changed
+                ],
+                "historyId": "1001",
+            }
+            self._count(0)
+        else:
+            body = self._thread_for_path(self.path)
+            self._count(1)
+        self._reply(json.dumps(body).encode(), "application/json")
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers["Content-Type"]).group(1)
+
+        out = []
+        parts = [p for p in raw.split("--" + boundary) if "Content-ID" in p]
+        for part in parts:
+            content_id = re.search(r"Content-ID: <([^>]+)>", part).group(1)
+            path = re.search(r"^GET (\S+) HTTP", part, re.M).group(1)
+            payload = json.dumps(self._thread_for_path(path))
+            out.append(
+                f"--resp\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n{payload}\r\n"
+            )
+        out.append("--resp--\r\n")
+        self._count(len(parts))
+        self._reply("".join(out).encode(), "multipart/mixed; boundary=resp")
+
+    def log_message(self, *args):
+        pass
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--followups", type=int, default=500)
+    ap.add_argument("--reply-every", type=int, default=10)
+    ap.add_argument("--changed", type=int, default=5, help="threads with new mail since the checkpoint")
+    args = ap.parse_args()
+
+    _FakeGmail.reply_every = args.reply_every
+    _FakeGmail.changed = list(range(args.reply_every, args.followups + 1, args.reply_every))[-args.changed:]
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeGmail)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tmp = tempfile.mkdtemp(prefix="bench_replies_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    os.environ["GMAIL_API_ENDPOINT"] = f"http://127.0.0.1:{server.server_port}/"
+
+    import database
+    import models_saas
+    import gmail_sync
+
+    database.init_db()
+    database.ensure_followup_reply_columns()
+
+    uid = models_saas.create_user("Bench", USER_EMAIL, "x")
+    models_saas.save_gmail_token(uid, json.dumps({
+        "token": "fake-access-token",
+        "refresh_token": "fake-refresh-token",
+        "client_id": "bench",
+        "client_secret": "bench",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "expiry": "2099-01-01T00:00:00Z",
+    }))
+    user = models_saas.get_user_by_id(uid)
+
+    def seed() -> None:
+        with database.session() as conn:
+            conn.execute("DELETE FROM followups")
+            conn.executemany(
+                """
+                INSERT INTO followups (
+                    user_id, client_name, email, followup_type, due_date, created_at,
+                    status, gmail_thread_id, last_sent_message_id
+                )
+                VALUES (?, ?, ?, 'other', '2026-06-01', '2026-01-01T00:00:00', 'sent', ?, ?)
+                """,
+                [
+                    (uid, f"Client {i}", f"c{i}@example.com", f"t{i}", f"sent{i}")
+                    for i in range(1, args.followups + 1)
+                ],
+            )
+
+    def check_before() -> list:
+        # the pre-batching loop: one threads.get(format="full") per followup
+        service = gmail_sync._service_for_user(user)
+        found = []
+        for f in models_saas.get_reply_tracked_followups(uid):
+            thread = service.users().threads().get(userId="me", id=f["gmail_thread_id"], format="full").execute()
+            if gmail_sync._find_reply_in_thread(f, thread, USER_EMAIL):
+                found.append(f["email"])
+        return found
+
+    def check_after() -> list:
+        models_saas.save_gmail_history_id(uid, None)
+        return [r["recipient_email"] for r in gmail_sync.check_replies_for_user(user)]
+
+    def check_incremental() -> list:
+        # checkpoint left behind by check_after(); only --changed threads moved since
+        return [r["recipient_email"] for r in gmail_sync.check_replies_for_user(user)]
+
+    results = {}
+    for label, fn in (
+        ("before (threads.get full)", check_before),
+        ("after (batched metadata)", check_after),
+        ("after (history delta)", check_incremental),
+    ):
+        seed()
+        _FakeGmail.http_calls = _FakeGmail.thread_gets = 0
+        t0 = time.perf_counter()
+        results[label] = sorted(fn())
+        took = time.perf_counter() - t0
+        print(
+            f"{label:<28} threads={_FakeGmail.thread_gets:<6} http_calls={_FakeGmail.http_calls:<6} "
+            f"replies={len(results[label]):<5} {took * 1e3:9.1f}ms"
+        )
+
+    before, after, incremental = results.values()
+    print("same replies found:", before == after)
+    print("delta found the changed threads:", incremental == sorted(f"c{n}@example.com" for n in _FakeGmail.changed))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
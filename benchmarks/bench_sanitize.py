@@ -0,0 +1,122 @@
+# benchmarks/bench_sanitize.py
+"""
+Sanitizing in render_scheduler_html: bleach.clean() with the policy built on
+every call (the old path) vs scheduler_render.sanitize (one Cleaner per
+thread, outputs memoized by content hash).
+
+A campaign sends the same message_override to every recipient, so the
+end-to-end runs use one message for --recipients followups, once in branded
+mode ({{content}}) and once in raw mode; then with a different message per
+recipient (no memo hits, so only the Cleaner reuse counts).
+_wrap_personal_message is timed on its own too (old: sanitize the fragment,
+wrap, sanitize the whole thing).
+Checks both paths produce the same HTML.
+
+    python benchmarks/bench_sanitize.py --recipients 5000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import warnings  # noqa: E402
+
+import bleach  # noqa: E402
+from bleach.css_sanitizer import CSSSanitizer  # noqa: E402
+
+import scheduler_render as sr  # noqa: E402
+
+warnings.simplefilter("ignore")  # raw policy allows style without a css_sanitizer, as it always has
+
+MESSAGE = """Hi there,
+
+Just a reminder that <b>invoice #4821</b> is due on <i>March 25</i>.
+You can pay online here: <a href="https://pay.example.com/4821" target="_blank">pay now</a>.
+<script>alert(1)</script>
+<ul><li>Amount: $1,250.00</li><li>Terms: net 30</li></ul>
+Thanks!"""
+
+RAW = """<html><head><title>Invoice</title></head><body>
+<div style="font-family: Arial; color: #111"><h2>Invoice #4821</h2>
+<p>Hi there, your invoice is due on <b>March 25</b>.</p>
+<table><tr><th>Item</th><th>Amount</th></tr><tr><td>Design work</td><td>$1,250.00</td></tr></table>
+<img src="https://example.com/logo.png" alt="logo" onerror="x()">
+<p><a href="https://pay.example.com/4821">Pay now</a></p></div></body></html>"""
+
+
+def _old_sanitize(html: str, policy: str = "html") -> str:
+    p = dict(sr._SANITIZE_POLICIES[policy])
+    if "css_sanitizer" in p:
+        p["css_sanitizer"] = CSSSanitizer(allowed_css_properties=list(sr._ALLOWED_CSS))
+    return bleach.clean(html, **p)
+
+
+def _old_wrap(inner_html: str) -> str:
+    return _old_sanitize(sr.PERSONAL_MESSAGE_WRAPPER.replace("{{content}}", inner_html))
+
+
+def _followup(i: int, fmt: str) -> dict:
+    return {
+        "client_name": f"Client {i}",
+        "followup_type": "invoice",
+        "description": f"Invoice #{i}",
+        "due_date": "2026-03-25",
+        "email_format": fmt,
+        "message_override": RAW if fmt == "raw" else MESSAGE,
+    }
+
+
+def _run(label: str, n: int, fn) -> tuple[float, list]:
+    out = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        out.append(fn(i))
+    took = time.perf_counter() - t0
+    print(f"{label:<36} {took * 1e6 / n:8.1f} us/render {n / took:10.0f} renders/s")
+    return took, out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--recipients", type=int, default=5000)
+    args = ap.parse_args()
+
+    n = args.recipients
+    tmpl = sr.DEFAULT_SCHEDULER_TEMPLATE
+    user = {"id": 1}
+    branding = {"company_name": "Acme", "support_email": "help@example.com"}
+
+    def render(fmt):
+        return lambda i: sr.render_scheduler_html(tmpl, user, _followup(i, fmt), branding)
+
+    for fmt in ("html", "raw"):
+        with mock.patch.object(sr, "sanitize", _old_sanitize):
+            before, old = _run(f"before ({fmt}, clean per call)", n, render(fmt))
+        after, new = _run(f"after ({fmt}, memoized)", n, render(fmt))
+        print(f"speedup: {before / after:.1f}x  same output: {old == new}")
+
+    # every recipient gets a different message: no memo hits, only the
+    # Cleaner reuse helps
+    def unique(i):
+        return sr.sanitize(f"{MESSAGE} #{i}".replace("\n", "<br>"), "content")
+
+    with mock.patch.object(sr, "sanitize", _old_sanitize):
+        before, old = _run("before (unique messages)", n, unique)
+    after, new = _run("after (unique messages)", n, unique)
+    print(f"speedup: {before / after:.1f}x  same output: {old == new}")
+
+    fragment = sr._sanitize_html(MESSAGE.replace("\n", "<br>"))
+    before, old = _run("before (_wrap_personal_message)", n, lambda i: _old_wrap(fragment))
+    after, new = _run("after (_wrap_personal_message)", n, lambda i: sr._wrap_personal_message(fragment))
+    print(f"speedup: {before / after:.1f}x  same output: {old == new}")
+    print("cache:", sr.sanitize_cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/bench_template_render.py
+"""
+Scheduler template rendering, 10k renders of the default template with a
+different followup each time: the line/regex pass on every render
+(_render_conditionals + _render_vars, the old path) vs the compiled template
+from the (user_id, hash) cache. Also times render_scheduler_html end to end
+and checks both paths produce the same HTML.
+
+    python benchmarks/bench_template_render.py --renders 10000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import scheduler_render as sr  # noqa: E402
+
+
+def _data(i: int) -> dict:
+    return {
+        "name": f"Client {i}",
+        "type": "invoice follow-up",
+        "description": "Just checking in about invoice #{}".format(i),
+        "due_date": "2026-03-25",
+        "sender": "Acme",
+        "company_name": "Acme",
+        "brand_logo": "https://example.com/logo.png" if i % 2 else "",
+        "support_email": "help@example.com",
+        "footer": "Need help? Contact help@example.com",
+        "content": "",
+    }
+
+
+def _run(label: str, n: int, fn) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    took = time.perf_counter() - t0
+    print(f"{label:<36} {took * 1e6 / n:8.1f} us/render {n / took:10.0f} renders/s")
+    return took
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--renders", type=int, default=10000)
+    ap.add_argument("--users", type=int, default=50)
+    args = ap.parse_args()
+
+    tmpl = sr.DEFAULT_SCHEDULER_TEMPLATE
+    rows = [_data(i) for i in range(args.renders)]
+
+    same = all(
+        sr._render_vars(sr._render_conditionals(tmpl, d), d) == sr.compile_template(tmpl).render(d)
+        for d in rows[:200]
+    )
+
+    before = _run("line/regex pass per render", args.renders,
+                  lambda i: sr._render_vars(sr._render_conditionals(tmpl, rows[i]), rows[i]))
+    _run("compile per render (no cache)", args.renders,
+         lambda i: sr.compile_template(tmpl).render(rows[i]))
+    after = _run(f"cached compiled ({args.users} users)", args.renders,
+                 lambda i: sr.get_compiled_template(i % args.users, tmpl).render(rows[i]))
+    print(f"speedup: {before / after:.1f}x  same output: {same}  cache: {sr.template_cache_stats()}")
+
+    branding = {"company_name": "Acme", "support_email": "help@example.com"}
+    _run("render_scheduler_html (end to end)", args.renders,
+         lambda i: sr.render_scheduler_html(
+             tmpl, {"id": i % args.users}, {"client_name": f"Client {i}", "followup_type": "invoice"}, branding
+         ))
+
+
+if __name__ == "__main__":
+    main()
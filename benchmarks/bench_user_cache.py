@@ -0,0 +1,90 @@
+# benchmarks/bench_user_cache.py
+"""
+/dashboard requests/sec with the request-scoped user loader + process user
+cache (current_user / get_user_cached) vs a users-table read on every call
+(what the auth gate, billing gates, inject_globals and require_user used to
+do, 4-5 times per request).
+
+Uses the Flask test client, so it measures app overhead, not the network.
+
+    python benchmarks/bench_user_cache.py --requests 2000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--followups", type=int, default=20)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_user_cache_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import database
+    import models_saas
+    import web.app as web_app
+
+    database.init_db()
+    uid = models_saas.create_user("Bench", "bench@example.com", "x")
+    with database.session() as conn:
+        conn.execute("UPDATE users SET email_verified=1, is_subscribed=1, subscription_status='active' WHERE id=?", (uid,))
+        conn.executemany(
+            """
+            INSERT INTO followups (user_id, client_name, email, followup_type, due_date, created_at, status)
+            VALUES (?, ?, ?, 'other', '2026-06-01', '2026-01-01T00:00:00', 'pending')
+            """,
+            [(uid, f"Client {i}", f"c{i}@example.com") for i in range(args.followups)],
+        )
+    models_saas.invalidate_user_cache()
+
+    app = web_app.app
+    app.config["TESTING"] = True
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"] = uid
+
+    reads = {"n": 0}
+    real_get_user_by_id = models_saas.get_user_by_id
+
+    def counting_get_user_by_id(user_id):
+        reads["n"] += 1
+        return real_get_user_by_id(user_id)
+
+    models_saas.get_user_by_id = counting_get_user_by_id
+    web_app.get_user_by_id = counting_get_user_by_id
+    cached_loader = web_app.current_user
+
+    def uncached_loader():
+        uid = web_app.session.get("user_id")
+        return counting_get_user_by_id(int(uid)) if uid else None
+
+    for label, loader in (("before (read per call)", uncached_loader), ("after (g + TTL cache)", cached_loader)):
+        web_app.current_user = loader
+        models_saas.invalidate_user_cache()
+        assert client.get("/dashboard").status_code == 200  # warm up
+
+        reads["n"] = 0
+        t0 = time.perf_counter()
+        for _ in range(args.requests):
+            client.get("/dashboard")
+        took = time.perf_counter() - t0
+        print(
+            f"{label:<24} requests={args.requests:<6} {args.requests / took:8.1f} req/s  "
+            f"user reads/request={reads['n'] / args.requests:.2f}"
+        )
+
+    web_app.current_user = cached_loader
+
+
+if __name__ == "__main__":
+    main()
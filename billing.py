@@ -11,6 +11,7 @@ from flask import Blueprint, request, redirect, url_for, flash, render_template,
 from database import get_connection
 from models_saas import (
     get_user_by_id,
+    invalidate_user_cache,
     is_trial_active,
 )
 
@@ -162,6 +163,7 @@ def _db_set_subscription_state(
 
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 def _db_mark_trial_upgraded(user_id: int):
     conn = get_connection()
@@ -174,6 +176,7 @@ def _db_mark_trial_upgraded(user_id: int):
     """, (int(user_id),))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 def _find_user_id_by_email(email: str) -> int | None:
@@ -1,7 +1,11 @@
 # database.py
+import atexit
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Iterator
 
 # -----------------------------
 # DB path (ABSOLUTE by default)
@@ -13,14 +17,35 @@ DB_PATH = os.getenv("DB_PATH") or os.path.join(BASE_DIR, "followups.db")
 # -----------------------------
 # Connection helpers
 # -----------------------------
-def _connect() -> sqlite3.Connection:
+# Max idle connections kept for the whole process, shared by every thread
+# and greenlet. 0 disables pooling entirely.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or 16)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that goes back to the shared pool on close().
+    Callers keep the usual `conn = get_connection() ... conn.close()` shape.
+    """
+
+    _pool_path: str = ""
+    _pool_idle: bool = False
+
+    def close(self) -> None:
+        _pool.release(self)
+
+    def _close_for_real(self) -> None:
+        super().close()
+
+
+def _connect(factory: type[sqlite3.Connection] = sqlite3.Connection) -> sqlite3.Connection:
     """
     One place to configure SQLite connections.
     - WAL reduces "database is locked" under concurrent reads/writes.
     - foreign_keys ON to enforce relations.
     - busy_timeout to wait rather than instantly failing.
     """
-    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, factory=factory)
     conn.row_factory = sqlite3.Row
 
     # Pragmas
@@ -33,8 +58,105 @@ def _connect() -> sqlite3.Connection:
     return conn
 
 
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+class _ConnectionPool:
+    """
+    Bounded pool of configured connections, one idle list for the whole
+    process. Pragmas are applied once, when a connection is first opened.
+
+    The idle list is shared rather than per thread: under the gevent worker
+    threading.local is per greenlet, so a per-thread list was warmed by one
+    request and dropped with it. A connection is only ever held by one
+    caller at a time (check_same_thread=False lets it move between threads);
+    past `size` idle connections, released ones are closed right away, and
+    whatever is idle at exit is closed by clear().
+    """
+
+    def __init__(self, size: int):
+        self.size = max(int(size), 0)
+        self._lock = threading.Lock()
+        self._idle: list[PooledConnection] = []
+
+    def acquire(self, row_factory=None) -> PooledConnection:
+        """
+        row_factory is set on every connection handed out, fresh or reused,
+        so the row type never depends on whether the pool was warm.
+        """
+        conn = None
+        while conn is None:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            conn._pool_idle = False
+            if conn._pool_path != DB_PATH:
+                # DB_PATH was switched (tests/scripts): drop stale connections
+                conn._close_for_real()
+                conn = None
+
+        if conn is None:
+            conn = _connect(factory=PooledConnection)
+            conn._pool_path = DB_PATH
+        conn.row_factory = row_factory
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        if conn._pool_idle:
+            return  # double close()
+
+        try:
+            # same semantics as a real close: uncommitted work is discarded
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            return  # already closed for real
+
+        if conn._pool_path == DB_PATH:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    conn._pool_idle = True
+                    self._idle.append(conn)
+                    return
+        conn._close_for_real()
+
+    def clear(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn._close_for_real()
+
+
+_pool = _ConnectionPool(POOL_SIZE)
+atexit.register(_pool.clear)
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Pooled connection with tuple rows (same shape as a bare sqlite3.connect()).
+    Callers may still set row_factory; the next acquire() resets it.
+    """
+    return _pool.acquire()
+
+
+@contextmanager
+def session(row_factory=sqlite3.Row) -> Iterator[sqlite3.Connection]:
+    """
+    with session() as conn:
+        conn.execute(...)
+
+    Commits on success, rolls back on error, always hands the connection back.
+    """
+    conn = _pool.acquire(row_factory)
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
 print("DB PATH:", os.path.abspath(DB_PATH))
 
 def ensure_auth_columns():
@@ -131,7 +253,7 @@ def dict_connection() -> sqlite3.Connection:
     Kept for backwards compatibility.
     This returns Row objects too, and you can do dict(row).
     """
-    return _connect()
+    return _pool.acquire(sqlite3.Row)
 
 
 # -----------------------------
@@ -149,11 +271,12 @@ def _safe_table_name(name: str) -> str:
 
 def column_exists(cur: sqlite3.Cursor, table: str, column: str) -> bool:
     table = _safe_table_name(table)
-    cur.execute(f"PRAGMA table_info({table})")
+    # table_xinfo also lists generated columns (table_info hides them)
+    cur.execute(f"PRAGMA table_xinfo({table})")
     rows = cur.fetchall()
 
     for r in rows:
-        # PRAGMA table_info columns: cid, name, type, notnull, dflt_value, pk
+        # PRAGMA table_xinfo columns: cid, name, type, notnull, dflt_value, pk, hidden
         name = r["name"] if isinstance(r, sqlite3.Row) else r[1]
         if name == column:
             return True
@@ -397,6 +520,126 @@ def init_db() -> None:
             """
         )
 
+        # ========= 9) OUTBOX (durable send queue, see web/outbox.py) =========
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                followup_id INTEGER,
+                kind TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'queued',  -- queued|inflight|done|skipped|dead
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                available_at TEXT NOT NULL,
+                claimed_by TEXT,
+                lease_expires_at TEXT,
+                result TEXT,
+                sent_at TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+            """
+        )
+
+        # ========= 10) SEND COUNTERS (daily quota, kept incrementally) =========
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS send_counters (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,  -- UTC date, YYYY-MM-DD
+                sent INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )
+            """
+        )
+
+        # ========= 11) IMPORT JOBS (web/import_jobs.py) =========
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',  -- queued|running|done|error
+                file_path TEXT NOT NULL,
+                mapping TEXT NOT NULL DEFAULT '{}',
+                mode TEXT NOT NULL DEFAULT 'skip',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                lease_expires_at TEXT,
+                rows_done INTEGER NOT NULL DEFAULT 0,  -- committed rows: the resume point
+                rows_total INTEGER NOT NULL DEFAULT 0,
+                inserted INTEGER NOT NULL DEFAULT 0,
+                updated INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                error_count INTEGER NOT NULL DEFAULT 0,
+                error_sample TEXT NOT NULL DEFAULT '[]',
+                rejected INTEGER NOT NULL DEFAULT 0,  -- rows written to error_file
+                error_file TEXT,
+                error_bytes INTEGER NOT NULL DEFAULT 0,  -- error_file size at the last checkpoint
+                result TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+            """
+        )
+
+        # ========= 12) USER COUNTERS (kept by triggers, see _USER_COUNTER_TRIGGERS) =========
+        counters_fresh = not table_exists(cur, "user_counters")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_counters (
+                user_id INTEGER NOT NULL,  -- 0 = totals across users
+                counter TEXT NOT NULL,  -- followups.<status>|notifications.unread|users|users.paid
+                n INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, counter)
+            ) WITHOUT ROWID
+            """
+        )
+
+        # ========= 13) SEND EVENTS + ANALYTICS ROLLUPS (see SEND_EVENT_ROLLUP_SQL) =========
+        events_fresh = not table_exists(cur, "send_events")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS send_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,  -- append-only; rollups resume from an id
+                user_id INTEGER NOT NULL,
+                followup_id INTEGER,  -- no FK: events outlive deleted followups
+                event TEXT NOT NULL,  -- sent|failed|replied
+                channel TEXT,
+                created_at TEXT NOT NULL  -- UTC ISO
+            )
+            """
+        )
+        for bucket in ("hourly", "daily"):
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS analytics_{bucket} (
+                    user_id INTEGER NOT NULL,
+                    bucket TEXT NOT NULL,  -- UTC 'YYYY-MM-DDTHH' (hourly) / 'YYYY-MM-DD' (daily)
+                    event TEXT NOT NULL,
+                    n INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, bucket, event)
+                ) WITHOUT ROWID
+                """
+            )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0  -- last send_events.id folded into the rollups
+            )
+            """
+        )
+
         # ========= FOLLOWUPS UPGRADES =========
         followups_migrations = [
             ("message_override", "TEXT"),
@@ -421,6 +664,11 @@ def init_db() -> None:
             ("schedule_rel_value", "INTEGER"),
             ("schedule_rel_unit", "TEXT"),
             ("next_send_at", "TEXT"),  # ISO datetime
+            # listing sort keys (list_followups_page); virtual, so they only
+            # exist to be indexed: drafts first, then by next send / due date
+            ("list_rank", "INTEGER AS (CASE WHEN status='draft' THEN 0 ELSE 1 END) VIRTUAL"),
+            ("list_due", "TEXT AS (COALESCE(next_send_at, due_date)) VIRTUAL"),
+            ("import_key", "TEXT"),  # CSV import natural key (import_csv._import_key)
         ]
         for col, col_def in followups_migrations:
             _add_column_if_missing(cur, "followups", col, col_def)
@@ -434,6 +682,7 @@ def init_db() -> None:
             ("stripe_subscription_id", "TEXT"),
             ("plan", "TEXT"),
             ("current_period_end", "TEXT"),
+            ("gmail_history_id", "TEXT"),  # reply-detection checkpoint
         ]
         for col, col_def in users_migrations:
             _add_column_if_missing(cur, "users", col, col_def)
@@ -455,10 +704,38 @@ def init_db() -> None:
         cur.execute(
             "CREATE INDEX IF NOT EXISTS idx_followups_user_next_send ON followups(user_id, schedule_enabled, next_send_at)"
         )
+        # global due queue (scheduler tick): partial, so only scheduled rows are indexed
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_followups_due_queue "
+            "ON followups(next_send_at, status, user_id) WHERE schedule_enabled=1"
+        )
+        # keyset pagination for the dashboard/schedule listing, one per sort order
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_followups_list_due ON followups(user_id, list_rank, list_due, id)"
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_followups_list_created ON followups(user_id, created_at, id)"
+        )
+        # CSV re-imports upsert on this (ON CONFLICT needs a unique index)
+        cur.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_followups_import_key "
+            "ON followups(user_id, import_key) WHERE import_key IS NOT NULL"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_status ON import_jobs(status, updated_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_claim ON outbox(status, available_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_lease ON outbox(status, lease_expires_at)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_whatsapp_logs_user_followup ON whatsapp_logs(user_id, followup_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_email_templates_user ON email_templates(user_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_activity_logs_user ON activity_logs(user_id, created_at)")
 
+        # counters go with the rows they count: same statement, same transaction
+        for ddl in _USER_COUNTER_TRIGGERS:
+            cur.execute(ddl)
+        if counters_fresh:
+            rebuild_user_counters(cur)
+        if events_fresh:
+            seed_send_events(cur)
+
         conn.commit()
         print(f"[DB] Initialized + migrated successfully at {DB_PATH}")
 
@@ -469,6 +746,168 @@ def init_db() -> None:
         conn.close()
 
 
+# -----------------------------
+# User counters
+# -----------------------------
+# Badges and counts (count_done, stats_overview, unread notifications) read
+# user_counters instead of COUNT(*) over followups/notifications/users. The
+# triggers below keep it in step with every write, whichever module makes
+# it (models_saas, import_csv, reply_detector_db, bulk UPDATEs); the repair
+# job (models_saas.repair_user_counters) fixes any drift left by writes
+# that bypassed them, e.g. a DB restored without this table.
+def _bump(user_id: str, counter: str, delta: str) -> str:
+    return f"({user_id}, {counter}, {delta})"
+
+
+def _counter_upsert(*rows: str) -> str:
+    return (
+        "INSERT INTO user_counters (user_id, counter, n) VALUES "
+        + ", ".join(rows)
+        + " ON CONFLICT(user_id, counter) DO UPDATE SET n = n + excluded.n;"
+    )
+
+
+_OLD_STATUS = "'followups.' || COALESCE(OLD.status, '')"
+_NEW_STATUS = "'followups.' || COALESCE(NEW.status, '')"
+
+_USER_COUNTER_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_followups_insert AFTER INSERT ON followups
+    BEGIN
+        {_counter_upsert(_bump("NEW.user_id", _NEW_STATUS, "1"), _bump("0", _NEW_STATUS, "1"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_followups_update AFTER UPDATE OF status, user_id ON followups
+    WHEN OLD.status IS NOT NEW.status OR OLD.user_id IS NOT NEW.user_id
+    BEGIN
+        {_counter_upsert(
+            _bump("OLD.user_id", _OLD_STATUS, "-1"), _bump("0", _OLD_STATUS, "-1"),
+            _bump("NEW.user_id", _NEW_STATUS, "1"), _bump("0", _NEW_STATUS, "1"),
+        )}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_followups_delete AFTER DELETE ON followups
+    BEGIN
+        {_counter_upsert(_bump("OLD.user_id", _OLD_STATUS, "-1"), _bump("0", _OLD_STATUS, "-1"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_notifications_insert AFTER INSERT ON notifications
+    WHEN COALESCE(NEW.read, 0) = 0
+    BEGIN
+        {_counter_upsert(_bump("NEW.user_id", "'notifications.unread'", "1"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_notifications_update AFTER UPDATE OF read, user_id ON notifications
+    WHEN COALESCE(OLD.read, 0) IS NOT COALESCE(NEW.read, 0) OR OLD.user_id IS NOT NEW.user_id
+    BEGIN
+        {_counter_upsert(
+            _bump("OLD.user_id", "'notifications.unread'", "-(COALESCE(OLD.read, 0) = 0)"),
+            _bump("NEW.user_id", "'notifications.unread'", "(COALESCE(NEW.read, 0) = 0)"),
+        )}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_notifications_delete AFTER DELETE ON notifications
+    WHEN COALESCE(OLD.read, 0) = 0
+    BEGIN
+        {_counter_upsert(_bump("OLD.user_id", "'notifications.unread'", "-1"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_users_insert AFTER INSERT ON users
+    BEGIN
+        {_counter_upsert(_bump("0", "'users'", "1"), _bump("0", "'users.paid'", "(COALESCE(NEW.is_subscribed, 0) = 1)"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_users_update AFTER UPDATE OF is_subscribed ON users
+    WHEN (COALESCE(OLD.is_subscribed, 0) = 1) IS NOT (COALESCE(NEW.is_subscribed, 0) = 1)
+    BEGIN
+        {_counter_upsert(_bump("0", "'users.paid'", "(COALESCE(NEW.is_subscribed, 0) = 1) - (COALESCE(OLD.is_subscribed, 0) = 1)"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_counters_users_delete AFTER DELETE ON users
+    BEGIN
+        {_counter_upsert(_bump("0", "'users'", "-1"), _bump("0", "'users.paid'", "-(COALESCE(OLD.is_subscribed, 0) = 1)"))}
+    END
+    """,
+]
+
+# What user_counters should hold, counted from scratch: (user_id, counter, n)
+USER_COUNTERS_SQL = """
+    SELECT user_id, 'followups.' || COALESCE(status, '') AS counter, COUNT(*) AS n
+    FROM followups GROUP BY 1, 2
+    UNION ALL
+    SELECT 0, 'followups.' || COALESCE(status, ''), COUNT(*)
+    FROM followups GROUP BY 2
+    UNION ALL
+    SELECT user_id, 'notifications.unread', COUNT(*)
+    FROM notifications WHERE COALESCE(read, 0) = 0 GROUP BY 1
+    UNION ALL
+    SELECT 0, 'users', COUNT(*) FROM users
+    UNION ALL
+    SELECT 0, 'users.paid', COUNT(*) FROM users WHERE COALESCE(is_subscribed, 0) = 1
+"""
+
+
+def rebuild_user_counters(cur: sqlite3.Cursor) -> None:
+    """Recount user_counters from scratch (caller commits)."""
+    cur.execute("DELETE FROM user_counters")
+    cur.execute(f"INSERT INTO user_counters (user_id, counter, n) {USER_COUNTERS_SQL}")
+
+
+# -----------------------------
+# Send events / analytics rollups
+# -----------------------------
+# Send paths append to send_events (models_saas.record_send_event) in the
+# transaction that marks the followup. A background job
+# (models_saas.roll_up_send_events) folds events past rollup_state.last_id
+# into analytics_hourly/analytics_daily, so /analytics reads a bounded
+# number of bucket rows however long the history gets.
+#
+# Fold send_events with lo < id <= hi into one rollup table (bucket = the
+# first `width` chars of created_at).
+SEND_EVENT_ROLLUP_SQL = """
+    INSERT INTO analytics_{table} (user_id, bucket, event, n)
+    SELECT user_id, substr(created_at, 1, {width}), event, COUNT(*)
+    FROM send_events
+    WHERE id > ? AND id <= ?
+    GROUP BY 1, 2, 3
+    ON CONFLICT(user_id, bucket, event) DO UPDATE SET n = n + excluded.n
+"""
+
+ROLLUP_TABLES = {"hourly": 13, "daily": 10}
+
+
+def seed_send_events(cur: sqlite3.Cursor) -> None:
+    """
+    First migration: one "sent" event per followup that has a last_sent_at
+    (all the history there is from before the log), rolled up right away.
+    """
+    cur.execute(
+        """
+        INSERT INTO send_events (user_id, followup_id, event, channel, created_at)
+        SELECT user_id, id, 'sent', COALESCE(NULLIF(preferred_channel, ''), 'email'), last_sent_at
+        FROM followups
+        WHERE last_sent_at IS NOT NULL AND TRIM(last_sent_at) <> ''
+        ORDER BY last_sent_at
+        """
+    )
+    hi = int(cur.execute("SELECT COALESCE(MAX(id), 0) FROM send_events").fetchone()[0])
+    for table, width in ROLLUP_TABLES.items():
+        cur.execute(SEND_EVENT_ROLLUP_SQL.format(table=table, width=width), (0, hi))
+    cur.execute(
+        "INSERT INTO rollup_state (name, last_id) VALUES ('send_events', ?) "
+        "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+        (hi,),
+    )
+
+
 def ensure_tables() -> None:
     init_db()
 
@@ -572,6 +1011,18 @@ def ensure_followup_reply_columns():
     if "max_sends" not in cols:
         add_col("ALTER TABLE followups ADD COLUMN max_sends INTEGER DEFAULT 4")
 
+    # threads still waiting for a reply (the reply job polls these every
+    # REPLY_POLL_SECONDS): partial, so only tracked rows are indexed. The
+    # WHERE must stay word for word the predicate of get_reply_poll_users /
+    # get_reply_tracked_followups or SQLite won't use it.
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_followups_reply_tracked "
+        "ON followups(user_id, COALESCE(last_sent_at, created_at)) "
+        "WHERE COALESCE(gmail_thread_id, '') <> '' "
+        "AND COALESCE(reply_detected_at, '') = '' "
+        "AND COALESCE(auto_stop_on_reply, 1) = 1"
+    )
+
     conn.commit()
     conn.close()
 
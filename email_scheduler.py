@@ -7,9 +7,9 @@ from email.mime.text import MIMEText
 from googleapiclient.discovery import build
 
 from models_saas import get_scheduler_template, get_branding
-from scheduler_render import render_scheduler_html
+from scheduler_render import BrandedRenderer, cached_renderer
 
-from gmail_sync import _creds_from_user, _save_refreshed_token
+from gmail_sync import _creds_from_user, _save_refreshed_token, _service_for_user, persist_refreshed_token
 from scheduler_render import DEFAULT_SCHEDULER_TEMPLATE
 
 _HTML_TAG_RE = re.compile(r"<[a-zA-Z][\s\S]*?>", re.I)
@@ -17,35 +17,40 @@ _HTML_TAG_RE = re.compile(r"<[a-zA-Z][\s\S]*?>", re.I)
 
 
 
-def build_branded_email_html(user: dict, followup: dict) -> str:
+def _load_branded(uid: int) -> tuple[str, dict]:
+    tmpl = (get_scheduler_template(uid) or "").strip()
+    if not tmpl:
+        tmpl = DEFAULT_SCHEDULER_TEMPLATE
+
+    branding = get_branding(uid) or {}
+    return tmpl, branding
+
+
+def branded_renderer(user: dict) -> BrandedRenderer:
+    """
+    The user's saved scheduler template (compiled) + branding, loaded once
+    and shared by their sends for SCHED_RENDERER_CACHE_SECONDS.
+    """
+    return cached_renderer(user, lambda: _load_branded(user["id"]))
+
+
+def build_branded_email_html(user: dict, followup: dict, renderer: BrandedRenderer | None = None) -> str:
     """
     Build the final branded email HTML using the saved scheduler template.
 
     Option A:
     - Scheduler templates are FULL email templates
-    - render_scheduler_html() returns the final HTML document
-    - message_override is handled inside render_scheduler_html()
+    - BrandedRenderer.render() returns the final HTML document
+    - message_override is handled inside BrandedRenderer.render()
     - no extra wrapping is applied here
     """
-    uid = user["id"]
+    renderer = renderer or branded_renderer(user)
 
-    tmpl = (get_scheduler_template(uid) or "").strip()
-    if not tmpl:
-        tmpl = DEFAULT_SCHEDULER_TEMPLATE
-
-    branding = get_branding(uid) or {}
-
-    final_html = render_scheduler_html(
-        tmpl=tmpl,
-        user=user,
-        followup=followup,
-        branding=branding,
-    )
+    final_html = renderer.render(followup)
 
     return (final_html or "").strip()
 
 
-
 from email.message import EmailMessage
 import base64
 from googleapiclient.discovery import build
@@ -68,15 +73,14 @@ def send_branded_email_gmail(user: dict, to_email: str, subject: str, html_body:
 
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
 
-    creds = _creds_from_user(user)
-    service = build("gmail", "v1", credentials=creds)
+    service = _service_for_user(user)
 
     sent = service.users().messages().send(
         userId="me",
         body={"raw": raw}
     ).execute()
 
-    _save_refreshed_token(user["id"], creds)
+    persist_refreshed_token(user)
     return {
     "message_id": sent.get("id"),
     "thread_id": sent.get("threadId"),
@@ -1,13 +1,21 @@
 import os
 import json
+import logging
+import time
 import base64
+import threading
 import warnings
+from collections import OrderedDict
+from typing import Any
+from urllib.parse import urljoin
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.http import BatchHttpRequest
 from flask import render_template_string
 
 from models_saas import save_gmail_token
@@ -18,6 +26,8 @@ warnings.filterwarnings(
     message="Your default credentials were not found"
 )
 
+log = logging.getLogger(__name__)
+
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.send",
     "https://www.googleapis.com/auth/gmail.readonly",
@@ -55,9 +65,147 @@ def _save_refreshed_token(user_id: int, creds: Credentials):
     save_gmail_token(user_id, creds.to_json())
 
 
+# -------------------------
+# SERVICE CACHE
+# -------------------------
+# Gmail services are cached per user (Credentials shared across threads) and
+# per thread (httplib2 is not thread-safe). Entries expire after
+# GMAIL_SERVICE_TTL seconds, the least recently used go past
+# GMAIL_SERVICE_CACHE_SIZE, and reconnecting Gmail (new refresh token)
+# invalidates them. GMAIL_API_ENDPOINT points the client elsewhere (fakes/tests).
+GMAIL_SERVICE_TTL = float(os.getenv("GMAIL_SERVICE_TTL") or 1800)
+GMAIL_SERVICE_CACHE_SIZE = int(os.getenv("GMAIL_SERVICE_CACHE_SIZE") or 256)
+GMAIL_API_ENDPOINT = os.getenv("GMAIL_API_ENDPOINT") or None
+
+
+class _CachedCreds:
+    __slots__ = ("creds", "fingerprint", "persisted_token", "loaded_at", "lock")
+
+    def __init__(self, creds: Credentials, fingerprint: str, persisted_token: str | None):
+        self.creds = creds
+        self.fingerprint = fingerprint
+        self.persisted_token = persisted_token
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+
+_cache_lock = threading.Lock()
+_creds_cache: "OrderedDict[int, _CachedCreds]" = OrderedDict()
+_service_cache: "OrderedDict[tuple[int, int], tuple[_CachedCreds, Any]]" = OrderedDict()
+_discovery_doc: str | None = None
+
+
+def _gmail_discovery_doc() -> str:
+    # bundled with google-api-python-client: no discovery fetch, read once
+    global _discovery_doc
+    if _discovery_doc is None:
+        _discovery_doc = discovery_cache.get_static_doc("gmail", "v1")
+    return _discovery_doc
+
+
+def _token_fingerprint(token_json: str | None) -> str:
+    try:
+        data = json.loads(token_json or "")
+    except ValueError:
+        return ""
+    return f"{data.get('client_id') or ''}|{data.get('refresh_token') or data.get('token') or ''}"
+
+
+def _evict_lru(cache: OrderedDict) -> None:
+    while len(cache) > GMAIL_SERVICE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def invalidate_gmail_cache(user_id: int) -> None:
+    uid = int(user_id)
+    with _cache_lock:
+        _creds_cache.pop(uid, None)
+        for key in [k for k in _service_cache if k[0] == uid]:
+            del _service_cache[key]
+
+
+def _cached_creds(user: dict) -> _CachedCreds:
+    uid = int(user["id"])
+    fingerprint = _token_fingerprint(user.get("gmail_token"))
+
+    with _cache_lock:
+        entry = _creds_cache.get(uid)
+        if entry and (
+            entry.fingerprint != fingerprint
+            or time.monotonic() - entry.loaded_at > GMAIL_SERVICE_TTL
+        ):
+            entry = None
+        if entry:
+            _creds_cache.move_to_end(uid)
+
+    if entry is None:
+        creds = _creds_from_user(user)  # raises if Gmail is not connected
+        try:
+            stored_token = json.loads(user.get("gmail_token") or "{}").get("token")
+        except ValueError:
+            stored_token = None
+        entry = _CachedCreds(creds, fingerprint, stored_token)
+        with _cache_lock:
+            _creds_cache[uid] = entry
+            _evict_lru(_creds_cache)
+    else:
+        with entry.lock:
+            if not entry.creds.valid:
+                if not (entry.creds.expired and entry.creds.refresh_token):
+                    invalidate_gmail_cache(uid)
+                    raise Exception("Reconnect Gmail.")
+                entry.creds.refresh(Request())
+
+    _persist_token_if_changed(uid, entry)
+    return entry
+
+
+def _persist_token_if_changed(user_id: int, entry: _CachedCreds) -> None:
+    """
+    Write the token back only after an actual refresh (by us or by the
+    transport on a 401), not after every message.
+    """
+    token = entry.creds.token
+    if token and token != entry.persisted_token:
+        _save_refreshed_token(user_id, entry.creds)
+        entry.persisted_token = token
+
+
+def _build_service(creds: Credentials):
+    client_options = {"api_endpoint": GMAIL_API_ENDPOINT} if GMAIL_API_ENDPOINT else None
+    return build_from_document(
+        _gmail_discovery_doc(),
+        credentials=creds,
+        client_options=client_options,
+    )
+
+
 def _service_for_user(user: dict):
-    creds = _creds_from_user(user)
-    return build("gmail", "v1", credentials=creds)
+    entry = _cached_creds(user)
+    key = (int(user["id"]), threading.get_ident())
+
+    with _cache_lock:
+        hit = _service_cache.get(key)
+        if hit and hit[0] is entry:
+            _service_cache.move_to_end(key)
+            return hit[1]
+
+    service = _build_service(entry.creds)
+    with _cache_lock:
+        _service_cache[key] = (entry, service)
+        _evict_lru(_service_cache)
+    return service
+
+
+def persist_refreshed_token(user: dict) -> None:
+    """
+    Call after using a cached service; saves the token if the transport
+    refreshed it mid-request.
+    """
+    with _cache_lock:
+        entry = _creds_cache.get(int(user["id"]))
+    if entry:
+        _persist_token_if_changed(int(user["id"]), entry)
 
 
 # -------------------------
@@ -121,15 +269,14 @@ def send_email_gmail(user: dict, to_email: str, subject: str, body: str, *, is_h
 
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
 
-    creds = _creds_from_user(user)
-    service = build("gmail", "v1", credentials=creds)
+    service = _service_for_user(user)
 
     sent = service.users().messages().send(
         userId="me",
         body={"raw": raw}
     ).execute()
 
-    _save_refreshed_token(user["id"], creds)
+    persist_refreshed_token(user)
 
     return {
         "message_id": sent.get("id"),
@@ -147,7 +294,10 @@ from models_saas import (
     mark_followup_replied,
     disable_followup_schedule,
     add_notification,
+    get_gmail_history_id,
+    save_gmail_history_id,
 )
+from web.reply_detector import fetch_history_thread_ids, get_mailbox_history_id
 
 
 def extract_email_address(header_value: str) -> str:
@@ -155,91 +305,175 @@ def extract_email_address(header_value: str) -> str:
     return (addr or "").strip().lower()
 
 
-def check_replies_for_user(user: dict):
-    service = _service_for_user(user)
-    user_email = (user.get("email") or "").strip().lower()
-    if not user_email:
-        return []
+# Gmail caps a batch at 100 calls; each call still costs its own quota units.
+GMAIL_BATCH_SIZE = min(100, int(os.getenv("GMAIL_BATCH_SIZE") or 100))
+REPLY_METADATA_HEADERS = ["From", "Subject", "Date"]
+
+
+def _new_batch(service, callback):
+    if GMAIL_API_ENDPOINT:
+        # the discovery doc's batch URI ignores api_endpoint
+        return BatchHttpRequest(callback=callback, batch_uri=urljoin(GMAIL_API_ENDPOINT, "batch"))
+    return service.new_batch_http_request(callback=callback)
+
+
+def fetch_threads_metadata(service, thread_ids: list[str]) -> tuple[dict[str, dict], list[str]]:
+    """
+    threads.get(format="metadata") for every id, GMAIL_BATCH_SIZE per HTTP call.
+    Returns ({thread_id: thread}, failed). Threads Gmail refuses for good
+    (deleted, no access) are just left out; rate-limited / 5xx calls and
+    whole batches that failed (network/auth) get one retry in a later batch,
+    and whatever still failed comes back in `failed`.
+    """
+    threads: dict[str, dict] = {}
+    pending = list(dict.fromkeys(t for t in thread_ids if t))
+    retry: list[str] = []
+
+    for attempt in range(2):
+        retry = []
+
+        def _on_response(request_id, response, exception):
+            if exception is None:
+                threads[request_id] = response
+                return
+            status = getattr(getattr(exception, "resp", None), "status", None)
+            if status in (429, 500, 502, 503, 504):
+                retry.append(request_id)
+
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            chunk = pending[start:start + GMAIL_BATCH_SIZE]
+            batch = _new_batch(service, _on_response)
+            for thread_id in chunk:
+                batch.add(
+                    service.users().threads().get(
+                        userId="me",
+                        id=thread_id,
+                        format="metadata",
+                        metadataHeaders=REPLY_METADATA_HEADERS,
+                    ),
+                    request_id=thread_id,
+                )
+            try:
+                batch.execute()
+            except Exception:
+                # whole batch failed; retry what didn't come back
+                retry.extend(t for t in chunk if t not in threads and t not in retry)
+
+        if not retry or attempt:
+            break
+        time.sleep(1)
+        pending = retry
 
-    followups = get_reply_tracked_followups(user["id"])
-    results = []
+    return threads, retry
 
-    for f in followups:
-        thread_id = (f.get("gmail_thread_id") or "").strip()
-        recipient_email = (f.get("email") or "").strip().lower()
-        sent_message_id = (f.get("last_sent_message_id") or "").strip()
 
-        if not thread_id or not recipient_email:
+def _find_reply_in_thread(f: dict, thread: dict, user_email: str) -> dict | None:
+    recipient_email = (f.get("email") or "").strip().lower()
+    sent_message_id = (f.get("last_sent_message_id") or "").strip()
+
+    for msg in thread.get("messages") or []:
+        msg_id = msg.get("id") or ""
+        payload = msg.get("payload") or {}
+        headers = {
+            h["name"].lower(): h["value"]
+            for h in (payload.get("headers") or [])
+            if h.get("name") and h.get("value")
+        }
+
+        from_header = headers.get("from", "")
+        from_email = extract_email_address(from_header)
+
+        if not from_email:
             continue
 
-        try:
-            thread = service.users().threads().get(
-                userId="me",
-                id=thread_id,
-                format="full"
-            ).execute()
-        except Exception:
+        if msg_id == sent_message_id:
             continue
 
-        messages = thread.get("messages") or []
-        found_reply = None
-
-        for msg in messages:
-            msg_id = msg.get("id") or ""
-            payload = msg.get("payload") or {}
-            headers = {
-                h["name"].lower(): h["value"]
-                for h in (payload.get("headers") or [])
-                if h.get("name") and h.get("value")
-            }
-
-            from_header = headers.get("from", "")
-            from_email = extract_email_address(from_header)
-
-            if not from_email:
-                continue
-
-            if msg_id == sent_message_id:
-                continue
-
-            if from_email == user_email:
-                continue
-
-            if from_email != recipient_email:
-                continue
-
-            found_reply = {
-                "followup_id": f["id"],
-                "reply_message_id": msg_id,
-                "reply_from": from_header,
-                "reply_subject": headers.get("subject", ""),
-                "reply_date": headers.get("date", ""),
-                "recipient_email": recipient_email,
-            }
-            break
+        if from_email == user_email:
+            continue
 
-        if not found_reply:
+        if from_email != recipient_email:
             continue
 
-        mark_followup_replied(
-            fid=f["id"],
-            user_id=user["id"],
-            reply_message_id=found_reply["reply_message_id"],
-            reply_from=found_reply["reply_from"],
-            reply_subject=found_reply["reply_subject"],
-            reply_date=found_reply["reply_date"],
+        return {
+            "followup_id": f["id"],
+            "reply_message_id": msg_id,
+            "reply_from": from_header,
+            "reply_subject": headers.get("subject", ""),
+            "reply_date": headers.get("date", ""),
+            "recipient_email": recipient_email,
+        }
+
+    return None
+
+
+def _record_reply(user: dict, found_reply: dict) -> None:
+    fid = found_reply["followup_id"]
+
+    mark_followup_replied(
+        fid=fid,
+        user_id=user["id"],
+        reply_message_id=found_reply["reply_message_id"],
+        reply_from=found_reply["reply_from"],
+        reply_subject=found_reply["reply_subject"],
+        reply_date=found_reply["reply_date"],
+    )
+
+    disable_followup_schedule(fid, user["id"])
+
+    try:
+        add_notification(
+            user["id"],
+            f"Reply detected from {found_reply['recipient_email']}. Auto-stopped follow-up #{fid}."
         )
+    except Exception:
+        pass
 
-        disable_followup_schedule(f["id"], user["id"])
 
-        try:
-            add_notification(
-                user["id"],
-                f"Reply detected from {recipient_email}. Auto-stopped follow-up #{f['id']}."
-            )
-        except Exception:
-            pass
+def check_replies_for_user(user: dict):
+    service = _service_for_user(user)
+    user_email = (user.get("email") or "").strip().lower()
+    if not user_email:
+        return []
+
+    followups = [
+        f for f in get_reply_tracked_followups(user["id"])
+        if (f.get("gmail_thread_id") or "").strip() and (f.get("email") or "").strip()
+    ]
+
+    # Only look at threads that changed since the last checkpoint; full rescan
+    # when there is none yet or Gmail has expired it.
+    checkpoint = get_gmail_history_id(user["id"])
+    delta = fetch_history_thread_ids(service, checkpoint) if checkpoint else None
+    if delta is None:
+        next_checkpoint = get_mailbox_history_id(service)
+    else:
+        changed, next_checkpoint = delta
+        followups = [f for f in followups if f["gmail_thread_id"].strip() in changed]
 
+    threads, failed = fetch_threads_metadata(
+        service, [f["gmail_thread_id"].strip() for f in followups]
+    ) if followups else ({}, [])
+    persist_refreshed_token(user)
+
+    results = []
+    for f in followups:
+        thread = threads.get(f["gmail_thread_id"].strip())
+        if not thread:
+            continue
+
+        found_reply = _find_reply_in_thread(f, thread, user_email)
+        if not found_reply:
+            continue
+
+        _record_reply(user, found_reply)
         results.append(found_reply)
 
-    return results
\ No newline at end of file
+    # only move past these changes once every changed thread was looked at;
+    # otherwise the next poll sees the same delta again
+    if failed:
+        log.warning("[GMAIL] user=%s %s threads not fetched, checkpoint kept", user["id"], len(failed))
+    elif next_checkpoint and next_checkpoint != checkpoint:
+        save_gmail_history_id(user["id"], next_checkpoint)
+
+    return results
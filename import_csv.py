@@ -1,10 +1,11 @@
+import codecs
 import csv
 import re
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 
 # IMPORTANT: For the SaaS/web app, import from models_saas (not models)
-from models_saas import add_followup
+from models_saas import _clean_email, _clean_phone, _utc_iso, resolve_channel
 
 
 HEADER_ALIASES = {
@@ -65,34 +66,22 @@ def build_header_map(fieldnames) -> Dict[str, str]:
 # import_csv.py
 import csv
 from datetime import datetime
-from models_saas import add_followup
 
 import hashlib
 from database import get_connection
 
-def _import_key(user_id: int, email: str, due_date: str, description: str, followup_type: str) -> str:
-    raw = f"{user_id}|{(email or '').strip().lower()}|{(due_date or '').strip()}|{(followup_type or '').strip().lower()}|{(description or '').strip()}"
+def _import_key(user_id: int, email: str, phone: str, followup_type: str,
+                due_date: str = "", description: str = "") -> str:
+    """
+    Natural key of an imported followup: contact (email, else phone), type,
+    due date and description, so one contact can have several followups in
+    a file. Stored in followups.import_key, unique per user.
+    """
+    contact = (email or "").strip().lower() or (phone or "").strip()
+    desc = " ".join((description or "").split()).lower()
+    raw = f"{user_id}|{contact}|{(followup_type or '').strip().lower()}|{(due_date or '').strip()}|{desc}"
     return hashlib.sha1(raw.encode("utf-8")).hexdigest()
 
-def _import_seen(conn, user_id: int, key: str) -> bool:
-    # uses activity_logs as a cheap dedupe store if you already have it
-    # BUT better is to store key on followups table (see option 2).
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT 1
-        FROM activity_logs
-        WHERE user_id=? AND action='import_csv' AND message=?
-        LIMIT 1
-    """, (int(user_id), key))
-    return cur.fetchone() is not None
-
-def _import_mark(conn, user_id: int, followup_id: int, key: str) -> None:
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO activity_logs(user_id, followup_id, action, message, created_at)
-        VALUES(?, ?, 'import_csv', ?, ?)
-    """, (int(user_id), int(followup_id), key, datetime.utcnow().replace(microsecond=0).isoformat()))
-
 
 # def import_followups_from_csv(file_path: str, user_id: int, mapping: dict | None = None) -> dict:
 #     mapping = mapping or {}
@@ -193,8 +182,6 @@ import re
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 
-from models_saas import add_followup
-
 E164_RE = re.compile(r"^\+\d{8,15}$")
 
 CANON_FIELDS = ["client_name", "email", "phone", "followup_type", "description", "due_date"]
@@ -232,16 +219,245 @@ def normalize_phone_with_default(phone_raw: str, default_country: str) -> Tuple[
     return p, None
 
 
-import csv
-from datetime import datetime
+# -------------------------
+# BULK IMPORT ENGINE
+# -------------------------
+# Streams the CSV once: rows are validated into chunks of IMPORT_CHUNK_ROWS
+# and each chunk goes in with one executemany + one commit on a single
+# connection. Progress comes from the byte offset (no line-count pass);
+# progress_cb(done, total) gets rows done and the total extrapolated from
+# bytes read, so done/total is the byte fraction and exact at the end.
+#
+# Re-uploads: every imported row carries import_key (_import_key), unique
+# per user, and the mode decides what a row whose key already exists does:
+#   skip    leave the existing followup alone (default)
+#   update  overwrite its name/contact details/channel, unless it is
+#           already replied/done/deleted
+#   insert  add it anyway (stored without a key)
+#
+# Resumable runs (web/import_jobs.py): on_chunk(conn, state) runs inside each
+# chunk's transaction, so whatever it writes commits together with the rows.
+# Passing that state back as resume= skips the rows it already covers and
+# carries its counters forward.
+#
+# Pipeline: this thread reads raw chunks, a process pool validates and
+# normalizes them (_validate_chunk: dates, emails, phones, keys), and this
+# thread writes the results back in file order. At most IMPORT_MAX_INFLIGHT
+# chunks are out at once; the reader waits on the oldest one beyond that, so
+# a slow disk/DB never lets parsed rows pile up in memory. Files under
+# IMPORT_PARALLEL_MIN_BYTES (or IMPORT_WORKERS <= 1) validate inline.
+#
+# Rejected rows (no email, bad date/phone) are appended to errors_path as CSV
+# (row, error, then the original columns) when it is given; the result only
+# keeps the first IMPORT_ERROR_SAMPLE messages plus error_count.
+import io
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS") or 2000)
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS") or min(4, os.cpu_count() or 1))
+IMPORT_MAX_INFLIGHT = int(os.getenv("IMPORT_MAX_INFLIGHT") or 2 * max(IMPORT_WORKERS, 1))
+IMPORT_PARALLEL_MIN_BYTES = int(os.getenv("IMPORT_PARALLEL_MIN_BYTES") or 8 << 20)
+IMPORT_ERROR_SAMPLE = int(os.getenv("IMPORT_ERROR_SAMPLE") or 50)
+
+_ENCODINGS = ("utf-8-sig", "utf-8", "cp1252", "latin-1")
+
+IMPORT_MODES = ("skip", "update", "insert")
+
+_INSERT_FOLLOWUP_SQL = """
+    INSERT INTO followups (
+        user_id, client_name, email, phone, preferred_channel,
+        followup_type, description, due_date, status,
+        created_at, recurring_interval, sent_count, schedule_enabled, import_key
+    )
+    VALUES (?, ?, ?, ?, ?, 'other', ?, ?, 'pending', ?, 0, 0, 0, ?)
+"""
+
+_UPSERT_SQL = {
+    "skip": _INSERT_FOLLOWUP_SQL + """
+    ON CONFLICT(user_id, import_key) WHERE import_key IS NOT NULL DO NOTHING
+    """,
+    "update": _INSERT_FOLLOWUP_SQL + """
+    ON CONFLICT(user_id, import_key) WHERE import_key IS NOT NULL DO UPDATE SET
+        client_name = excluded.client_name,
+        email = excluded.email,
+        phone = excluded.phone,
+        preferred_channel = excluded.preferred_channel,
+        description = excluded.description,
+        due_date = excluded.due_date
+    WHERE followups.status NOT IN ('replied', 'done', 'deleted')
+    """,
+    "insert": _INSERT_FOLLOWUP_SQL,
+}
+
+
+def _existing_import_keys(conn, user_id: int, keys: list[str]) -> set[str]:
+    rows = conn.execute(
+        f"SELECT import_key FROM followups WHERE user_id=? AND import_key IN ({','.join('?' * len(keys))})",
+        (user_id, *keys),
+    ).fetchall()
+    return {r[0] for r in rows}
+
+
+def _encoding_for_sample(sample: bytes) -> str:
+    """
+    First encoding that decodes a sample from the start of the file. The
+    file is then read with errors="replace", so a bad byte further down
+    cannot abort an import halfway through.
+    """
+    for enc in _ENCODINGS:
+        if enc == "utf-8-sig" and not sample.startswith(b"\xef\xbb\xbf"):
+            continue
+        try:
+            # final=False: the sample may end mid-character
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def _parse_due_date(raw: str, today: str, fmt: str | None = None) -> str:
+    if not raw:
+        return today
+    try:
+        if not fmt or fmt == "%Y-%m-%d":
+            return date.fromisoformat(raw[:10]).isoformat()
+        return datetime.strptime(raw.split()[0], fmt).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid due date '{raw}' (expected {DATE_FORMATS.get(fmt or '%Y-%m-%d', fmt)})")
+
+
+_MISSING_EMAIL = "Missing email"
+
+
+def _validate_chunk(
+    rows: list[list[str]],
+    first_row: int,
+    cols: tuple[int, int, int, int, int],
+    uid: int,
+    preferred_channel: str,
+    keyed: bool,
+    today: str,
+    now: str,
+    date_format: str | None = None,
+) -> tuple[list[tuple], list[tuple[int, str, list[str]]], int]:
+    """
+    Runs in the worker processes (or inline). Returns (insert params,
+    rejected as (CSV line, reason, raw row), how many rejects were errors
+    rather than a missing email). first_row is the CSV line of rows[0].
+    """
+    i_name, i_email, i_phone, i_desc, i_due = cols
+    width = max(cols) + 1
+    valid: list[tuple] = []
+    rejected: list[tuple[int, str, list[str]]] = []
+    failed = 0
+
+    for n, row in enumerate(rows, start=first_row):
+        raw = list(row)
+        if len(row) < width:
+            row.extend([""] * (width - len(row)))
+        # unmapped columns read row[-1], this ""
+        row.append("")
+        try:
+            # the key takes the due date as given ("" when blank/unmapped),
+            # not the today default, so a re-upload on a later day still matches
+            due_key = _parse_due_date(row[i_due].strip(), "", date_format)
+            due_date = due_key or today
+            email = _clean_email(row[i_email])
+            if not email:
+                rejected.append((n, _MISSING_EMAIL, raw))
+                continue
+            phone = _clean_phone(row[i_phone])
+            description = row[i_desc].strip()
+            valid.append((
+                uid,
+                row[i_name].strip() or "(No name)",
+                email,
+                phone,
+                resolve_channel(preferred_channel, email, phone),
+                description,
+                due_date,
+                now,
+                _import_key(uid, email, phone, "other", due_key, description) if keyed else None,
+            ))
+        except Exception as e:
+            failed += 1
+            rejected.append((n, str(e), raw))
+
+    return valid, rejected, failed
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _validation_pool() -> ProcessPoolExecutor:
+    # one pool per process, started by the first big import; spawn, not
+    # fork, because the web process runs threads (scheduler, outbox, Socket.IO)
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=IMPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+class _Done:
+    # stands in for a Future when a chunk was validated inline
+    def __init__(self, value):
+        self._value = value
+
+    def result(self):
+        return self._value
+
+    def cancel(self) -> bool:
+        return False
+
+
+def _open_errors_file(path: str, resume_bytes: int, headers: list[str]):
+    """
+    Append handle on the rejected-rows CSV. A resumed run first cuts it back
+    to what its checkpoint covered, so no row is listed twice.
+    """
+    f = open(path, "a+b")
+    f.truncate(resume_bytes)
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    if resume_bytes == 0:
+        writer.writerow(["row", "error", *headers])
+    return text, writer
+
 
 def import_followups_from_csv(
     file_path: str,
     user_id: int,
     mapping: dict | None = None,
     progress_cb=None,
+    mode: str = "skip",
+    on_chunk=None,
+    resume: dict | None = None,
+    errors_path: str | None = None,
 ) -> dict:
+    """
+    Returns {"imported", "inserted", "updated", "skipped", "errors",
+    "error_count", "rejected"}; imported = inserted + updated, errors is the
+    first IMPORT_ERROR_SAMPLE messages, rejected counts rows in errors_path.
+
+    on_chunk/resume state: {"rows_done", "rows_total", "inserted", "updated",
+    "skipped", "errors", "error_count", "rejected", "error_bytes"}.
+    """
     mapping = mapping or {}
+    mode = (mode or "skip").strip().lower()
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode {mode!r} (use {', '.join(IMPORT_MODES)})")
 
     col_name = (mapping.get("client_name") or "").strip()
     col_email = (mapping.get("email") or "").strip()
@@ -250,88 +466,351 @@ def import_followups_from_csv(
     col_due = (mapping.get("due_date") or "").strip()
     preferred_channel = (mapping.get("preferred_channel") or "email").strip().lower() or "email"
 
-    imported = 0
-    skipped = 0
-    errors: list[str] = []
+    resume = resume or {}
+    inserted = int(resume.get("inserted") or 0)
+    updated = int(resume.get("updated") or 0)
+    skipped = int(resume.get("skipped") or 0)
+    errors: list[str] = list(resume.get("errors") or [])[:IMPORT_ERROR_SAMPLE]
+    error_count = int(resume.get("error_count") or len(errors))
+    rejected = int(resume.get("rejected") or 0)
+    sql = _UPSERT_SQL[mode]
+
+    sniffed = sniff_csv(file_path)
+    date_format = (mapping.get("due_date_format") or "").strip() or sniffed["date_formats"].get(col_due)
+    size = os.path.getsize(file_path)
+    uid = int(user_id)
+    today = datetime.utcnow().date().isoformat()
+    now = _utc_iso()
+
+    with open(file_path, "rb") as raw:
+        text = io.TextIOWrapper(raw, encoding=sniffed["encoding"], errors="replace", newline="")
+        reader = csv.reader(text, **_dialect_kwargs(sniffed))
+        headers = next(reader, None) or []
+
+        if col_name and col_name not in headers:
+            return {"imported": 0, "skipped": 0, "errors": [f"Mapped Client Name column '{col_name}' not found in CSV headers."]}
+        if col_email and col_email not in headers:
+            return {"imported": 0, "skipped": 0, "errors": [f"Mapped Email column '{col_email}' not found in CSV headers."]}
+
+        def _col(name: str) -> int:
+            # unmapped columns read row[-1] (see _validate_chunk)
+            return headers.index(name) if name and name in headers else -1
+
+        cols = (_col(col_name), _col(col_email), _col(col_phone), _col(col_desc), _col(col_due))
+
+        done = int(resume.get("rows_done") or 0)
+        total = done
+        if done:
+            for _ in islice(reader, done):
+                pass
+
+        err_text, err_writer = (
+            _open_errors_file(errors_path, int(resume.get("error_bytes") or 0), headers)
+            if errors_path else (None, None)
+        )
+
+        def _write_batch(conn, batch: list[tuple]) -> None:
+            nonlocal inserted, updated, skipped
+            rows = batch
+            if mode != "insert":
+                # one row per key per chunk (first wins for skip, last for update)
+                by_key: dict[str, tuple] = {}
+                for r in rows:
+                    if mode == "update" or r[-1] not in by_key:
+                        by_key[r[-1]] = r
+                skipped += len(rows) - len(by_key)
+                rows = list(by_key.values())
+
+            existing = _existing_import_keys(conn, uid, [r[-1] for r in rows]) if mode == "update" else set()
+            cur = conn.executemany(sql, rows)
+            changed = max(cur.rowcount, 0)
+
+            if mode == "update":
+                new = sum(1 for r in rows if r[-1] not in existing)
+                inserted += new
+                updated += changed - new
+                skipped += len(rows) - changed
+            else:
+                inserted += changed
+                skipped += len(rows) - changed
+
+        def _write_chunk(conn, chunk_rows: int, read: int, result) -> None:
+            nonlocal done, total, skipped, error_count, rejected
+            valid, bad, failed = result
+            done += chunk_rows
+            skipped += len(bad)
+            error_count += failed
+            rejected += len(bad)
+            for n, reason, raw_row in bad:
+                if reason != _MISSING_EMAIL and len(errors) < IMPORT_ERROR_SAMPLE:
+                    errors.append(f"Row {n}: {reason}")
+            if err_writer is not None and bad:
+                err_writer.writerows([n, reason, *raw_row] for n, reason, raw_row in bad)
+
+            if valid:
+                _write_batch(conn, valid)
+            total = done if read >= size else max(done, round(done * size / max(read, 1)))
+            if on_chunk:
+                on_chunk(conn, {
+                    "rows_done": done,
+                    "rows_total": total,
+                    "inserted": inserted,
+                    "updated": updated,
+                    "skipped": skipped,
+                    "errors": errors,
+                    "error_count": error_count,
+                    "rejected": rejected,
+                    "error_bytes": err_text.buffer.tell() if err_text else 0,
+                })
+            conn.commit()
+            if progress_cb:
+                progress_cb(done, total)
 
-    encodings = ("utf-8-sig", "utf-8", "cp1252", "latin-1")
-    last_exc = None
+        parallel = IMPORT_WORKERS > 1 and size >= IMPORT_PARALLEL_MIN_BYTES
+        pool = _validation_pool() if parallel else None
+        # (rows in chunk, bytes read when it was cut, future), oldest first
+        inflight: deque = deque()
+        first_row = next_row = done + 2  # CSV line of the next data row (header is line 1)
 
-    for enc in encodings:
+        conn = get_connection()
         try:
-            # 1) count rows (for progress %)
-            with open(file_path, "r", newline="", encoding=enc) as f:
-                total = max(sum(1 for _ in f) - 1, 0)  # minus header
+            while True:
+                chunk = list(islice(reader, IMPORT_CHUNK_ROWS))
+                if not chunk:
+                    break
+                args = (chunk, next_row, cols, uid, preferred_channel, mode != "insert", today, now, date_format)
+                fut = pool.submit(_validate_chunk, *args) if pool else _Done(_validate_chunk(*args))
+                inflight.append((len(chunk), raw.tell(), fut))
+                next_row += len(chunk)
+
+                # backpressure: the reader waits on the oldest chunk
+                while len(inflight) >= max(IMPORT_MAX_INFLIGHT, 1):
+                    n, read, fut = inflight.popleft()
+                    _write_chunk(conn, n, read, fut.result())
+
+            while inflight:
+                n, read, fut = inflight.popleft()
+                _write_chunk(conn, n, read, fut.result())
+
+            if next_row == first_row:
+                # nothing left to read: still report (and checkpoint) once
+                _write_chunk(conn, 0, size, ([], [], 0))
+        finally:
+            for _, _, fut in inflight:
+                fut.cancel()
+            conn.close()
+            if err_text is not None:
+                err_text.close()
+
+    return {
+        "imported": inserted + updated,
+        "inserted": inserted,
+        "updated": updated,
+        "skipped": skipped,
+        "errors": errors,
+        "error_count": error_count,
+        "rejected": rejected,
+    }
+
+
+# -------------------------
+# CSV SNIFFER
+# -------------------------
+# One bounded read of the start of an upload (IMPORT_SNIFF_BYTES, never the
+# whole file) gives the encoding, the dialect, the header row, a preview and
+# a guess at each column's role (email / phone / due_date / client_name /
+# description) with a confidence from 0 to 1: the share of sampled values
+# that look the part, nudged by the header name (HEADER_ALIASES).
+#
+# The result is cached next to the upload (<upload>.sniff.json, keyed on
+# size + mtime), so the mapping page and the import job, in whichever
+# worker, read the JSON instead of the CSV again.
+import json
+
+IMPORT_SNIFF_BYTES = int(os.getenv("IMPORT_SNIFF_BYTES") or 1 << 20)
+IMPORT_SNIFF_ROWS = int(os.getenv("IMPORT_SNIFF_ROWS") or 200)
+IMPORT_SNIFF_PREVIEW = 5
+IMPORT_SNIFF_MIN_CONFIDENCE = 0.5
+
+# strptime format -> how it is shown; ISO first, day-first before month-first
+# (ties go to the earlier one)
+DATE_FORMATS = {
+    "%Y-%m-%d": "YYYY-MM-DD",
+    "%d/%m/%Y": "DD/MM/YYYY",
+    "%m/%d/%Y": "MM/DD/YYYY",
+    "%d-%m-%Y": "DD-MM-YYYY",
+    "%d.%m.%Y": "DD.MM.YYYY",
+    "%Y/%m/%d": "YYYY/MM/DD",
+}
 
-            done = 0
-            if progress_cb:
-                progress_cb(done, total)
+_SNIFF_DELIMITERS = ",;\t|"
+_SNIFF_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_SNIFF_PHONE_RE = re.compile(r"^\+?[\d\s().-]{7,20}$")
+_SNIFF_NAME_RE = re.compile(r"^[^\W\d_][^\d@]{0,60}$")
+_SNIFF_DATE_LIKE_RE = re.compile(r"^(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4})\b")
 
-            # 2) actual import
-            with open(file_path, "r", newline="", encoding=enc) as f:
-                reader = csv.DictReader(f)
-                headers = reader.fieldnames or []
-
-                if col_name and col_name not in headers:
-                    return {"imported": 0, "skipped": 0, "errors": [f"Mapped Client Name column '{col_name}' not found in CSV headers."]}
-                if col_email and col_email not in headers:
-                    return {"imported": 0, "skipped": 0, "errors": [f"Mapped Email column '{col_email}' not found in CSV headers."]}
-
-                for i, row in enumerate(reader, start=2):
-                    try:
-                        client_name = (row.get(col_name) or "").strip() if col_name else ""
-                        email = (row.get(col_email) or "").strip() if col_email else ""
-                        phone = (row.get(col_phone) or "").strip() if col_phone else ""
-                        description = (row.get(col_desc) or "").strip() if col_desc else ""
-
-                        due_date_raw = (row.get(col_due) or "").strip() if col_due else ""
-                        if due_date_raw:
-                            try:
-                                due_date = datetime.strptime(due_date_raw[:10], "%Y-%m-%d").date().isoformat()
-                            except Exception:
-                                raise ValueError(f"Invalid due date '{due_date_raw}' (expected YYYY-MM-DD)")
-                        else:
-                            due_date = datetime.utcnow().date().isoformat()
-
-                        if not email:
-                            skipped += 1
-                            done += 1
-                            if progress_cb and (done % 5 == 0 or done == total):
-                                progress_cb(done, total)
-                            continue
-
-                        add_followup(
-                            user_id=int(user_id),
-                            client_name=client_name or "(No name)",
-                            email=email,
-                            phone=phone,
-                            followup_type="other",
-                            description=description,
-                            due_date=due_date,
-                            preferred_channel=preferred_channel,
-                            recurring_interval=0,
-                        )
-
-                        imported += 1
-                        done += 1
-
-                        if progress_cb and (done % 5 == 0 or done == total):
-                            progress_cb(done, total)
-
-                    except Exception as e:
-                        skipped += 1
-                        done += 1
-                        errors.append(f"Row {i}: {e}")
-                        if progress_cb and (done % 5 == 0 or done == total):
-                            progress_cb(done, total)
 
-            if progress_cb:
-                progress_cb(total, total)
+def sniff_cache_path(file_path: str) -> str:
+    return f"{file_path}.sniff.json"
 
-            return {"imported": imported, "skipped": skipped, "errors": errors}
 
-        except UnicodeDecodeError as e:
-            last_exc = e
-            continue
+def _dialect_kwargs(sniffed: dict) -> dict:
+    return {
+        "delimiter": sniffed.get("delimiter") or ",",
+        "quotechar": sniffed.get("quotechar") or '"',
+        "skipinitialspace": bool(sniffed.get("skipinitialspace")),
+    }
+
 
-    return {"imported": 0, "skipped": 0, "errors": [f"Could not read CSV file (encoding issue). Try exporting as UTF-8 CSV. Details: {last_exc}"]}
+def _sniff_dialect(text: str) -> dict:
+    head = text[:64 * 1024]
+    try:
+        d = csv.Sniffer().sniff(head, delimiters=_SNIFF_DELIMITERS)
+        return {"delimiter": d.delimiter, "quotechar": d.quotechar or '"', "skipinitialspace": d.skipinitialspace}
+    except csv.Error:
+        # one column, or nothing csv.Sniffer can agree on: most common delimiter in the header line
+        first = head.split("\n", 1)[0]
+        delim = max(_SNIFF_DELIMITERS, key=first.count)
+        return {"delimiter": delim if first.count(delim) else ",", "quotechar": '"', "skipinitialspace": False}
+
+
+def _date_format_scores(values: list[str]) -> dict[str, float]:
+    scores = {}
+    for fmt in DATE_FORMATS:
+        ok = 0
+        for v in values:
+            try:
+                datetime.strptime(v.split()[0] if fmt != "%Y-%m-%d" else v[:10], fmt)
+                ok += 1
+            except ValueError:
+                pass
+        scores[fmt] = ok / len(values)
+    return scores
+
+
+def _role_scores(header: str, values: list[str]) -> tuple[dict[str, float], str | None]:
+    """
+    Confidence per role for one column, plus its best date format.
+    """
+    norm = normalize_header(header)
+    flat = norm.replace("_", "")
+    tokens = set(norm.split("_"))
+    hints = {}
+    for role, aliases in HEADER_ALIASES.items():
+        flat_aliases = {re.sub(r"[^a-z0-9]", "", a) for a in aliases}
+        if norm in aliases or flat in flat_aliases:
+            hints[role] = 1.0  # "E-Mail Address" counts as email_address
+        elif tokens & aliases:
+            hints[role] = 0.6  # "Full Name", "Due Date (UK)"
+    values = [v.strip() for v in values if v and v.strip()]
+
+    value_scores = dict.fromkeys(("email", "phone", "due_date", "client_name", "description"), 0.0)
+    date_format = None
+    if values:
+        n = len(values)
+        value_scores["email"] = sum(1 for v in values if _SNIFF_EMAIL_RE.match(v)) / n
+        value_scores["phone"] = sum(
+            1 for v in values
+            if _SNIFF_PHONE_RE.match(v) and not _SNIFF_DATE_LIKE_RE.match(v)
+            and 7 <= sum(c.isdigit() for c in v) <= 15
+        ) / n
+        fmt_scores = _date_format_scores(values)
+        date_format = max(fmt_scores, key=fmt_scores.get)
+        value_scores["due_date"] = fmt_scores[date_format]
+        # names and notes are just text, so values alone cap lower than the header
+        value_scores["client_name"] = 0.8 * sum(
+            1 for v in values if _SNIFF_NAME_RE.match(v) and len(v.split()) <= 4
+        ) / n
+        value_scores["description"] = 0.8 * sum(1 for v in values if len(v) >= 20 and " " in v) / n
+
+    scores = {}
+    for role, vs in value_scores.items():
+        header_score = hints.get(role, 0.0)
+        conf = 0.7 * vs + 0.3 * header_score if values else 0.6 * header_score
+        scores[role] = round(conf, 3)
+    return scores, (date_format if value_scores["due_date"] > 0 else None)
+
+
+def _sniff(file_path: str) -> dict:
+    st = os.stat(file_path)
+    with open(file_path, "rb") as f:
+        sample = f.read(IMPORT_SNIFF_BYTES)
+    complete = len(sample) >= st.st_size
+
+    enc = _encoding_for_sample(sample)
+    text = codecs.getincrementaldecoder(enc)(errors="replace").decode(sample, final=complete)
+    dialect = _sniff_dialect(text)
+
+    reader = csv.reader(io.StringIO(text, newline=""), **dialect)
+    headers = next(reader, None) or []
+    rows = list(islice(reader, IMPORT_SNIFF_ROWS + 1))
+    if len(rows) > IMPORT_SNIFF_ROWS:
+        rows = rows[:IMPORT_SNIFF_ROWS]
+    elif not complete and rows:
+        rows = rows[:-1]  # the sample cut the last row short
+
+    columns = []
+    candidates = []
+    for i, h in enumerate(headers):
+        values = [r[i] if i < len(r) else "" for r in rows]
+        scores, date_format = _role_scores(h, values)
+        filled = sum(1 for v in values if v.strip())
+        columns.append({
+            "name": h,
+            "role": None,
+            "confidence": 0.0,
+            "scores": scores,
+            "date_format": date_format,
+            "fill_rate": round(filled / len(values), 3) if values else 0.0,
+        })
+        candidates.extend((conf, role, i) for role, conf in scores.items())
+
+    # best (role, column) pairs first; each role and column used once
+    mapping, confidence = {}, {}
+    for conf, role, i in sorted(candidates, key=lambda c: -c[0]):
+        if conf < IMPORT_SNIFF_MIN_CONFIDENCE or role in mapping or columns[i]["role"]:
+            continue
+        mapping[role] = headers[i]
+        confidence[role] = conf
+        columns[i].update(role=role, confidence=conf)
+
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "encoding": enc,
+        **dialect,
+        "headers": headers,
+        "preview": [dict(zip(headers, r)) for r in rows[:IMPORT_SNIFF_PREVIEW]],
+        "sampled_rows": len(rows),
+        "complete": complete,
+        "columns": columns,
+        "mapping": mapping,
+        "confidence": confidence,
+        "date_formats": {c["name"]: c["date_format"] for c in columns if c["date_format"]},
+    }
+
+
+def sniff_csv(file_path: str) -> dict:
+    """
+    Sniff result for an upload, from its cache file when that still matches
+    the upload (size + mtime), else sniffed now and cached.
+    """
+    st = os.stat(file_path)
+    cache = sniff_cache_path(file_path)
+    try:
+        with open(cache, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("size") == st.st_size and cached.get("mtime_ns") == st.st_mtime_ns:
+            return cached
+    except (OSError, ValueError):
+        pass
+
+    result = _sniff(file_path)
+    try:
+        tmp = f"{cache}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp, cache)
+    except OSError:
+        pass
+    return result
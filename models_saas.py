@@ -1,13 +1,23 @@
 # models_saas.py
 from __future__ import annotations
 
+import base64
+import json
+import logging
 import os
 import re
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta, date, timezone
 from typing import Any, Optional
 
-from database import get_connection
+from database import (
+    ROLLUP_TABLES,
+    SEND_EVENT_ROLLUP_SQL,
+    USER_COUNTERS_SQL,
+    get_connection,
+)
 
 # IMPORTANT:
 # - We use database.get_connection() as the single source of truth.
@@ -207,6 +217,93 @@ def get_user_by_id(uid: int) -> dict | None:
     return dict(row) if row else None
 
 
+# -------------------------
+# USER CACHE
+# -------------------------
+# get_user_cached() serves users rows to the request path (auth/billing
+# gates, context processor, require_user) from a small process-wide cache.
+# Anything that writes the users table calls invalidate_user_cache() after
+# committing; USER_CACHE_SECONDS bounds how stale another process can be.
+# get_user_by_id() above always reads the DB.
+USER_CACHE_SECONDS = float(os.getenv("USER_CACHE_SECONDS") or 30)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE") or 1024)
+
+_user_cache_lock = threading.Lock()
+_user_cache: dict[int, tuple[dict, float]] = {}  # uid -> (row, loaded_at)
+_user_cache_generation = 0
+
+
+def get_user_cached(uid: int) -> dict | None:
+    uid = int(uid)
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(uid)
+        generation = _user_cache_generation
+    if hit and now - hit[1] < USER_CACHE_SECONDS:
+        return dict(hit[0])
+
+    user = get_user_by_id(uid)
+    if user is None:
+        return None
+
+    with _user_cache_lock:
+        # skip the store if a write landed while we were reading
+        if generation == _user_cache_generation:
+            if len(_user_cache) >= USER_CACHE_SIZE:
+                _user_cache.clear()
+            _user_cache[uid] = (user, now)
+    return dict(user)
+
+
+def invalidate_user_cache(uid: int | None = None) -> None:
+    """
+    Drop one user (or everyone, for writes keyed by email/subscription id).
+    """
+    global _user_cache_generation
+    with _user_cache_lock:
+        if uid is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(int(uid), None)
+        _user_cache_generation += 1
+
+
+def user_cache_generation() -> int:
+    """
+    Bumped by every invalidation; lets per-request copies notice writes.
+    """
+    return _user_cache_generation
+
+
+# -------------------------
+# STATUS EVENTS
+# -------------------------
+# The mark_* functions that move a followup to sent / failed / replied /
+# passed publish the change after their UPDATE commits:
+#
+#     listener(user_id, [{"id": fid, "status": new_status, "event": "sent"}, ...])
+#
+# web/live_updates.py registers one that pushes it to the user's Socket.IO
+# room, so open dashboards patch those rows instead of reloading. A listener
+# that raises is logged and skipped; the write has already happened.
+_status_listeners: list = []
+
+
+def register_status_listener(fn) -> None:
+    if fn not in _status_listeners:
+        _status_listeners.append(fn)
+
+
+def _publish_status(user_id: int, changes: list[dict]) -> None:
+    if not changes:
+        return
+    for fn in list(_status_listeners):
+        try:
+            fn(int(user_id), changes)
+        except Exception:
+            logging.getLogger("models_saas").exception("[EVENTS] status listener failed for user %s", user_id)
+
+
 def get_all_users() -> list[dict]:
     conn = get_connection()
     conn.row_factory = sqlite3.Row
@@ -227,6 +324,7 @@ def update_gmail_token(user_id: int, token_json: str | None) -> None:
     c.execute("UPDATE users SET gmail_token=? WHERE id=?", (token_json, int(user_id)))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 def get_user_subscription(user_id: int) -> dict:
@@ -272,6 +370,7 @@ def deactivate_subscription(user_id: int) -> None:
     """, (int(user_id),))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 def mark_payment_failed(user_id: int) -> None:
     conn = get_connection()
@@ -284,6 +383,7 @@ def mark_payment_failed(user_id: int) -> None:
     """, (int(user_id),))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 
@@ -308,15 +408,10 @@ def set_subscription_active(
 
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
-def dict_connection() -> sqlite3.Connection:
-    """
-    Kept for backwards compatibility.
-    This returns Row objects too, and you can do dict(row).
-    """
-    return _connect()
-
-from database import _connect
+# Kept for backwards compatibility (pooled, Row objects).
+from database import dict_connection
 
 def _set_user_subscription_ids(user_id: int, customer_id: str | None, subscription_id: str | None):
     conn = get_connection()
@@ -329,6 +424,7 @@ def _set_user_subscription_ids(user_id: int, customer_id: str | None, subscripti
     """, (customer_id, subscription_id, int(user_id)))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 def _find_user_id_by_customer(customer_id: str | None):
     if not customer_id:
@@ -352,6 +448,7 @@ def _update_subscription_state(user_id: int, active: int, sub_id: str | None, st
     """, (int(active), sub_id, status, int(user_id)))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 
@@ -361,6 +458,7 @@ def activate_subscription(user_id: int) -> None:
     c.execute("UPDATE users SET is_subscribed=1, subscription_status='active' WHERE id=?", (int(user_id),))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 def mark_user_subscribed(email: str) -> None:
@@ -369,6 +467,7 @@ def mark_user_subscribed(email: str) -> None:
     c.execute("UPDATE users SET is_subscribed=1, subscription_status='active' WHERE lower(email)=?", (_clean_email(email),))
     conn.commit()
     conn.close()
+    invalidate_user_cache()
 
 
 def mark_user_unsubscribed(email: str) -> None:
@@ -377,6 +476,7 @@ def mark_user_unsubscribed(email: str) -> None:
     c.execute("UPDATE users SET is_subscribed=0, subscription_status='inactive' WHERE lower(email)=?", (_clean_email(email),))
     conn.commit()
     conn.close()
+    invalidate_user_cache()
 
 
 
@@ -390,6 +490,7 @@ def mark_user_unsubscribed_by_subscription_id(sub_id: str) -> None:
     """, (sub_id,))
     conn.commit()
     conn.close()
+    invalidate_user_cache()
 
 
 
@@ -420,23 +521,97 @@ def is_trial_active(user):
 
 
 def stats_overview() -> dict[str, int]:
+    totals = _read_counters(0, ("users", "users.paid", "followups.pending", "followups.done"))
+    return {
+        "users": totals["users"],
+        "paid": totals["users.paid"],
+        "pending": totals["followups.pending"],
+        "done": totals["followups.done"],
+    }
+
+
+# =========================
+# COUNTERS
+# =========================
+# user_counters is kept by triggers on followups/notifications/users
+# (database._USER_COUNTER_TRIGGERS), so these are primary-key reads however
+# many rows the user has. Sent today comes from send_counters (quota).
+def _read_counters(user_id: int, names: tuple[str, ...]) -> dict[str, int]:
     conn = get_connection()
-    c = conn.cursor()
+    rows = conn.execute(
+        f"SELECT counter, n FROM user_counters WHERE user_id=? AND counter IN ({','.join('?' * len(names))})",
+        (int(user_id), *names),
+    ).fetchall()
+    conn.close()
+    out = dict.fromkeys(names, 0)
+    out.update({name: max(int(n or 0), 0) for name, n in rows})
+    return out
 
-    c.execute("SELECT COUNT(*) FROM users")
-    users = int(c.fetchone()[0] or 0)
 
-    c.execute("SELECT COUNT(*) FROM users WHERE is_subscribed=1")
-    paid = int(c.fetchone()[0] or 0)
+def get_user_counters(user_id: int) -> dict[str, Any]:
+    """
+    {"followups": {status: n}, "unread_notifications": n, "sent_today": n}
+    """
+    today = datetime.utcnow().date().isoformat()
+    conn = get_connection()
+    rows = conn.execute(
+        """
+        SELECT counter, n FROM user_counters WHERE user_id=?
+        UNION ALL
+        SELECT 'sent_today', sent FROM send_counters WHERE user_id=? AND day=?
+        """,
+        (int(user_id), int(user_id), today),
+    ).fetchall()
+    conn.close()
 
-    c.execute("SELECT COUNT(*) FROM followups WHERE status='pending'")
-    pending = int(c.fetchone()[0] or 0)
+    out: dict[str, Any] = {"followups": {}, "unread_notifications": 0, "sent_today": 0}
+    for name, n in rows:
+        n = max(int(n or 0), 0)
+        if name.startswith("followups."):
+            if n:
+                out["followups"][name[len("followups."):]] = n
+        elif name == "notifications.unread":
+            out["unread_notifications"] = n
+        elif name == "sent_today":
+            out["sent_today"] = n
+    return out
 
-    c.execute("SELECT COUNT(*) FROM followups WHERE status='done'")
-    done = int(c.fetchone()[0] or 0)
 
-    conn.close()
-    return {"users": users, "paid": paid, "pending": pending, "done": done}
+def count_unread_notifications(user_id: int) -> int:
+    return _read_counters(user_id, ("notifications.unread",))["notifications.unread"]
+
+
+def repair_user_counters() -> list[tuple[int, str, int, int]]:
+    """
+    Recount user_counters and fix rows that drifted. Returns the fixes as
+    (user_id, counter, stored, actual). Runs under BEGIN IMMEDIATE so no
+    write lands between the recount and the fix (readers aren't blocked).
+    """
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        actual = {(r[0], r[1]): int(r[2]) for r in conn.execute(USER_COUNTERS_SQL)}
+        stored = {(r[0], r[1]): int(r[2]) for r in conn.execute("SELECT user_id, counter, n FROM user_counters")}
+        fixes = [
+            (uid, name, stored.get((uid, name), 0), actual.get((uid, name), 0))
+            for uid, name in sorted(actual.keys() | stored.keys())
+            if stored.get((uid, name), 0) != actual.get((uid, name), 0)
+        ]
+        conn.executemany(
+            """
+            INSERT INTO user_counters (user_id, counter, n) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, counter) DO UPDATE SET n = excluded.n
+            """,
+            [(uid, name, n) for uid, name, _, n in fixes],
+        )
+        conn.execute("DELETE FROM user_counters WHERE n=0")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return fixes
 
 
 # =========================
@@ -824,29 +999,303 @@ def get_user_followups(user_id: int) -> list[dict]:
     return [dict(r) for r in rows]
 
 
-def get_analytics_data() -> dict[str, Any]:
+# =========================
+# FOLLOWUP LISTING (keyset pagination)
+# =========================
+# Dashboard/schedule pages load one page at a time. The cursor is the last
+# row's sort key + id, so every page is an index seek (no OFFSET scan).
+# Each sort has a matching index in init_db (idx_followups_list_*);
+# list_rank/list_due are virtual columns standing in for the old
+# CASE/COALESCE ORDER BY so they can be indexed.
+LIST_DEFAULT_STATUSES = ("draft", "pending", "running", "passed", "failed", "sent", "scheduled")
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 500
+LIST_COUNT_CAP = 10000  # counts stop here; past it the total is "10000+"
+
+_LIST_SORTS = {
+    # name: (key columns, direction)
+    "due": (("list_rank", "list_due", "id"), "ASC"),
+    "created": (("created_at", "id"), "DESC"),
+}
+
+_LIST_COLUMNS = """
+    id, client_name, email, phone, followup_type, status, preferred_channel,
+    sent_count, last_sent_at,
+    COALESCE(substr(next_send_at,1,10), NULLIF(due_date,'')) AS due_date,
+    next_send_at, schedule_enabled, schedule_repeat, last_error, created_at,
+    list_rank, list_due
+"""
+
+
+def _encode_list_cursor(sort: str, values: list) -> str:
+    raw = json.dumps([sort, *values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_list_cursor(cursor: str, sort: str, n_keys: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("bad cursor")
+    if not isinstance(data, list) or len(data) != n_keys + 1 or data[0] != sort:
+        raise ValueError("bad cursor")
+    return data[1:]
+
+
+def list_followups_page(
+    user_id: int,
+    *,
+    sort: str = "due",
+    statuses: list[str] | tuple[str, ...] | None = None,
+    followup_type: str | None = None,
+    channel: str | None = None,
+    cursor: str | None = None,
+    limit: int = LIST_PAGE_SIZE,
+) -> dict:
+    """
+    One page of a user's followups, filtered by status/type/channel.
+
+    Returns {"items", "next_cursor", "total", "total_exact"}. next_cursor is
+    None on the last page. total is capped at LIST_COUNT_CAP (total_exact is
+    False past it). Raises ValueError for an unknown sort or a bad cursor.
+    """
+    if sort not in _LIST_SORTS:
+        raise ValueError(f"unknown sort {sort!r}")
+    keys, direction = _LIST_SORTS[sort]
+    limit = max(1, min(int(limit or LIST_PAGE_SIZE), LIST_MAX_PAGE_SIZE))
+
+    statuses = [s.strip().lower() for s in (statuses or LIST_DEFAULT_STATUSES) if s and s.strip()]
+    where = ["user_id=?", f"status IN ({','.join('?' * len(statuses))})"]
+    params: list = [int(user_id), *statuses]
+    if followup_type:
+        where.append("followup_type=?")
+        params.append(followup_type.strip())
+    if channel:
+        where.append("COALESCE(preferred_channel, 'email')=?")
+        params.append(channel.strip().lower())
+
+    filters = " AND ".join(where)
+    filter_params = list(params)
+
+    page_where = filters
+    if cursor:
+        after = _decode_list_cursor(cursor, sort, len(keys))
+        op = ">" if direction == "ASC" else "<"
+        page_where += f" AND ({', '.join(keys)}) {op} ({', '.join('?' * len(keys))})"
+        params += after
+
+    order = ", ".join(f"{k} {direction}" for k in keys)
+
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {_LIST_COLUMNS} FROM followups WHERE {page_where} ORDER BY {order} LIMIT ?",
+        (*params, limit + 1),
+    )
+    rows = c.fetchall()
+    c.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM followups WHERE {filters} LIMIT ?)",
+        (*filter_params, LIST_COUNT_CAP + 1),
+    )
+    total = int(c.fetchone()[0] or 0)
+    conn.close()
+
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_list_cursor(sort, [items[-1][k] for k in keys])
+    for item in items:
+        item.pop("list_rank", None)
+        item.pop("list_due", None)
+
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": min(total, LIST_COUNT_CAP),
+        "total_exact": total <= LIST_COUNT_CAP,
+    }
+
+
+def get_followups_by_ids(user_id: int, ids: list[int]) -> list[dict]:
+    """
+    The listing rows (same columns as list_followups_page) for some of a
+    user's followups, in ids order; ids that aren't theirs are left out.
+    """
+    ids = [int(x) for x in ids][:LIST_MAX_PAGE_SIZE]
+    if not ids:
+        return []
+
     conn = get_connection()
+    conn.row_factory = sqlite3.Row
     c = conn.cursor()
+    c.execute(
+        f"SELECT {_LIST_COLUMNS} FROM followups WHERE user_id=? AND id IN ({','.join('?' * len(ids))})",
+        (int(user_id), *ids),
+    )
+    rows = {r["id"]: dict(r) for r in c.fetchall()}
+    conn.close()
 
-    # ✅ group by the day emails were actually sent
-    c.execute("""
-        SELECT substr(last_sent_at, 1, 10) AS day, COUNT(*)
+    items = [rows[i] for i in dict.fromkeys(ids) if i in rows]
+    for item in items:
+        item.pop("list_rank", None)
+        item.pop("list_due", None)
+    return items
+
+
+# =========================
+# ANALYTICS (send_events + rollups)
+# =========================
+# Env knobs:
+#   ANALYTICS_ROLLUP_BATCH      events folded per transaction by the rollup job
+#   ANALYTICS_DEFAULT_DAYS      /analytics range when none is given
+#   ANALYTICS_MAX_HOURLY_DAYS   longest range served hour by hour
+ANALYTICS_ROLLUP_BATCH = int(os.getenv("ANALYTICS_ROLLUP_BATCH") or 10000)
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS") or 90)
+ANALYTICS_MAX_HOURLY_DAYS = int(os.getenv("ANALYTICS_MAX_HOURLY_DAYS") or 31)
+SEND_EVENTS = ("sent", "failed", "replied")
+
+
+def record_send_event(conn: sqlite3.Connection, fid: int, user_id: int, event: str) -> None:
+    """
+    Append a send event for this followup inside the caller's transaction
+    (call before its commit, so the event and the status change land together).
+    """
+    conn.execute(
+        """
+        INSERT INTO send_events (user_id, followup_id, event, channel, created_at)
+        SELECT user_id, id, ?, COALESCE(NULLIF(preferred_channel, ''), 'email'), ?
         FROM followups
-        WHERE last_sent_at IS NOT NULL AND TRIM(last_sent_at) <> ''
-        GROUP BY substr(last_sent_at, 1, 10)
-        ORDER BY day ASC
-    """)
-    sent_per_day = c.fetchall()
+        WHERE id=? AND user_id=?
+        """,
+        (event, _utc_iso(), int(fid), int(user_id)),
+    )
 
-    c.execute("SELECT COUNT(*) FROM users WHERE is_subscribed=1")
-    paid = int(c.fetchone()[0] or 0)
 
-    c.execute("SELECT COUNT(*) FROM users WHERE is_subscribed=0")
-    trial = int(c.fetchone()[0] or 0)
+def roll_up_send_events(batch: int | None = None) -> int:
+    """
+    Fold new send_events into analytics_hourly/analytics_daily, one batch per
+    transaction (rollups and rollup_state move together, so a crash never
+    counts an event twice). Returns events folded.
+    """
+    batch = int(batch or ANALYTICS_ROLLUP_BATCH)
+    total = 0
+    while True:
+        conn = get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT last_id FROM rollup_state WHERE name='send_events'").fetchone()
+            lo = int(row[0]) if row else 0
+            hi, n = conn.execute(
+                "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM send_events WHERE id > ? ORDER BY id LIMIT ?)",
+                (lo, batch),
+            ).fetchone()
+            if not n:
+                conn.rollback()
+                return total
+            for table, width in ROLLUP_TABLES.items():
+                conn.execute(SEND_EVENT_ROLLUP_SQL.format(table=table, width=width), (lo, int(hi)))
+            conn.execute(
+                "INSERT INTO rollup_state (name, last_id) VALUES ('send_events', ?) "
+                "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+                (int(hi),),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        total += int(n)
+        if n < batch:
+            return total
 
-    conn.close()
-    return {"sent_per_day": sent_per_day, "paid": paid, "trial": trial}
 
+def analytics_range(start: str | None, end: str | None, bucket: str = "day") -> tuple[str, str, str]:
+    """
+    (start, end, bucket) as served: UTC days, inclusive, defaulting to the
+    last ANALYTICS_DEFAULT_DAYS; "hour" falls back to "day" past
+    ANALYTICS_MAX_HOURLY_DAYS. Bad input raises ValueError.
+    """
+    end_d = date.fromisoformat(end) if end else datetime.utcnow().date()
+    start_d = date.fromisoformat(start) if start else end_d - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if start_d > end_d:
+        start_d, end_d = end_d, start_d
+    if bucket not in ("hour", "day"):
+        raise ValueError(f"bad bucket: {bucket}")
+    if bucket == "hour" and (end_d - start_d).days >= ANALYTICS_MAX_HOURLY_DAYS:
+        bucket = "day"
+    return start_d.isoformat(), end_d.isoformat(), bucket
+
+
+def iter_analytics_series(
+    user_id: int,
+    start: str | None = None,
+    end: str | None = None,
+    bucket: str = "day",
+) -> Any:
+    """
+    (bucket, sent, failed, replied) per hour/day in the range, oldest first.
+
+    Reads the rollups plus events the rollup job hasn't reached yet, in one
+    statement (one snapshot), so nothing is missed or counted twice.
+    """
+    start, end, bucket = analytics_range(start, end, bucket)
+    table, width = ("hourly", 13) if bucket == "hour" else ("daily", 10)
+    lo_b, hi_b = (f"{start}T00", f"{end}T23") if bucket == "hour" else (start, end)
+    pivot = ", ".join(f"SUM(CASE WHEN event='{e}' THEN n ELSE 0 END)" for e in SEND_EVENTS)
+
+    return _iter_rows(
+        f"""
+        SELECT bucket, {pivot}
+        FROM (
+            SELECT bucket, event, n FROM analytics_{table}
+            WHERE user_id=? AND bucket BETWEEN ? AND ?
+            UNION ALL
+            SELECT substr(created_at, 1, {width}), event, COUNT(*) FROM send_events
+            WHERE id > COALESCE((SELECT last_id FROM rollup_state WHERE name='send_events'), 0)
+              AND user_id=? AND created_at >= ? AND created_at < ?
+            GROUP BY 1, 2
+        )
+        GROUP BY bucket
+        ORDER BY bucket
+        """,
+        (int(user_id), lo_b, hi_b, int(user_id), start, (date.fromisoformat(end) + timedelta(days=1)).isoformat()),
+    )
+
+
+def get_analytics_data(
+    user_id: int,
+    start: str | None = None,
+    end: str | None = None,
+    bucket: str = "day",
+) -> dict[str, Any]:
+    """
+    Per-user send analytics for [start, end] by "day" or "hour" (see
+    analytics_range):
+
+        {"series": [{"bucket", "sent", "failed", "replied"}, ...],
+         "sent_per_day": [(bucket, sent), ...], "totals": {...},
+         "start", "end", "bucket", "paid", "trial"}
+    """
+    start, end, bucket = analytics_range(start, end, bucket)
+    series = [
+        {"bucket": row[0], **{e: int(n or 0) for e, n in zip(SEND_EVENTS, row[1:])}}
+        for row in iter_analytics_series(user_id, start, end, bucket)
+    ]
+
+    users = _read_counters(0, ("users", "users.paid"))
+    return {
+        "series": series,
+        "sent_per_day": [(r["bucket"], r["sent"]) for r in series if r["sent"]],
+        "totals": {e: sum(r[e] for r in series) for e in SEND_EVENTS},
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+        "paid": users["users.paid"],
+        "trial": users["users"] - users["users.paid"],
+    }
 
 
 def get_overdue_followups(user_id: int) -> list[dict]:
@@ -895,17 +1344,92 @@ def get_due_soon_followups(user_id: int) -> list[dict]:
     return [dict(r) for r in rows]
 
 
+# =========================
+# CSV EXPORT (web/csv_export.py streams these)
+# =========================
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS") or 1000)
+
+FOLLOWUP_EXPORT_COLUMNS = (
+    "id", "client_name", "email", "phone", "followup_type", "description", "status",
+    "due_date", "created_at", "preferred_channel", "sent_count", "last_sent_at",
+    "next_send_at", "replied_at", "last_error",
+)
+_EXPORT_DATE_FIELDS = {"due": "due_date", "created": "created_at", "sent": "last_sent_at"}
+
+
+def _iter_rows(sql: str, params: tuple) -> Any:
+    # steps the statement as rows are consumed (fetchmany), so memory doesn't
+    # grow with the result; the connection goes back when the generator is
+    # exhausted or closed (client went away)
+    conn = get_connection()
+    try:
+        c = conn.execute(sql, params)
+        while True:
+            rows = c.fetchmany(EXPORT_FETCH_ROWS)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        conn.close()
+
+
+def iter_followups_export(
+    user_id: int,
+    *,
+    statuses: list[str] | tuple[str, ...] | None = None,
+    date_field: str = "due",
+    date_from: str | None = None,
+    date_to: str | None = None,
+    followup_type: str | None = None,
+    channel: str | None = None,
+) -> Any:
+    """
+    A user's followups as tuples of FOLLOWUP_EXPORT_COLUMNS, oldest first,
+    filtered by status (default all) and an inclusive date range on the
+    due/created/sent date. Walks idx_followups_list_created in order, so
+    nothing is sorted or held in memory. Raises ValueError on bad filters
+    (before the first row, since the checks run on creation).
+    """
+    if date_field not in _EXPORT_DATE_FIELDS:
+        raise ValueError(f"unknown date field {date_field!r}")
+    col = _EXPORT_DATE_FIELDS[date_field]
+
+    where = ["user_id=?"]
+    params: list = [int(user_id)]
+    statuses = [s.strip().lower() for s in (statuses or ()) if s and s.strip()]
+    if statuses:
+        where.append(f"status IN ({','.join('?' * len(statuses))})")
+        params += statuses
+    if date_from:
+        where.append(f"{col} >= ?")
+        params.append(date.fromisoformat(date_from).isoformat())
+    if date_to:
+        where.append(f"{col} < ?")
+        params.append((date.fromisoformat(date_to) + timedelta(days=1)).isoformat())
+    if followup_type:
+        where.append("followup_type=?")
+        params.append(followup_type.strip())
+    if channel:
+        where.append("COALESCE(preferred_channel, 'email')=?")
+        params.append(channel.strip().lower())
+
+    return _iter_rows(
+        f"""
+        SELECT {', '.join(FOLLOWUP_EXPORT_COLUMNS)}
+        FROM followups INDEXED BY idx_followups_list_created
+        WHERE {' AND '.join(where)}
+        ORDER BY created_at, id
+        """,
+        tuple(params),
+    )
+
+
 # =========================
 # STATUS MARKERS
 # =========================
 
 def get_done_count(user_id: int) -> int:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM followups WHERE user_id=? AND status='done'", (int(user_id),))
-    n = int(c.fetchone()[0] or 0)
-    conn.close()
-    return n
+    return _read_counters(user_id, ("followups.done",))["followups.done"]
 
 
 def count_done(user_id: int) -> int:
@@ -1005,17 +1529,22 @@ def mark_followup_failed(fid: int, user_id: int, err: str) -> None:
     mark_send_failed(fid, user_id, err)
 
 
-def set_status_running(fid: int, user_id: int) -> None:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
+def set_status_running(fid: int, user_id: int, conn: sqlite3.Connection | None = None) -> None:
+    """
+    With conn, runs inside the caller's transaction (the caller commits).
+    """
+    own = conn is None
+    if own:
+        conn = get_connection()
+    conn.execute("""
         UPDATE followups
         SET status='running'
         WHERE id=? AND user_id=?
           AND COALESCE(status,'') IN ('scheduled', 'pending')
     """, (int(fid), int(user_id)))
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
 
 # =========================
 # SCHEDULING (ONE SYSTEM)
@@ -1099,14 +1628,17 @@ def mark_schedule_passed(user_id: int, cutoff_iso: str) -> int:
           AND COALESCE(last_sent_at,'') = ''
           AND status IN ('pending','scheduled')
           AND COALESCE(schedule_repeat,'once') = 'once'
+        RETURNING id
     """, (int(user_id), cutoff_iso))
 
-    n = c.rowcount
+    ids = [r[0] for r in c.fetchall()]
     conn.commit()
     conn.close()
-    return n
+    _publish_status(user_id, [{"id": fid, "status": "passed", "event": "passed"} for fid in ids])
+    return len(ids)
 
 from web.compute_next import compute_next_send_at
+from web.scheduler_trace import sample_dump
 
 def set_followup_schedule_rule(fid: int, user_id: int, rule: dict) -> bool:
     conn = get_connection()
@@ -1376,6 +1908,7 @@ def save_gmail_token(user_id: int, token_json: str) -> None:
 
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 def save_gmail_email(user_id: int, email: str) -> None:
@@ -1393,6 +1926,31 @@ def save_gmail_email(user_id: int, email: str) -> None:
 
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
+
+
+def get_gmail_history_id(user_id: int) -> str | None:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT gmail_history_id FROM users WHERE id=?", (int(user_id),)
+    ).fetchone()
+    conn.close()
+    return (row[0] or None) if row else None
+
+
+def save_gmail_history_id(user_id: int, history_id: str | None) -> None:
+    """
+    Reply-detection checkpoint (Gmail mailbox historyId). None forces the
+    next check to do a full rescan, e.g. after reconnecting another mailbox.
+    """
+    conn = get_connection()
+    conn.execute(
+        "UPDATE users SET gmail_history_id=? WHERE id=?",
+        (str(history_id) if history_id else None, int(user_id)),
+    )
+    conn.commit()
+    conn.close()
+    invalidate_user_cache(int(user_id))
 
 
 
@@ -1640,13 +2198,15 @@ def get_due_scheduled(user_id: int, now_iso: str):
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
 
-    # DEBUG: dump all followups for this user
-    c.execute("""
-        SELECT id, status, schedule_enabled, next_send_at
-        FROM followups
-        WHERE user_id=?
-    """, (int(user_id),))
-    print("[SCHED][FOLLOWUPS]", [dict(r) for r in c.fetchall()])
+    # Sampled + capped, and only with SCHED_TRACE=1 (was: every row, every tick)
+    sample_dump(f"[SCHED][FOLLOWUPS] user={int(user_id)}", lambda: [
+        dict(r) for r in c.execute("""
+            SELECT id, status, schedule_enabled, next_send_at
+            FROM followups
+            WHERE user_id=?
+            LIMIT 200
+        """, (int(user_id),)).fetchall()
+    ])
 
     # Actual due scheduled query
     c.execute("""
@@ -1666,6 +2226,132 @@ def get_due_scheduled(user_id: int, now_iso: str):
     return rows
 
 
+_DUE_QUEUE_USER_COLS = ("email", "name", "gmail_token", "is_subscribed", "trial_end")
+
+
+def get_due_queue(now_iso: str, per_user_limit: int = 50, limit: int = 5000) -> list[dict]:
+    """
+    Every followup due to be sent now, across all users, oldest first, at
+    most per_user_limit per user. Each row carries its owner under
+    row["user"] (one shared dict per user).
+
+    Served by idx_followups_due_queue (partial on schedule_enabled=1), so the
+    cost tracks the number of due rows, not users x followups. The per-user
+    cap is applied in SQL before the global limit, so one user with a huge
+    backlog can't push everyone else out of the tick.
+    """
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+
+    user_cols = ", ".join(f"u.{col} AS owner_{col}" for col in _DUE_QUEUE_USER_COLS)
+    c.execute(f"""
+        WITH due AS (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY next_send_at, id) AS rn
+            FROM followups
+            WHERE schedule_enabled=1
+              AND next_send_at IS NOT NULL
+              AND next_send_at <= ?
+              AND status IN ('pending','scheduled')
+        )
+        SELECT f.*, {user_cols}
+        FROM due
+        JOIN followups f ON f.id = due.id
+        JOIN users u ON u.id = f.user_id
+        WHERE due.rn <= ?
+        ORDER BY f.next_send_at ASC, f.id ASC
+        LIMIT ?
+    """, (now_iso, int(per_user_limit), int(limit)))
+    rows = c.fetchall()
+    conn.close()
+
+    owners: dict[int, dict] = {}
+    out: list[dict] = []
+
+    for r in rows:
+        d = dict(r)
+        uid = int(d["user_id"])
+        owner = {col: d.pop(f"owner_{col}") for col in _DUE_QUEUE_USER_COLS}
+        if uid not in owners:
+            owners[uid] = {"id": uid, **owner}
+        d["user"] = owners[uid]
+        out.append(d)
+
+    return out
+
+
+def get_reply_poll_users() -> list[dict]:
+    """
+    Gmail-connected users that have at least one thread waiting for a reply,
+    with the newest send among those threads (last_tracked_send_at) so the
+    reply job can decide how often to poll them.
+
+    Runs every REPLY_POLL_SECONDS, so the followups side is a lookup per
+    connected user in idx_followups_reply_tracked (partial on exactly this
+    predicate, covering the MAX), never a scan of the whole table.
+    """
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("""
+        SELECT u.id, u.email, u.name, u.gmail_token, u.is_subscribed, u.trial_end,
+               MAX(COALESCE(f.last_sent_at, f.created_at)) AS last_tracked_send_at,
+               COUNT(*) AS tracked_threads
+        FROM users u
+        JOIN followups f ON f.user_id = u.id
+        WHERE COALESCE(u.gmail_token, '') <> ''
+          AND COALESCE(f.gmail_thread_id, '') <> ''
+          AND COALESCE(f.reply_detected_at, '') = ''
+          AND COALESCE(f.auto_stop_on_reply, 1) = 1
+        GROUP BY u.id
+        ORDER BY u.id ASC
+    """)
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def mark_schedule_passed_all(cutoff_iso: str, user_ids: list[int]) -> int:
+    """
+    Global version of mark_schedule_passed(): one UPDATE per chunk of users
+    instead of one per user. Only touches user_ids, i.e. the users the tick
+    actually fetched and enqueued; anyone else's overdue rows are left for
+    the tick that handles them.
+    """
+    uids = sorted({int(u) for u in user_ids})
+    if not uids:
+        return 0
+
+    conn = get_connection()
+    c = conn.cursor()
+    rows = []
+    for i in range(0, len(uids), 500):
+        chunk = uids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        c.execute(f"""
+            UPDATE followups
+            SET status='passed'
+            WHERE user_id IN ({marks})
+              AND schedule_enabled=1
+              AND next_send_at IS NOT NULL
+              AND next_send_at < ?
+              AND COALESCE(last_sent_at,'') = ''
+              AND status IN ('pending','scheduled')
+              AND COALESCE(schedule_repeat,'once') = 'once'
+            RETURNING id, user_id
+        """, (*chunk, cutoff_iso))
+        rows.extend(c.fetchall())
+
+    by_user: dict[int, list[dict]] = {}
+    for fid, uid in rows:
+        by_user.setdefault(uid, []).append({"id": fid, "status": "passed", "event": "passed"})
+    conn.commit()
+    conn.close()
+    for uid, changes in by_user.items():
+        _publish_status(uid, changes)
+    return sum(len(v) for v in by_user.values())
+
+
 from datetime import datetime
 from web.compute_next import compute_next_send_at
 
@@ -1728,8 +2414,13 @@ def mark_send_success(fid: int, user_id: int, f: dict[str, Any] | None = None) -
         (now_iso, now_iso, schedule_enabled, next_send_at, next_send_at, int(fid), int(user_id)),
     )
 
+    changed = c.rowcount > 0
+    if changed:
+        record_send_event(conn, fid, user_id, "sent")
     conn.commit()
     conn.close()
+    if changed:
+        _publish_status(user_id, [{"id": int(fid), "status": "sent", "event": "sent"}])
 
 
 from datetime import datetime
@@ -1753,8 +2444,13 @@ def mark_send_success_once(fid: int, user_id: int) -> None:
         WHERE id=? AND user_id=?
     """, (now_iso, now_iso, int(fid), int(user_id)))
 
+    changed = c.rowcount > 0
+    if changed:
+        record_send_event(conn, fid, user_id, "sent")
     conn.commit()
     conn.close()
+    if changed:
+        _publish_status(user_id, [{"id": int(fid), "status": "sent", "event": "sent"}])
 
 from datetime import datetime
 
@@ -1777,8 +2473,14 @@ def mark_send_success_repeat(fid: int, user_id: int, next_send_at: str) -> None:
         WHERE id=? AND user_id=?
     """, (now_iso, now_iso, next_send_at, next_send_at, int(fid), int(user_id)))
 
+    changed = c.rowcount > 0
+    if changed:
+        record_send_event(conn, fid, user_id, "sent")
     conn.commit()
     conn.close()
+    if changed:
+        # sent, and back on the schedule for the next one
+        _publish_status(user_id, [{"id": int(fid), "status": "scheduled", "event": "sent"}])
 
 
 def mark_send_failed(fid: int, user_id: int, reason: str) -> None:
@@ -1797,10 +2499,16 @@ def mark_send_failed(fid: int, user_id: int, reason: str) -> None:
             last_attempt_at = ?
         WHERE id = ? AND user_id = ?
           AND COALESCE(status, '') NOT IN ('done', 'replied', 'deleted')
+        RETURNING status
     """, (reason, now_iso, int(fid), int(user_id)))
 
+    rows = c.fetchall()
+    if rows:
+        record_send_event(conn, fid, user_id, "failed")
     conn.commit()
     conn.close()
+    if rows:
+        _publish_status(user_id, [{"id": int(fid), "status": rows[0][0], "event": "failed"}])
 
 
 
@@ -1916,6 +2624,8 @@ def set_branding(
 
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
+    _drop_render_cache(int(user_id))
 
 
 # def get_branding(user_id: int | None) -> dict[str, str]:
@@ -2044,17 +2754,33 @@ def update_email_template(tid: int, name: str, subject: str, html_content: str)
         UPDATE email_templates
         SET name=?, subject=?, html_content=?
         WHERE id=?
+        RETURNING user_id
     """, (_clean_text(name), _clean_text(subject), html_content, int(tid)))
+    owners = {r[0] for r in c.fetchall()}
     conn.commit()
     conn.close()
+    # it may be (or may have been renamed to/from) the scheduler template
+    for user_id in owners:
+        _drop_render_cache(user_id)
 
 
 def delete_email_template(tid: int) -> None:
     conn = get_connection()
     c = conn.cursor()
-    c.execute("DELETE FROM email_templates WHERE id=?", (int(tid),))
+    c.execute("DELETE FROM email_templates WHERE id=? RETURNING user_id", (int(tid),))
+    owners = {r[0] for r in c.fetchall()}
     conn.commit()
     conn.close()
+    for user_id in owners:
+        _drop_render_cache(user_id)
+
+def _drop_render_cache(user_id: int) -> None:
+    # compiled copies of the old template (scheduler_render LRU) and the
+    # user's cached renderer (template + branding)
+    from scheduler_render import invalidate_renderers, invalidate_template_cache
+    invalidate_template_cache(user_id)
+    invalidate_renderers(user_id)
+
 
 def get_scheduler_template(user_id: int) -> str:
     """
@@ -2100,6 +2826,7 @@ def upsert_scheduler_template(user_id: int, html_content: str) -> None:
 
     conn.commit()
     conn.close()
+    _drop_render_cache(user_id)
 
 
 
@@ -2159,6 +2886,7 @@ def save_scheduler_template(user_id: int, html_content: str) -> None:
 
     conn.commit()
     conn.close()
+    _drop_render_cache(user_id)
 
 
 # =========================
@@ -2204,18 +2932,55 @@ def get_whatsapp_logs(user_id: int, followup_id: int | None = None, limit: int =
 
 
 def count_sent_today(user_id: int) -> int:
+    """
+    Sends today (UTC) across channels, from the per-day counter the outbox
+    bumps on every send (send_counters) instead of counting log rows.
+    """
     today = datetime.utcnow().date().isoformat()
     conn = get_connection()
+    row = conn.execute(
+        "SELECT sent FROM send_counters WHERE user_id=? AND day=?",
+        (int(user_id), today),
+    ).fetchone()
+    conn.close()
+    return int(row[0]) if row else 0
+
+
+def reserve_daily_send(user_id: int, day: str, limit: int) -> bool:
+    """
+    Atomically take one send from today's quota. False when the quota is used up.
+    """
+    conn = get_connection()
     c = conn.cursor()
-    c.execute("""
-        SELECT COUNT(*)
-        FROM whatsapp_logs
-        WHERE user_id = ?
-          AND substr(sent_at, 1, 10) = ?
-    """, (int(user_id), today))
-    n = int(c.fetchone()[0] or 0)
+    c.execute(
+        "INSERT OR IGNORE INTO send_counters (user_id, day, sent) VALUES (?, ?, 0)",
+        (int(user_id), day),
+    )
+    c.execute(
+        """
+        UPDATE send_counters
+        SET sent = sent + 1
+        WHERE user_id=? AND day=? AND sent < ?
+        """,
+        (int(user_id), day, int(limit)),
+    )
+    ok = (c.rowcount or 0) > 0
+    conn.commit()
+    conn.close()
+    return ok
+
+
+def release_daily_send(user_id: int, day: str) -> None:
+    """
+    Give back a reserved send that did not go out.
+    """
+    conn = get_connection()
+    conn.execute(
+        "UPDATE send_counters SET sent = MAX(sent - 1, 0) WHERE user_id=? AND day=?",
+        (int(user_id), day),
+    )
+    conn.commit()
     conn.close()
-    return n
 
 
 # =========================
@@ -2402,9 +3167,13 @@ def mark_followup_replied(
         int(fid),
         int(user_id),
     ))
-    conn.commit()
     ok = c.rowcount > 0
+    if ok:
+        record_send_event(conn, fid, user_id, "replied")
+    conn.commit()
     conn.close()
+    if ok:
+        _publish_status(user_id, [{"id": int(fid), "status": "replied", "event": "replied"}])
     return ok
 
 
@@ -1,10 +1,16 @@
 # web/scheduler_render.py
 from __future__ import annotations
 
+import hashlib
+import logging
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
 from typing import Any, Mapping
 
-import bleach
+log = logging.getLogger("scheduler_render")
 
 # scheduler_render.py
 
@@ -219,192 +225,454 @@ def _render_vars(src: str, data: Mapping[str, Any]) -> str:
     return _VAR_RE.sub(repl, src)
 
 
+# -------------------------
+# COMPILED TEMPLATES
+# -------------------------
+# _render_conditionals + _render_vars re-scan the raw template line by line
+# and by regex on every render. compile_template() does that scan once and
+# keeps nodes, which render() just walks:
+#   (_LIT, text)          literal text
+#   (_VAR, key)           {{ key }}, key in _ALLOWED_VARS (unknown ones compile to nothing)
+#   (_IF, key, nodes)     {% if key %} ... {% endif %}, key None when unknown (never true)
+# Same subset and line rules as the two functions above, which stay as the
+# reference. Compiled templates are cached per (user_id, sha1 of the source)
+# in an LRU of SCHED_TEMPLATE_CACHE_SIZE; saving a user's scheduler template
+# drops their entries (models_saas.upsert_scheduler_template / save_scheduler_template).
+SCHED_TEMPLATE_CACHE_SIZE = int(os.getenv("SCHED_TEMPLATE_CACHE_SIZE") or 512)
+
+_LIT, _VAR, _IF = 0, 1, 2
+
+
+class CompiledTemplate:
+    __slots__ = ("nodes", "vars")
+
+    def __init__(self, nodes: list, vars_: frozenset[str]):
+        self.nodes = nodes
+        self.vars = vars_  # every allowed var the template prints, inside ifs too
+
+    def render(self, data: Mapping[str, Any]) -> str:
+        out: list[str] = []
+        _emit(self.nodes, data, out)
+        return "".join(out)
+
+
+def _emit(nodes: list, data: Mapping[str, Any], out: list[str]) -> None:
+    for node in nodes:
+        kind = node[0]
+        if kind == _LIT:
+            out.append(node[1])
+        elif kind == _VAR:
+            v = data.get(node[1])
+            if v is not None:
+                out.append(str(v))
+        elif node[1] is not None and _truthy(data.get(node[1])):
+            _emit(node[2], data, out)
+
+
+def compile_template(src: str) -> CompiledTemplate:
+    root: list = []
+    bodies = [root]
+    buf: list[str] = []
+    used: set[str] = set()
+
+    def flush() -> None:
+        text = "".join(buf)
+        buf.clear()
+        pos = 0
+        for m in _VAR_RE.finditer(text):
+            if m.start() > pos:
+                bodies[-1].append((_LIT, text[pos:m.start()]))
+            key = m.group(1)
+            if key in _ALLOWED_VARS:
+                bodies[-1].append((_VAR, key))
+                used.add(key)
+            pos = m.end()
+        if pos < len(text):
+            bodies[-1].append((_LIT, text[pos:]))
+
+    for line in (src or "").splitlines(True):
+        m_open = _IF_OPEN_RE.search(line)
+        if m_open:
+            flush()
+            var = m_open.group(1)
+            body: list = []
+            bodies[-1].append((_IF, var if var in _ALLOWED_VARS else None, body))
+            bodies.append(body)
+            continue
 
-import bleach
-from bleach.css_sanitizer import CSSSanitizer
+        if _IF_CLOSE_RE.search(line):
+            # a stray endif is dropped without splitting the text around it
+            if len(bodies) > 1:
+                flush()
+                bodies.pop()
+            continue
 
-def _sanitize_html(html: str) -> str:
-    allowed_tags = [
-        "div",
-        "p",
-        "br",
-        "b",
-        "strong",
-        "i",
-        "em",
-        "ul",
-        "ol",
-        "li",
-        "span",
-        "small",
-        "h1",
-        "h2",
-        "h3",
-        "h4",
-        "a",
-        "img",
-        "hr",
-        "table",
-        "thead",
-        "tbody",
-        "tr",
-        "th",
-        "td",
-    ]
-
-    allowed_attrs = {
-        "*": ["style"],
-        "a": ["href", "target", "rel"],
-        "img": ["src", "alt", "width", "height", "style"],
-    }
-
-    css_sanitizer = CSSSanitizer(
-        allowed_css_properties=[
-            "background",
-            "background-color",
-            "color",
-            "font-family",
-            "font-size",
-            "font-weight",
-            "line-height",
-            "text-align",
-            "padding",
-            "padding-top",
-            "padding-right",
-            "padding-bottom",
-            "padding-left",
-            "margin",
-            "margin-top",
-            "margin-right",
-            "margin-bottom",
-            "margin-left",
-            "border",
-            "border-top",
-            "border-right",
-            "border-bottom",
-            "border-left",
-            "border-radius",
-            "width",
-            "max-width",
-            "height",
-            "display",
-            "vertical-align",
-            "letter-spacing",
-            "text-transform",
-            "box-shadow",
-            "overflow",
-            "text-decoration",
-        ]
+        buf.append(line)
+    flush()
+
+    return CompiledTemplate(root, frozenset(used))
+
+
+_template_cache: "OrderedDict[tuple[int | None, str], CompiledTemplate]" = OrderedDict()
+_template_cache_lock = threading.Lock()
+_template_cache_stats = {"hits": 0, "misses": 0}
+
+
+def get_compiled_template(user_id: int | None, src: str) -> CompiledTemplate:
+    key = (
+        int(user_id) if user_id is not None else None,
+        hashlib.sha1((src or "").encode("utf-8")).hexdigest(),
     )
+    with _template_cache_lock:
+        hit = _template_cache.get(key)
+        if hit is not None:
+            _template_cache.move_to_end(key)
+            _template_cache_stats["hits"] += 1
+            return hit
+        _template_cache_stats["misses"] += 1
+
+    compiled = compile_template(src)
+    with _template_cache_lock:
+        _template_cache[key] = compiled
+        _template_cache.move_to_end(key)
+        while len(_template_cache) > SCHED_TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    return compiled
+
+
+def invalidate_template_cache(user_id: int | None = None) -> None:
+    with _template_cache_lock:
+        if user_id is None:
+            _template_cache.clear()
+            return
+        for key in [k for k in _template_cache if k[0] == int(user_id)]:
+            del _template_cache[key]
+
+
+def template_cache_stats() -> dict:
+    with _template_cache_lock:
+        return {"size": len(_template_cache), **_template_cache_stats}
+
+
+
+# -------------------------
+# SANITIZING
+# -------------------------
+# bleach.clean() builds a new Cleaner (html5lib parser, tree walker, filter
+# chain) on every call, and _sanitize_html built its CSSSanitizer too. The
+# policies below are fixed, so each thread builds its Cleaner once
+# (Cleaner isn't thread-safe; the parser keeps state).
+#
+# The same fragments get sanitized over and over (one message_override goes
+# to every recipient of a campaign), so outputs are memoized by sha1 of the
+# input, per policy. Inputs over SCHED_SANITIZE_MAX_CHARS aren't cached.
 
-    cleaned = bleach.clean(
-        html,
-        tags=allowed_tags,
-        attributes=allowed_attrs,
-        css_sanitizer=css_sanitizer,
+from bleach.css_sanitizer import CSSSanitizer
+from bleach.sanitizer import Cleaner
+
+SCHED_SANITIZE_CACHE_SIZE = int(os.getenv("SCHED_SANITIZE_CACHE_SIZE") or 2048)
+SCHED_SANITIZE_MAX_CHARS = int(os.getenv("SCHED_SANITIZE_MAX_CHARS") or 65536)
+
+_ALLOWED_CSS = [
+    "background",
+    "background-color",
+    "color",
+    "font-family",
+    "font-size",
+    "font-weight",
+    "line-height",
+    "text-align",
+    "padding",
+    "padding-top",
+    "padding-right",
+    "padding-bottom",
+    "padding-left",
+    "margin",
+    "margin-top",
+    "margin-right",
+    "margin-bottom",
+    "margin-left",
+    "border",
+    "border-top",
+    "border-right",
+    "border-bottom",
+    "border-left",
+    "border-radius",
+    "width",
+    "max-width",
+    "height",
+    "display",
+    "vertical-align",
+    "letter-spacing",
+    "text-transform",
+    "box-shadow",
+    "overflow",
+    "text-decoration",
+]
+
+_SANITIZE_POLICIES = {
+    # _sanitize_html: email body fragments
+    "html": dict(
+        tags=[
+            "div", "p", "br", "b", "strong", "i", "em",
+            "ul", "ol", "li", "span", "small",
+            "h1", "h2", "h3", "h4",
+            "a", "img", "hr",
+            "table", "thead", "tbody", "tr", "th", "td",
+        ],
+        attributes={
+            "*": ["style"],
+            "a": ["href", "target", "rel"],
+            "img": ["src", "alt", "width", "height", "style"],
+        },
+        css_sanitizer=CSSSanitizer(allowed_css_properties=_ALLOWED_CSS),
         strip=True,
-    )
+    ),
+    # raw mode: a whole one-off document
+    "raw": dict(
+        tags=[
+            "html", "head", "body", "meta", "title",
+            "div", "p", "br", "b", "strong", "i", "em", "u",
+            "ul", "ol", "li", "span", "small",
+            "h1", "h2", "h3", "h4",
+            "table", "thead", "tbody", "tr", "th", "td",
+            "a", "img", "hr"
+        ],
+        attributes={
+            "*": ["style"],
+            "a": ["href", "target", "rel"],
+            "img": ["src", "alt", "width", "height", "style"],
+            "meta": ["charset", "name", "content"],
+        },
+        strip=True,
+    ),
+    # message_override as {{content}} in a branded template
+    "content": dict(
+        tags=["b", "strong", "i", "em", "u", "br", "p", "ul", "ol", "li", "div", "span", "a"],
+        attributes={"a": ["href", "target", "rel"]},
+        strip=True,
+    ),
+}
+
+_cleaners = threading.local()
+_sanitized: "OrderedDict[tuple[str, str], str]" = OrderedDict()
+_sanitized_lock = threading.Lock()
+_sanitize_hits = 0
+_sanitize_misses = 0
+
+
+def _cleaner(policy: str) -> Cleaner:
+    by_policy = getattr(_cleaners, "by_policy", None)
+    if by_policy is None:
+        by_policy = _cleaners.by_policy = {}
+    cleaner = by_policy.get(policy)
+    if cleaner is None:
+        cleaner = by_policy[policy] = Cleaner(**_SANITIZE_POLICIES[policy])
+    return cleaner
+
+
+def sanitize(html: str, policy: str = "html") -> str:
+    """
+    bleach-clean html under one of _SANITIZE_POLICIES, memoized.
+    """
+    global _sanitize_hits, _sanitize_misses
+    html = html or ""
+    if len(html) > SCHED_SANITIZE_MAX_CHARS:
+        return _cleaner(policy).clean(html)
+
+    key = (policy, hashlib.sha1(html.encode("utf-8", "surrogatepass")).hexdigest())
+    with _sanitized_lock:
+        cleaned = _sanitized.get(key)
+        if cleaned is not None:
+            _sanitized.move_to_end(key)
+            _sanitize_hits += 1
+            return cleaned
+        _sanitize_misses += 1
+
+    cleaned = _cleaner(policy).clean(html)
+    with _sanitized_lock:
+        _sanitized[key] = cleaned
+        while len(_sanitized) > SCHED_SANITIZE_CACHE_SIZE:
+            _sanitized.popitem(last=False)
     return cleaned
 
+
+def sanitize_cache_stats() -> dict:
+    with _sanitized_lock:
+        return {
+            "size": len(_sanitized),
+            "max": SCHED_SANITIZE_CACHE_SIZE,
+            "hits": _sanitize_hits,
+            "misses": _sanitize_misses,
+        }
+
+
+def _sanitize_html(html: str) -> str:
+    return sanitize(html, "html")
+
 def safe_nl2br(text: str) -> str:
     return (text or "").replace("\n", "<br>")
 
 
-def _wrap_personal_message(inner_html: str) -> str:
-    # inner_html is already sanitized before wrapping
-    wrapped = PERSONAL_MESSAGE_WRAPPER.replace("{{content}}", inner_html)
-    # sanitize again after wrapping (belt + suspenders)
-    return _sanitize_html(wrapped)
+# The wrapper is a constant, so its sanitized halves are computed once and
+# only the user's part goes through the sanitizer on each call.
+_WRAP_MARK = "__sched_wrap_content__"
+_WRAP_HEAD, _WRAP_TAIL = sanitize(
+    PERSONAL_MESSAGE_WRAPPER.replace("{{content}}", "<p>" + _WRAP_MARK + "</p>")
+).split("<p>" + _WRAP_MARK + "</p>")
 
 
-import bleach
+def _wrap_personal_message(inner_html: str) -> str:
+    # inner_html is already sanitized before wrapping; sanitizing it again
+    # (belt + suspenders) is a memo hit unless the content changed
+    return _WRAP_HEAD + _sanitize_html(inner_html) + _WRAP_TAIL
+
 
+def _as_text(value, default=""):
+    return value.strip() if isinstance(value, str) else default
 
 
 def render_scheduler_html(tmpl: str, user: dict, followup: dict, branding: dict) -> str:
-    def as_text(value, default=""):
-        return value.strip() if isinstance(value, str) else default
-
-    sender = as_text(branding.get("company_name"), "Your Company")
-    support_email = as_text(branding.get("support_email"))
-    footer = as_text(branding.get("footer"))
-
-    if support_email and not footer:
-        footer = f"Need help? Contact {support_email}"
-
-    format_type = as_text(followup.get("email_format"), "html").lower()
-    if format_type not in {"text", "html", "raw"}:
-        format_type = "html"
-
-    message_override = as_text(followup.get("message_override"))
-
-    # --- RAW HTML MODE ---
-    # User is editing one-off HTML for this follow-up only.
-    if format_type == "raw" and message_override:
-        safe_body = bleach.clean(
-            message_override,
-            tags=[
-                "html", "head", "body", "meta", "title",
-                "div", "p", "br", "b", "strong", "i", "em", "u",
-                "ul", "ol", "li", "span", "small",
-                "h1", "h2", "h3", "h4",
-                "table", "thead", "tbody", "tr", "th", "td",
-                "a", "img", "hr"
-            ],
-            attributes={
-                "*": ["style"],
-                "a": ["href", "target", "rel"],
-                "img": ["src", "alt", "width", "height", "style"],
-                "meta": ["charset", "name", "content"],
-            },
-            strip=True,
-        )
-        return safe_body.strip()
-
-    # --- TEMPLATE DATA ---
-    # In branded mode, message_override should be available as {{content}}
-    # or ignored by the template if not used.
-    data = {
-        "name": as_text(followup.get("client_name"), "there"),
-        "type": as_text(followup.get("followup_type"), "follow-up"),
-        "description": safe_nl2br(followup.get("description") or "").strip(),
-        "due_date": as_text(followup.get("due_date")),
-        "sender": sender,
-        "company_name": sender,
-        "brand_logo": as_text(branding.get("brand_logo")),
-        "support_email": support_email,
-        "footer": footer,
-        "content": (
-            bleach.clean(
-                message_override.replace("\n", "<br>"),
-                tags=["b", "strong", "i", "em", "u", "br", "p", "ul", "ol", "li", "div", "span", "a"],
-                attributes={"a": ["href", "target", "rel"]},
-                strip=True,
-            ).strip()
-            if message_override else ""
-        ),
-    }
-
-    # --- BRANDED TEMPLATE MODE ---
-    step1 = _render_conditionals(tmpl or "", data)
-    step2 = _render_vars(step1, data)
-
-    final_html = step2.strip()
-
-      # ✅ Smart fallback: inject content if template didn't use it
-      if message_override:
-          if "{{content}}" not in (tmpl or ""):
-              current_app.logger.warning(
-                  "[SMART TEMPLATE] content not used in template → auto injecting"
-              )
-
-              # inject before closing body or append
-              if "</body>" in final_html:
-                  final_html = final_html.replace(
-                      "</body>",
-                      f"<div style='margin-top:20px'>{data['content']}</div></body>"
-                  )
-              else:
-                  final_html += f"<div style='margin-top:20px'>{data['content']}</div>"
-
-      return final_html
\ No newline at end of file
+    return BrandedRenderer(tmpl, user, branding).render(followup)
+
+
+# -------------------------
+# BATCH RENDERING
+# -------------------------
+# A BrandedRenderer holds what every email of one user shares: the compiled
+# template and the branding vars. Build it once and render each followup:
+#
+#     r = BrandedRenderer(tmpl, user, branding)
+#     for f in followups:
+#         html = r.render(f)
+#
+# Send paths that render one followup at a time (outbox handlers) get the
+# user's renderer from cached_renderer(), so a bulk send loads the template
+# and branding once, not once per recipient. Entries live
+# SCHED_RENDERER_CACHE_SECONDS (bounds how stale another process can be);
+# saving a template or branding drops the user's entry
+# (models_saas._drop_render_cache).
+SCHED_RENDERER_CACHE_SECONDS = float(os.getenv("SCHED_RENDERER_CACHE_SECONDS") or 30)
+SCHED_RENDERER_CACHE_SIZE = int(os.getenv("SCHED_RENDERER_CACHE_SIZE") or 1024)
+
+
+class BrandedRenderer:
+    __slots__ = ("user", "branding", "compiled", "key", "_brand")
+
+    def __init__(self, tmpl: str, user: dict, branding: dict, *, cache_template: bool = True):
+        self.user = user or {}
+        self.branding = branding or {}
+        # cache_template=False for throwaway templates (editor previews), so
+        # they don't push saved ones out of the LRU
+        if cache_template:
+            self.compiled = get_compiled_template(self.user.get("id"), tmpl or "")
+        else:
+            self.compiled = compile_template(tmpl or "")
+
+        sender = _as_text(self.branding.get("company_name"), "Your Company")
+        support_email = _as_text(self.branding.get("support_email"))
+        footer = _as_text(self.branding.get("footer"))
+
+        if support_email and not footer:
+            footer = f"Need help? Contact {support_email}"
+
+        self._brand = {
+            "sender": sender,
+            "company_name": sender,
+            "brand_logo": _as_text(self.branding.get("brand_logo")),
+            "support_email": support_email,
+            "footer": footer,
+        }
+        # same key, same output for the same followup
+        self.key = hashlib.sha1(
+            "\x00".join([tmpl or "", *self._brand.values()]).encode("utf-8", "surrogatepass")
+        ).hexdigest()
+
+    def render(self, followup: dict) -> str:
+        format_type = _as_text(followup.get("email_format"), "html").lower()
+        if format_type not in {"text", "html", "raw"}:
+            format_type = "html"
+
+        message_override = _as_text(followup.get("message_override"))
+
+        # --- RAW HTML MODE ---
+        # User is editing one-off HTML for this follow-up only.
+        if format_type == "raw" and message_override:
+            safe_body = sanitize(message_override, "raw")
+            return safe_body.strip()
+
+        # --- TEMPLATE DATA ---
+        # In branded mode, message_override should be available as {{content}}
+        # or ignored by the template if not used.
+        data = {
+            "name": _as_text(followup.get("client_name"), "there"),
+            "type": _as_text(followup.get("followup_type"), "follow-up"),
+            "description": safe_nl2br(followup.get("description") or "").strip(),
+            "due_date": _as_text(followup.get("due_date")),
+            **self._brand,
+            "content": (
+                sanitize(message_override.replace("\n", "<br>"), "content").strip()
+                if message_override else ""
+            ),
+        }
+
+        # --- BRANDED TEMPLATE MODE ---
+        compiled = self.compiled
+        final_html = compiled.render(data).strip()
+
+        # ✅ Smart fallback: inject content if template didn't use it
+        if message_override:
+            if "content" not in compiled.vars:
+                log.warning(
+                    "[SMART TEMPLATE] content not used in template → auto injecting"
+                )
+
+                # inject before closing body or append
+                if "</body>" in final_html:
+                    final_html = final_html.replace(
+                        "</body>",
+                        f"<div style='margin-top:20px'>{data['content']}</div></body>"
+                    )
+                else:
+                    final_html += f"<div style='margin-top:20px'>{data['content']}</div>"
+
+        return final_html
+
+
+_renderers: dict[int, tuple[BrandedRenderer, float]] = {}  # uid -> (renderer, loaded_at)
+_renderers_lock = threading.Lock()
+_renderers_generation = 0
+
+
+def cached_renderer(user: dict, load) -> BrandedRenderer:
+    """
+    The user's BrandedRenderer, built from load() -> (tmpl, branding) when
+    there's no fresh one.
+    """
+    uid = int(user["id"])
+    now = time.monotonic()
+    with _renderers_lock:
+        hit = _renderers.get(uid)
+        generation = _renderers_generation
+    if hit and now - hit[1] < SCHED_RENDERER_CACHE_SECONDS:
+        return hit[0]
+
+    tmpl, branding = load()
+    renderer = BrandedRenderer(tmpl, user, branding)
+    with _renderers_lock:
+        # skip the store if a save landed while we were loading
+        if generation == _renderers_generation:
+            if len(_renderers) >= SCHED_RENDERER_CACHE_SIZE:
+                _renderers.clear()
+            _renderers[uid] = (renderer, now)
+    return renderer
+
+
+def invalidate_renderers(user_id: int | None = None) -> None:
+    global _renderers_generation
+    with _renderers_lock:
+        _renderers_generation += 1
+        if user_id is None:
+            _renderers.clear()
+        else:
+            _renderers.pop(int(user_id), None)
@@ -8,9 +8,8 @@ import textwrap
 
 
 from gmail_sync import send_email_gmail  # your Gmail sender
-from models_saas import get_branding
 from email_scheduler import send_branded_email_gmail
-from email_scheduler import build_branded_email_html
+from email_scheduler import branded_renderer, build_branded_email_html
 
 # -----------------------------
 # Phone helpers
@@ -25,7 +24,7 @@ from googleapiclient.discovery import build
 # ---------- Placeholder helpers ----------
 
 
-from gmail_sync import  _creds_from_user
+from gmail_sync import  _creds_from_user, _service_for_user, persist_refreshed_token
 
 
 def _save_refreshed_token(user_id, creds):
@@ -66,15 +65,14 @@ def send_plain_text_email(user: dict, to_email: str, subject: str, body: str):
 
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
 
-    creds = _creds_from_user(user)
-    service = build("gmail", "v1", credentials=creds)
+    service = _service_for_user(user)
 
     sent = service.users().messages().send(
         userId="me",
         body={"raw": raw}
     ).execute()
 
-    _save_refreshed_token(user["id"], creds)
+    persist_refreshed_token(user)
 
     return sent.get("id")
 
@@ -344,15 +342,14 @@ def send_email(user: dict, to_email: str, subject: str, body: str, *, is_html: b
     # Encode for Gmail API
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
 
-    creds = _creds_from_user(user)
-    service = build("gmail", "v1", credentials=creds)
+    service = _service_for_user(user)
 
     sent = service.users().messages().send(
         userId="me",
         body={"raw": raw}
     ).execute()
 
-    _save_refreshed_token(user["id"], creds)
+    persist_refreshed_token(user)
     return sent.get("id")
 
 
@@ -506,7 +503,7 @@ def send_via_preference(user: dict, f: dict, message: str | None):
             logger.debug("[EMAIL] Sending text-style email to %s", email)
 
             formatted = format_plain_text_message(raw_message)
-            branding = get_branding(user.get("id")) or {}
+            branding = branded_renderer(user).branding
             html_body = render_text_email_html(user, f, formatted, branding)
 
             send_meta = send_email_gmail(
@@ -17,7 +17,7 @@ os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, session, Response, current_app, abort, jsonify
+    flash, session, Response, current_app, abort, jsonify, g, send_file
 )
 
 
@@ -48,6 +48,9 @@ from models_saas import (
     create_user,
     get_user_by_email,
     get_user_by_id,
+    get_user_cached,
+    invalidate_user_cache,
+    user_cache_generation,
     is_trial_active,
     activate_subscription,
     update_gmail_token,
@@ -61,6 +64,10 @@ from models_saas import (
     update_followup,
     get_followup,
     get_user_followups,
+    list_followups_page,
+    LIST_PAGE_SIZE,
+    LIST_DEFAULT_STATUSES,
+    get_followups_by_ids,
     update_followup_due_date,
     delete_followup,
     mark_followup_done_by_id,
@@ -102,15 +109,23 @@ from models_saas import (
     delete_email_template,
 
     # analytics/admin
+    analytics_range,
     get_analytics_data,
+    iter_analytics_series,
     stats_overview,
     get_all_users,
 
-    # done count
+    # done count / badges (user_counters)
     count_done,
+    count_unread_notifications,
+    get_user_counters,
 
     # message override
     update_followup_message_override,
+
+    # CSV export (web/csv_export.py)
+    FOLLOWUP_EXPORT_COLUMNS,
+    iter_followups_export,
 )
 
 # -----------------------------
@@ -121,10 +136,11 @@ from flask_socketio import SocketIO
 import os
 import secrets
 import stripe
-from database import init_db, ensure_auth_columns
+from database import init_db, ensure_auth_columns, ensure_followup_reply_columns
 
 init_db()
 ensure_auth_columns()
+ensure_followup_reply_columns()  # reply columns + idx_followups_reply_tracked
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY") or secrets.token_urlsafe(32)
@@ -173,7 +189,7 @@ werkzeug_logger.addFilter(_NoSocketIOFilter())
 
 @app.get("/import-csv-mapped/status/<job_id>")
 def import_csv_mapped_status(job_id):
-    job = IMPORT_JOBS.get(job_id)
+    job = import_jobs.status(job_id, user_id=_get_user_id())
     if not job:
         return jsonify({"ok": False, "error": "job_not_found"}), 404
     return jsonify({"ok": True, "job": job})
@@ -217,6 +233,27 @@ OPEN_ENDPOINTS = {
 
 
 
+def current_user() -> dict | None:
+    """
+    The logged-in user for this request, loaded once and kept on flask.g
+    (the gates, inject_globals and require_user all ask for it). Reloaded if
+    the session user changes or a users row is written mid-request.
+    """
+    uid = session.get("user_id")
+    if not uid:
+        return None
+
+    uid = int(uid)
+    generation = user_cache_generation()
+    hit = g.get("_current_user")
+    if hit and hit[0] == uid and hit[1] == generation:
+        return hit[2]
+
+    user = get_user_cached(uid)
+    g._current_user = (uid, generation, user)
+    return user
+
+
 @app.before_request
 def gate_auth_and_verify():
     ep = request.endpoint or ""
@@ -229,7 +266,7 @@ def gate_auth_and_verify():
     if not uid:
         return redirect(url_for("login"))
 
-    user = get_user_by_id(int(uid))
+    user = current_user()
     if not user:
         session.clear()
         return redirect(url_for("login"))
@@ -252,7 +289,7 @@ def gate_billing():
     if not uid:
         return None  # auth gate handles redirect to login
 
-    user = get_user_by_id(int(uid))
+    user = current_user()
     if not user:
         return None
 
@@ -324,7 +361,7 @@ def require_user():
         flash("Please log in.", "warning")
         return None, redirect(url_for("login"))
 
-    user = get_user_by_id(int(uid))
+    user = current_user()
     if not user:
         session.clear()
         flash("Session expired. Login again.", "warning")
@@ -349,7 +386,7 @@ from models_saas import add_followup,bulk_mark_done,bulk_delete_followups
 
 import os, tempfile
 from flask import request, render_template, redirect, url_for, flash
-from import_csv import import_followups_from_csv
+from import_csv import import_followups_from_csv, sniff_csv, DATE_FORMATS
 from models_saas import looks_like_text_file
 from models_saas import allowed_file
 def _get_user_id():
@@ -377,6 +414,31 @@ def update_smart_settings(fid):
     flash("Smart follow-up updated", "success")
     return redirect(url_for("preview", fid=fid))
 
+IMPORT_UPLOADS_KEPT = 5  # pending uploads remembered per session
+
+
+def _remember_upload(path: str) -> str:
+    token = secrets.token_urlsafe(16)
+    uploads = dict(session.get("import_uploads") or {})
+    uploads[token] = os.path.basename(path)
+    session["import_uploads"] = dict(list(uploads.items())[-IMPORT_UPLOADS_KEPT:])
+    return token
+
+
+def _take_upload(token: str) -> str | None:
+    """This session's upload for token (then forgotten), resolved inside UPLOAD_FOLDER."""
+    uploads = dict(session.get("import_uploads") or {})
+    name = uploads.pop(token or "", None)
+    if not name:
+        return None
+    try:
+        path = import_jobs.resolve_upload(os.path.join(app.config["UPLOAD_FOLDER"], name))
+    except ValueError:
+        return None
+    session["import_uploads"] = uploads
+    return path
+
+
 @app.route("/import-csv", methods=["GET", "POST"])
 def import_csv():
     user_id = _get_user_id()
@@ -405,7 +467,7 @@ def import_csv():
 
     if up and up.filename != "":
         safe = secure_filename(up.filename)
-        tmp_path = os.path.join(app.config["UPLOAD_FOLDER"], f"fu_{uuid.uuid4().hex}_{safe}")
+        tmp_path = os.path.join(app.config["UPLOAD_FOLDER"], import_jobs.upload_name(safe))
         up.save(tmp_path)
     else:
         flash("Pick a CSV file first.", "danger")
@@ -420,19 +482,25 @@ def import_csv():
             pass
         return redirect(url_for("import_csv"))
 
-    # read headers
-    with open(tmp_path, "r", newline="", encoding="utf-8-sig") as f:
-        reader = csv.reader(f)
-        headers = next(reader, [])
+    # one bounded read: encoding, delimiter, headers, preview, column guesses
+    # (cached next to the upload, the import job reuses it)
+    sniffed = sniff_csv(tmp_path)
+    headers = sniffed["headers"]
 
     if not headers:
         flash("CSV file has no header row.", "danger")
         return redirect(url_for("import_csv"))
 
+    # the mapping form only carries an opaque token; the path stays server side
+    upload = _remember_upload(tmp_path)
+
     return render_template(
         "import_map.html",
-        tmp_path=tmp_path,
+        upload=upload,
         headers=headers,
+        preview=sniffed["preview"],
+        sniff=sniffed,
+        date_formats=DATE_FORMATS,
     )
 
 
@@ -546,7 +614,7 @@ def preview_render_email(fid):
     if block:
         return block
 
-    f = get_followup(fid, user["id"])
+    f = preview_cache.followup_row(user["id"], fid, lambda: get_followup(fid, user["id"]))
     if not f:
         return Response(
             "<div style='padding:20px;font-family:sans-serif;'>Follow-up not found.</div>",
@@ -574,8 +642,19 @@ def preview_render_email(fid):
         email_format = "html"
     preview_f["email_format"] = email_format
 
-    html_doc = build_branded_email_html(user, preview_f)
-    return Response(html_doc, mimetype="text/html")
+    # same inputs (template + branding via renderer.key, followup fields) -> cached document
+    renderer = branded_renderer(user)
+    etag, html_doc = preview_cache.render(
+        user["id"],
+        fid,
+        preview_cache.content_key(renderer.key, preview_f),
+        lambda: build_branded_email_html(user, preview_f, renderer),
+    )
+
+    # clients that send the etag they're showing get JSON (maybe a diff)
+    if "base" in data:
+        return jsonify(preview_cache.body(user["id"], etag, html_doc, data.get("base")))
+    return Response(html_doc, mimetype="text/html", headers={"ETag": etag})
 
 
 @app.route("/preview/<int:fid>/reset", methods=["POST"])
@@ -605,7 +684,9 @@ def preview_reset(fid):
 from flask import request, Response
 from models_saas import get_followup
 
-from email_scheduler import build_branded_email_html  # wherever you placed it
+from email_scheduler import branded_renderer, build_branded_email_html  # wherever you placed it
+from web import csv_export
+from web import preview_cache
 
 # @app.route("/preview/<int:fid>/render-email", methods=["GET", "POST"])
 # def preview_render_email(fid):
@@ -669,7 +750,7 @@ from email_scheduler import build_branded_email_html  # wherever you placed it
 #     return Response(html_doc, mimetype="text/html")
 
 from flask import jsonify, request
-from scheduler_render import render_scheduler_html, DEFAULT_SCHEDULER_TEMPLATE
+from scheduler_render import BrandedRenderer, render_scheduler_html, DEFAULT_SCHEDULER_TEMPLATE
 from models_saas import get_branding
 
 
@@ -695,24 +776,42 @@ def scheduler_template_preview():
         "name": user.get("name") or "You",
     }
 
-    branding = get_branding(int(user["id"])) or {}
+    branding = branded_renderer(user).branding
 
     try:
-        preview_html = render_scheduler_html(
-            tmpl=tmpl,
-            user=sample_user,
-            followup=sample_followup,
-            branding=branding,
+        etag, preview_html = preview_cache.render(
+            user["id"],
+            "template",
+            preview_cache.content_key(tmpl, branding),
+            lambda: BrandedRenderer(tmpl, sample_user, branding, cache_template=False).render(sample_followup),
         )
-        return jsonify({"ok": True, "preview_html": preview_html})
     except Exception as e:
         return jsonify({"ok": False, "error": f"{type(e).__name__}: {e}"}), 400
 
+    if "base" in data:
+        return jsonify(preview_cache.body(user["id"], etag, preview_html, data.get("base")))
+    return jsonify({"ok": True, "etag": etag, "preview_html": preview_html})
+
 
 import uuid
 from flask_socketio import join_room
 
-IMPORT_JOBS = {}  # job_id -> {"status": "...", "result": {...}}
+# Import job state lives in the import_jobs table (web/import_jobs.py), so any
+# worker can answer a status poll and a crashed import resumes from its last chunk.
+from web import import_jobs
+
+
+def _emit_import_event(event: str, job_id: str, payload: dict) -> None:
+    socketio.emit(event, {"job_id": job_id, **payload}, room=job_id)
+
+
+import_jobs.register_notifier(_emit_import_event)
+import_jobs.set_upload_dir(app.config["UPLOAD_FOLDER"])
+
+# followup status changes -> the owner's room; open dashboards patch rows
+from web import live_updates
+
+live_updates.init(socketio)
 
 @socketio.on("join_import")
 def on_join_import(data):
@@ -724,10 +823,19 @@ def on_join_import(data):
 
 @app.get("/import-csv-mapped/result/<job_id>")
 def import_csv_job_result(job_id):
-    data = IMPORT_JOBS.get(job_id)
-    if not data:
+    job = import_jobs.get(job_id, user_id=_get_user_id())
+    if not job:
         return jsonify({"ok": False, "error": "not_found"}), 404
-    return jsonify({"ok": True, **data})
+    return jsonify({"ok": True, "status": job["status"], "result": job["result"]})
+
+
+@app.get("/import-csv-mapped/rejected/<job_id>")
+def import_csv_rejected_rows(job_id):
+    # rows the import skipped (no email, bad date/phone), with the reason, as CSV
+    path = import_jobs.rejected_file(job_id, _get_user_id())
+    if not path:
+        abort(404)
+    return send_file(path, mimetype="text/csv", as_attachment=True, download_name=f"import_{job_id[:8]}_rejected.csv")
 
 
 
@@ -773,14 +881,15 @@ def import_csv_job_result(job_id):
 #     return redirect(url_for("dashboard"))
 
 
-from import_csv import import_followups_from_csv
+from import_csv import IMPORT_MODES
 
 @app.post("/import-csv-mapped/start")
 def import_csv_mapped_start():
     user_id = _get_user_id()
 
-    tmp_path = (request.form.get("tmp_path") or "").strip()
-    if not tmp_path or not os.path.exists(tmp_path):
+    # validate everything before the token is used up
+    upload = (request.form.get("upload") or "").strip()
+    if upload not in (session.get("import_uploads") or {}):
         return jsonify({"ok": False, "error": "missing_file"}), 400
 
     mapping = {
@@ -790,33 +899,25 @@ def import_csv_mapped_start():
         "description": request.form.get("col_desc"),
         "due_date": request.form.get("col_due"),
         "preferred_channel": request.form.get("preferred_channel") or "email",
+        "due_date_format": request.form.get("due_date_format") or None,
     }
 
+    if mapping["due_date_format"] and mapping["due_date_format"] not in DATE_FORMATS:
+        return jsonify({"ok": False, "error": "bad_date_format"}), 400
+
     if not (mapping.get("email") or "").strip():
         return jsonify({"ok": False, "error": "missing_email_mapping"}), 400
 
-    job_id = uuid.uuid4().hex
-    IMPORT_JOBS[job_id] = {"status": "running", "result": None}
+    import_mode = (request.form.get("import_mode") or "skip").strip().lower()
+    if import_mode not in IMPORT_MODES:
+        return jsonify({"ok": False, "error": "bad_import_mode"}), 400
 
-    def _run_job():
-        def progress_cb(done, total):
-            pct = 100 if total <= 0 else int((done / total) * 100)
-            socketio.emit("import_progress", {"job_id": job_id, "done": done, "total": total, "pct": pct}, room=job_id)
-
-        try:
-            result = import_followups_from_csv(tmp_path, user_id, mapping=mapping, progress_cb=progress_cb)
-            IMPORT_JOBS[job_id] = {"status": "done", "result": result}
-            socketio.emit("import_done", {"job_id": job_id, "result": result}, room=job_id)
-        except Exception as e:
-            IMPORT_JOBS[job_id] = {"status": "error", "result": {"error": str(e)}}
-            socketio.emit("import_error", {"job_id": job_id, "error": str(e)}, room=job_id)
-        finally:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+    tmp_path = _take_upload(upload)
+    if not tmp_path:
+        return jsonify({"ok": False, "error": "missing_file"}), 400
 
-    socketio.start_background_task(_run_job)
+    job_id = import_jobs.create(user_id, tmp_path, mapping, import_mode)
+    socketio.start_background_task(import_jobs.run, job_id)
 
     return jsonify({"ok": True, "job_id": job_id})
 
@@ -1196,6 +1297,165 @@ def preview_edit_all(fid):
 #     return redirect(url_for("dashboard"))
 
 
+# -----------------------------
+# OUTBOX (manual / bulk / preview sends)
+# -----------------------------
+# Request paths enqueue into the durable outbox (web/outbox.py). Single
+# sends are then delivered in the request so the user still gets an answer;
+# anything that fails stays queued and is retried by the scheduler.
+import hashlib
+import json
+from web import outbox
+from models_saas import save_outbound_gmail_metadata
+
+_OUTBOX_OVERRIDE_FIELDS = (
+    "client_name",
+    "email",
+    "followup_type",
+    "description",
+    "message_override",
+    "email_format",
+    "preferred_channel",
+)
+
+
+def _outbox_send_followup(item: dict) -> dict | None:
+    uid = int(item["user_id"])
+    fid = int(item["followup_id"])
+    payload = item.get("payload") or {}
+
+    user = get_user_by_id(uid)
+    f = get_followup(fid, uid)
+    if not user or not f:
+        return None
+
+    if f.get("status") in ("done", "replied", "deleted"):
+        current_app.logger.info("[OUTBOX] skipping followup=%s status=%s", fid, f.get("status"))
+        return None
+
+    merged = dict(f)
+    merged.update(payload.get("overrides") or {})
+
+    if payload.get("record", True):
+        mark_send_attempt(fid, uid)
+
+    channel_used, error, send_meta = send_via_preference(user, merged, payload.get("message"))
+
+    current_app.logger.info(
+        "[OUTBOX SEND] followup=%s source=%s channel=%s error=%s send_meta=%s",
+        fid,
+        payload.get("source"),
+        channel_used,
+        error,
+        send_meta,
+    )
+
+    if error:
+        raise RuntimeError(error)
+
+    return {"channel": channel_used, **(send_meta or {})}
+
+
+def _outbox_complete_followup(item: dict, result: dict) -> None:
+    uid = int(item["user_id"])
+    fid = int(item["followup_id"])
+    payload = item.get("payload") or {}
+
+    if payload.get("record", True):
+        if result.get("message_id"):
+            save_outbound_gmail_metadata(
+                fid=fid,
+                user_id=uid,
+                gmail_message_id=result.get("message_id") or "",
+                gmail_thread_id=result.get("thread_id") or "",
+            )
+
+        mark_send_success(fid, uid)
+        if payload.get("chase"):
+            update_chase_stage(fid, uid)
+
+    notify = payload.get("notify")
+    if notify:
+        add_notification(uid, notify.replace("{channel}", str(result.get("channel") or "")))
+
+
+def _outbox_fail_followup(item: dict, error: str) -> None:
+    if (item.get("payload") or {}).get("record", True):
+        mark_send_failed(int(item["followup_id"]), int(item["user_id"]), error)
+
+
+outbox.register_handler(
+    "followup",
+    send=_outbox_send_followup,
+    complete=_outbox_complete_followup,
+    fail=_outbox_fail_followup,
+)
+
+
+def enqueue_followup_send(
+    user_id: int,
+    f: dict,
+    *,
+    source: str,
+    overrides: dict | None = None,
+    message: str | None = None,
+    record: bool = True,
+    chase: bool = False,
+    notify: str | None = None,
+) -> int:
+    """
+    One outbox item per followup send. The idempotency key only changes after
+    a successful send (sent_count), so double submits and retries collapse
+    into the same item; a resend while it is still queued replaces its
+    payload (see outbox.enqueue). Non-recording sends (preview) are keyed by
+    content.
+    """
+    overrides = {k: v for k, v in (overrides or {}).items() if k in _OUTBOX_OVERRIDE_FIELDS}
+    payload = {
+        "source": source,
+        "overrides": overrides,
+        "message": message,
+        "record": record,
+        "chase": chase,
+        "notify": notify,
+    }
+
+    if record:
+        key = f"send:{f['id']}:{int(f.get('sent_count') or 0)}"
+    else:
+        digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+        key = f"{source}:{f['id']}:{digest}:{datetime.utcnow():%Y%m%d%H%M}"
+
+    return outbox.enqueue(user_id, f["id"], "followup", payload, key)
+
+
+def deliver_followup_send(item_id: int) -> tuple[str, dict]:
+    """
+    Try the queued send right away. Returns (status, item) where status is
+    "done", "skipped" (nothing was sent: the followup is gone, done or
+    replied), "queued" (will retry), "deferred" (over a send limit) or "dead".
+    """
+    status = outbox.deliver_now(current_app._get_current_object(), item_id)
+    item = outbox.get_item(item_id) or {}
+    if status in ("retry", "inflight", "lost"):
+        status = "queued"
+    return status, item
+
+
+def flash_send_outcome(status: str, item: dict, sent_message: str) -> None:
+    if status == "done":
+        channel = (item.get("result") or {}).get("channel") or "Email"
+        flash(sent_message.replace("{channel}", channel), "success")
+    elif status == "skipped":
+        flash("Not sent. This follow-up is already done, replied or deleted.", "warning")
+    elif status == "dead":
+        flash(map_send_error(RuntimeError(item.get("last_error") or "")), "danger")
+    elif status == "deferred":
+        flash("Sending limit reached. It's queued and will go out automatically.", "warning")
+    else:
+        flash("Couldn't send right now. It's queued and will be retried automatically.", "warning")
+
+
 @app.route("/preview/<int:fid>/send-now", methods=["POST"])
 def preview_send_now(fid):
     user, block = require_user()
@@ -1249,23 +1509,27 @@ def preview_send_now(fid):
     temp_followup["preferred_channel"] = "email"
 
     try:
-        channel_used, error = send_via_preference(user, temp_followup, None)
+        item_id = enqueue_followup_send(
+            user["id"],
+            f,
+            source="preview",
+            overrides=temp_followup,
+            record=False,
+            notify=f"Preview send via {{channel}} to {temp_followup.get('client_name', '')}",
+        )
+        status, item = deliver_followup_send(item_id)
 
         current_app.logger.info(
-            "[PREVIEW SEND] followup=%s channel=%s error=%s",
+            "[PREVIEW SEND] followup=%s outbox_item=%s status=%s",
             fid,
-            channel_used,
-            error,
+            item_id,
+            status,
         )
 
-        if error:
-            raise RuntimeError(error)
-
-        add_notification(
-            user["id"],
-            f"Preview send via {channel_used} to {temp_followup.get('client_name', '')}"
-        )
-        flash(f"Preview message sent via {channel_used} ✅", "success")
+        if status == "dead":
+            flash("Preview send failed. Please try again.", "danger")
+        else:
+            flash_send_outcome(status, item, "Preview message sent via {channel} ✅")
 
     except Exception as e:
         current_app.logger.exception("Preview send failed")
@@ -1309,13 +1573,13 @@ def bulk_action():
             flash("Gmail not connected. Go to Settings and connect Gmail first.", "danger")
             return redirect(url_for("dashboard"))
 
-        sent = 0
-        failed = 0
+        queued = 0
+        skipped = 0
 
         for fid in ids:
             f = get_followup(fid, user_id)
             if not f:
-                failed += 1
+                skipped += 1
                 current_app.logger.warning("[BULK SEND] followup not found fid=%s user_id=%s", fid, user_id)
                 continue
 
@@ -1327,51 +1591,41 @@ def bulk_action():
                 )
                 continue
 
-            mark_send_attempt(fid, user_id)
+            # Message source rules:
+            # - text email: use override if present, else description
+            # - html/raw email: renderer will use followup data + message_override internally
+            email_format = (f.get("email_format") or "html").strip().lower()
+            message_override = (f.get("message_override") or "").strip()
+            description = (f.get("description") or "").strip()
 
-            try:
-                # Message source rules:
-                # - text email: use override if present, else description
-                # - html/raw email: renderer will use followup data + message_override internally
-                email_format = (f.get("email_format") or "html").strip().lower()
-                message_override = (f.get("message_override") or "").strip()
-                description = (f.get("description") or "").strip()
-
-                if email_format == "text":
-                    message = message_override or description
-                else:
-                    # For html/raw, pass override if present so send_via_preference
-                    # can inject it into the builder when needed.
-                    message = message_override or ""
-
-                channel_used, error = send_via_preference(user, f, message)
+            if email_format == "text":
+                message = message_override or description
+            else:
+                # For html/raw, pass override if present so send_via_preference
+                # can inject it into the builder when needed.
+                message = message_override or ""
 
-                current_app.logger.info(
-                    "[BULK SEND] followup=%s channel_used=%s error=%s",
-                    fid,
-                    channel_used,
-                    error,
-                )
-
-                if error:
-                    raise RuntimeError(error)
-
-                mark_send_success(fid, user_id)
-                update_chase_stage(fid, user_id)
-                add_notification(
+            try:
+                enqueue_followup_send(
                     user_id,
-                    f"Sent {channel_used} to {f.get('client_name', '')}"
+                    f,
+                    source="bulk",
+                    message=message,
+                    chase=True,
+                    notify=f"Sent {{channel}} to {f.get('client_name', '')}",
                 )
-                sent += 1
+                queued += 1
+            except Exception:
+                current_app.logger.exception("[BULK SEND] enqueue failed followup=%s", fid)
+                skipped += 1
 
-            except Exception as e:
-                current_app.logger.exception("[BULK SEND] failed followup=%s", fid)
-                mark_send_failed(fid, user_id, str(e))
-                failed += 1
+        # outbox workers send them in the background (per-user concurrency, retries)
+        outbox.kick(current_app._get_current_object())
 
         flash(
-            f"Bulk send complete ✅ Sent {sent}, Failed {failed}.",
-            "success" if sent else "warning",
+            f"Bulk send queued ✅ {queued} sending now"
+            + (f", {skipped} skipped." if skipped else "."),
+            "success" if queued else "warning",
         )
         return redirect(url_for("dashboard"))
 
@@ -1558,7 +1812,7 @@ def billing_gate():
     if not uid:
         return redirect(url_for("login"))
 
-    user = get_user_by_id(int(uid))
+    user = current_user()
     if not user:
         session.clear()
         return redirect(url_for("login"))
@@ -1600,6 +1854,7 @@ OPEN_ENDPOINTS = {
     "reset_password_submit",      # ✅ add this
     "reset_password",             # ✅ if you have a GET page
     "static","landing","/","google_verification",
+    "scheduler_metrics",          # scrape endpoint; token-checked in the view
 }
 
 # @app.before_request
@@ -1677,7 +1932,7 @@ def stripe_webhook():
 @app.context_processor
 def inject_globals():
     uid = session.get("user_id")
-    user = get_user_by_id(uid) if uid else None
+    user = current_user()
 
     if not user:
         branding = {"color": "#36A2EB", "logo": url_for("static", filename="logo.png")}
@@ -1931,6 +2186,7 @@ def auth_google_callback():
     """, (now, uid))
     conn.commit()
     conn.close()
+    invalidate_user_cache(uid)
 
     # ✅ IMPORTANT: clear anything that forces verify flow
     session.pop("pending_verify_user_id", None)
@@ -2009,6 +2265,7 @@ def _store_email_verify_code(user_id: int, code: str, minutes: int = 15):
     """, (code_hash, expires, int(user_id)))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user_id))
 
 def _send_verify_code_email(to_email: str, code: str):
     send_email_smtp(
@@ -2164,32 +2421,26 @@ def preview_send_followup(fid):
         return redirect(url_for("preview", fid=fid))
 
     try:
-        mark_send_attempt(fid, user["id"])
-
-        channel_used, error = send_via_preference(user, merged, None)
+        item_id = enqueue_followup_send(
+            user["id"],
+            f,
+            source="preview_send",
+            overrides=merged,
+            notify=f"Sent {{channel}} to {merged.get('client_name', '')}",
+        )
+        status, item = deliver_followup_send(item_id)
 
         current_app.logger.info(
-            "[PREVIEW SEND] followup=%s channel=%s error=%s format=%s",
+            "[PREVIEW SEND] followup=%s outbox_item=%s status=%s format=%s",
             fid,
-            channel_used,
-            error,
+            item_id,
+            status,
             merged["email_format"],
         )
 
-        if error:
-            raise RuntimeError(error)
-
-        mark_send_success(fid, user["id"])
-
-        add_notification(
-            user["id"],
-            f"Sent {channel_used} to {merged.get('client_name', '')}"
-        )
-
-        flash(f"Message sent via {channel_used} ✅", "success")
+        flash_send_outcome(status, item, "Message sent via {channel} ✅")
 
     except Exception as e:
-        mark_send_failed(fid, user["id"], str(e))
         current_app.logger.exception("Preview send failed")
         flash(map_send_error(e), "danger")
 
@@ -2358,40 +2609,26 @@ def send_followup(fid):
         return redirect(url_for("preview", fid=fid))
 
     try:
-        mark_send_attempt(fid, user["id"])
-
-        channel_used, error, send_meta = send_via_preference(user, merged, None)
+        item_id = enqueue_followup_send(
+            user["id"],
+            f,
+            source="send",
+            overrides=merged,
+            notify=f"Sent {{channel}} to {merged.get('client_name', '')}",
+        )
+        status, item = deliver_followup_send(item_id)
 
         current_app.logger.info(
-            "[SEND] followup=%s channel=%s error=%s send_meta=%s",
+            "[SEND] followup=%s outbox_item=%s status=%s result=%s",
             fid,
-            channel_used,
-            error,
-            send_meta,
-        )
-
-        if error:
-            raise RuntimeError(error)
-
-        if send_meta:
-            save_outbound_gmail_metadata(
-                fid=fid,
-                user_id=user["id"],
-                gmail_message_id=send_meta.get("message_id") or "",
-                gmail_thread_id=send_meta.get("thread_id") or "",
-            )
-
-        mark_send_success(fid, user["id"])
-
-        add_notification(
-            user["id"],
-            f"Sent {channel_used} to {merged.get('client_name', '')}"
+            item_id,
+            status,
+            item.get("result"),
         )
 
-        flash(f"Message sent via {channel_used} ✅", "success")
+        flash_send_outcome(status, item, "Message sent via {channel} ✅")
 
     except Exception as e:
-        mark_send_failed(fid, user["id"], str(e))
         current_app.logger.exception("Send failed")
         flash(map_send_error(e), "danger")
 
@@ -2400,6 +2637,7 @@ def send_followup(fid):
 # in web/app.py
 
 from web.reply_detector import run_reply_detection_for_user
+from models_saas import get_gmail_history_id, save_gmail_history_id
 from web.reply_detector_db import (
     get_reply_tracked_followups,
     mark_followup_replied as db_mark_followup_replied,
@@ -2438,6 +2676,8 @@ def run_reply_detection():
             mark_followup_replied=_mark_followup_replied,
             disable_followup_schedule=_disable_followup_schedule,
             add_notification=add_notification,
+            history_id=get_gmail_history_id(user["id"]),
+            save_history_id=lambda hid: save_gmail_history_id(user["id"], hid),
         )
 
         if results:
@@ -2589,9 +2829,88 @@ def dashboard():
     if block:
         return block
 
-    followups = get_user_followups(user["id"])
+    try:
+        page = list_followups_page(user["id"], **_listing_filters())
+    except ValueError:
+        page = list_followups_page(user["id"])
     done = count_done(user["id"])
-    return render_template("dashboard.html", due_soon=followups, done=done)
+    return render_template("dashboard.html", due_soon=page["items"], page=page, done=done)
+
+
+# -----------------------------
+# FOLLOWUP LISTING API (lazy-loaded pages for dashboard/schedule)
+# -----------------------------
+_LISTING_ROW_TEMPLATES = {
+    "dashboard": "_dashboard_rows.html",
+    "schedule": "_schedule_rows.html",
+}
+
+
+def _listing_filters() -> dict:
+    """
+    ?sort=due|created&status=a,b&type=...&channel=email|whatsapp
+    """
+    statuses = [s for s in (request.args.get("status") or "").split(",") if s.strip()]
+    return {
+        "sort": (request.args.get("sort") or "due").strip().lower(),
+        "statuses": statuses or None,
+        "followup_type": (request.args.get("type") or "").strip() or None,
+        "channel": (request.args.get("channel") or "").strip() or None,
+    }
+
+
+@app.get("/api/followups")
+def api_followups():
+    user, block = require_user()
+    if block:
+        return jsonify({"ok": False, "error": "login_required"}), 401
+
+    try:
+        page = list_followups_page(
+            user["id"],
+            cursor=(request.args.get("cursor") or "").strip() or None,
+            limit=request.args.get("limit", type=int) or LIST_PAGE_SIZE,
+            **_listing_filters(),
+        )
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    body = {"ok": True, **page}
+    template = _LISTING_ROW_TEMPLATES.get(request.args.get("view") or "")
+    if template:
+        body["html"] = render_template(template, followups=page["items"])
+    return jsonify(body)
+
+
+@app.get("/api/followups/rows")
+def api_followup_rows():
+    """
+    ?ids=1,2,3&view=dashboard plus the page's own filters: fresh HTML for
+    rows a live update said changed. Rows that no longer match the filters
+    come back in "removed".
+    """
+    user, block = require_user()
+    if block:
+        return jsonify({"ok": False, "error": "login_required"}), 401
+
+    template = _LISTING_ROW_TEMPLATES.get(request.args.get("view") or "")
+    if not template:
+        return jsonify({"ok": False, "error": "unknown view"}), 400
+
+    ids = [int(x) for x in (request.args.get("ids") or "").split(",") if x.strip().isdigit()]
+    filters = _listing_filters()
+    statuses = {s.strip().lower() for s in (filters["statuses"] or LIST_DEFAULT_STATUSES)}
+
+    def listed(f: dict) -> bool:
+        return (
+            (f.get("status") or "") in statuses
+            and (not filters["followup_type"] or f.get("followup_type") == filters["followup_type"])
+            and (not filters["channel"] or (f.get("preferred_channel") or "email") == filters["channel"].lower())
+        )
+
+    items = [f for f in get_followups_by_ids(user["id"], ids) if listed(f)]
+    rows = {f["id"]: render_template(template, followups=[f]) for f in items}
+    return jsonify({"ok": True, "rows": rows, "removed": [i for i in ids if i not in rows]})
 
 
 
@@ -2893,6 +3212,7 @@ def send_password_reset_code(uid: int, email: str):
     """, (code, expires.isoformat(), uid))
     conn.commit()
     conn.close()
+    invalidate_user_cache(uid)
 
     subject = "Reset your password"
     html = f"""
@@ -3009,6 +3329,7 @@ def reset_password_submit():
         """, (pw_hash, int(uid)))
         conn.commit()
         conn.close()
+        invalidate_user_cache(int(uid))
 
         # cleanup reset session
         session.pop("reset_ok", None)
@@ -3060,6 +3381,7 @@ def forgot_password_new():
         """, (generate_password_hash(pw), uid))
         conn.commit()
         conn.close()
+        invalidate_user_cache(uid)
 
         session.clear()
         flash("Password reset successful. Login now.", "success")
@@ -3227,9 +3549,12 @@ def schedule():
     if block:
         return block
 
-    followups = get_user_followups(user["id"])
+    try:
+        page = list_followups_page(user["id"], **_listing_filters())
+    except ValueError:
+        page = list_followups_page(user["id"])
     scheduler = get_scheduler_settings(user["id"])
-    return render_template("schedule.html", followups=followups, scheduler=scheduler)
+    return render_template("schedule.html", followups=page["items"], page=page, scheduler=scheduler)
 
 
 def _iso_local_picker(dt: str) -> str:
@@ -3548,7 +3873,7 @@ def _gmail_get_profile_email(creds) -> str | None:
         return None
 
 
-from models_saas import get_user_by_id, save_gmail_email, save_gmail_token
+from models_saas import get_user_by_id, save_gmail_email, save_gmail_token, save_gmail_history_id
 
 # make sure these exist in your module
 # CLIENT_SECRETS = "path/to/client_secret.json"
@@ -3681,6 +4006,8 @@ def gmail_callback():
         )
 
         save_gmail_email(user["id"], user["email"])
+        # may be a different mailbox: reply detection starts from a full rescan
+        save_gmail_history_id(user["id"], None)
 
         logger.info(f"Gmail connected successfully for user {user['id']}")
         flash("Gmail connected ✅", "success")
@@ -3700,9 +4027,10 @@ def gmail_disconnect():
 
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE users SET gmail_token=NULL WHERE id=?", (int(user["id"]),))
+    c.execute("UPDATE users SET gmail_token=NULL, gmail_history_id=NULL WHERE id=?", (int(user["id"]),))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user["id"]))
 
     flash("Gmail disconnected ✅", "success")
     return redirect(url_for("settings"))
@@ -4225,12 +4553,33 @@ def delete_email_template_route(tid):
     return redirect(url_for("email_templates"))
 
 
+def _analytics_args() -> dict:
+    """?start=YYYY-MM-DD&end=YYYY-MM-DD&bucket=day|hour, normalized (analytics_range)."""
+    start = (request.args.get("start") or "").strip() or None
+    end = (request.args.get("end") or "").strip() or None
+    bucket = (request.args.get("bucket") or "day").strip().lower()
+    try:
+        start, end, bucket = analytics_range(start, end, bucket)
+    except ValueError:
+        flash("Invalid date range, showing the default.", "warning")
+        start, end, bucket = analytics_range(None, None)
+    return {"start": start, "end": end, "bucket": bucket}
+
+
+def _analytics_for(user: dict) -> dict:
+    return get_analytics_data(user["id"], **_analytics_args())
+
+
+def _want_gzip() -> bool:
+    return (request.args.get("gzip") or "").strip().lower() in ("1", "true", "yes")
+
+
 @app.route("/analytics")
 def analytics():
     user, block = require_user()
     if block:
         return block
-    stats = get_analytics_data()
+    stats = _analytics_for(user)
     return render_template("analytics.html", stats=stats)
 
 
@@ -4239,14 +4588,36 @@ def export_analytics_csv():
     user, block = require_user()
     if block:
         return block
-    stats = get_analytics_data()
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(["Date", "Follow-ups Sent"])
-    for day, count in stats["sent_per_day"]:
-        cw.writerow([day, count])
-    return Response(si.getvalue(), mimetype="text/csv",
-                    headers={"Content-Disposition": "attachment;filename=analytics.csv"})
+    r = _analytics_args()
+    header = ["Hour (UTC)" if r["bucket"] == "hour" else "Date", "Follow-ups Sent", "Failed", "Replied"]
+    rows = iter_analytics_series(user["id"], **r)
+    return csv_export.response(f"analytics_{r['start']}_{r['end']}.csv", header, rows, gzip=_want_gzip())
+
+
+@app.route("/followups/export/csv")
+def export_followups_csv():
+    """
+    ?status=a,b&date=due|created|sent&from=YYYY-MM-DD&to=YYYY-MM-DD&type=...&channel=...&gzip=1
+    Streams every matching followup (no status = all of them).
+    """
+    user, block = require_user()
+    if block:
+        return block
+    statuses = [s for s in (request.args.get("status") or "").split(",") if s.strip()]
+    try:
+        rows = iter_followups_export(
+            user["id"],
+            statuses=statuses,
+            date_field=(request.args.get("date") or "due").strip().lower(),
+            date_from=(request.args.get("from") or "").strip() or None,
+            date_to=(request.args.get("to") or "").strip() or None,
+            followup_type=(request.args.get("type") or "").strip() or None,
+            channel=(request.args.get("channel") or "").strip() or None,
+        )
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    today = datetime.utcnow().date().isoformat()
+    return csv_export.response(f"followups_{today}.csv", FOLLOWUP_EXPORT_COLUMNS, rows, gzip=_want_gzip())
 
 
 @app.route("/analytics/export/pdf")
@@ -4254,12 +4625,12 @@ def export_analytics_pdf():
     user, block = require_user()
     if block:
         return block
-    stats = get_analytics_data()
+    stats = _analytics_for(user)
     html = render_template("analytics_pdf.html", stats=stats)
     result = BytesIO()
     pisa.CreatePDF(html, dest=result)
     return Response(result.getvalue(), mimetype="application/pdf",
-                    headers={"Content-Disposition": "attachment;filename=analytics.pdf"})
+                    headers={"Content-Disposition": f"attachment;filename=analytics_{stats['start']}_{stats['end']}.pdf"})
 
 
 @app.route("/notifications")
@@ -4276,8 +4647,15 @@ def notifications_count():
     user, block = require_user()
     if block:
         return jsonify({"count": 0})
-    notes = get_notifications(user["id"], unread_only=True)
-    return jsonify({"count": len(notes)})
+    return jsonify({"count": count_unread_notifications(user["id"])})
+
+
+@app.get("/api/counters")
+def api_counters():
+    user, block = require_user()
+    if block:
+        return jsonify({"ok": False, "error": "login_required"}), 401
+    return jsonify({"ok": True, **get_user_counters(user["id"])})
 
 
 @app.route("/notifications/read/<int:nid>", methods=["POST"])
@@ -4352,6 +4730,7 @@ def cleanup_expired_otps():
     """, (now,))
     conn.commit()
     conn.close()
+    invalidate_user_cache()
 
 
 @app.route("/account/email", methods=["GET", "POST"])
@@ -4386,6 +4765,7 @@ def change_email():
         """, (new_email, uid))
         conn.commit()
         conn.close()
+        invalidate_user_cache(uid)
 
         session["pending_verify_user_id"] = uid
 
@@ -4528,6 +4908,7 @@ def send_verification_code(uid: int, email: str, minutes: int = 15) -> None:
     """, (code, exp, now.isoformat(), uid))
     conn.commit()
     conn.close()
+    invalidate_user_cache(uid)
 
     app_name = os.getenv("APP_NAME", "Follow-Up Tracker")
     subject = f"{app_name} verification code: {code}"
@@ -4663,6 +5044,7 @@ def verify_email_submit():
     """, (now, int(uid)))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(uid))
 
     session["user_id"] = int(uid)
     session.pop("pending_verify_user_id", None)
@@ -4813,6 +5195,7 @@ def cancel_subscription():
     """, (int(user["id"]),))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user["id"]))
 
     flash("Subscription canceled ✅", "success")
     return redirect(url_for("billing"))
@@ -4872,6 +5255,7 @@ def activate_subscription(user_id, plan):
 
     conn.commit()
     conn.close()
+    invalidate_user_cache(user_id)
 
 from models_saas import deactivate_subscription, mark_payment_failed
 
@@ -5026,6 +5410,7 @@ def paystack_callback():
     )
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user["id"]))
 
     flash("Subscription active ✅", "success")
     return redirect(url_for("billing"))
@@ -5082,6 +5467,7 @@ def billing_success():
     """, (str(cust_id or ""), str(sub_id), plan, int(user["id"])))
     conn.commit()
     conn.close()
+    invalidate_user_cache(int(user["id"]))
 
     flash("Subscription active ✅", "success")
     return redirect(url_for("billing"))
@@ -5098,11 +5484,46 @@ def debug_socketio():
     return {"has_socketio": True}
 
 
+import hmac
+from web import scheduler_trace
+from web.scheduler import get_scheduler_metrics
+
+@app.get("/metrics/scheduler")
+def scheduler_metrics():
+    # only exists when SCHED_TRACE=1
+    if not scheduler_trace.ENABLED:
+        abort(404)
+
+    # the logged-in admin, or a scraper holding SCHED_METRICS_TOKEN (if set);
+    # never anonymous
+    token = os.getenv("SCHED_METRICS_TOKEN") or ""
+    auth = request.headers.get("Authorization", "")
+    if not (token and hmac.compare_digest(auth, f"Bearer {token}")):
+        user = current_user()
+        if not user:
+            abort(401)
+        if (user.get("email") or "").strip().lower() != ADMIN_EMAIL:
+            abort(403)
+
+    gauges = {
+        f"sched_{k}": v
+        for k, v in get_scheduler_metrics().items()
+        if isinstance(v, (int, float))
+    }
+    body = scheduler_trace.registry.render_prometheus(gauges)
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
 
 import os
 from web.scheduler import start_scheduler
 
 def maybe_start_scheduler():
+    # `python web/app.py`: spawned import validation workers (import_csv)
+    # re-import this file as __mp_main__; they must not run a scheduler
+    if __name__ == "__mp_main__":
+        return
+
     # Development (Flask reloader)
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
         start_scheduler(app)
@@ -0,0 +1,104 @@
+# web/csv_export.py
+"""
+Streaming CSV downloads.
+
+Rows come from a generator (models_saas.iter_followups_export,
+iter_analytics_series, which step a SQLite cursor with fetchmany) and go out
+as the response body in ~CSV_EXPORT_CHUNK_BYTES chunks, so memory stays
+flat however many rows there are:
+
+    return csv_export.response("followups.csv", header, rows, gzip=True)
+
+gzip=True compresses on the fly (zlib, gzip framing) and names the file
+.csv.gz; it's a download, not Content-Encoding, so browsers save it as is.
+
+Env knobs:
+    CSV_EXPORT_CHUNK_BYTES   CSV text buffered before a chunk is sent
+    CSV_EXPORT_GZIP_LEVEL    zlib level for gzip=True
+"""
+
+from __future__ import annotations
+
+import csv
+import os
+import zlib
+from typing import Iterable, Iterator, Optional, Sequence
+
+from flask import Response, stream_with_context
+
+CSV_EXPORT_CHUNK_BYTES = int(os.getenv("CSV_EXPORT_CHUNK_BYTES") or 64 * 1024)
+CSV_EXPORT_GZIP_LEVEL = int(os.getenv("CSV_EXPORT_GZIP_LEVEL") or 6)
+
+
+class _Buffer:
+    # csv.writer target that just collects what it's given
+    def __init__(self) -> None:
+        self.parts: list[str] = []
+        self.size = 0
+
+    def write(self, s: str) -> None:
+        self.parts.append(s)
+        self.size += len(s)
+
+    def take(self) -> str:
+        out = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        return out
+
+
+def iter_csv(
+    header: Optional[Sequence[str]],
+    rows: Iterable[Sequence],
+    gzip: bool = False,
+    chunk_bytes: Optional[int] = None,
+) -> Iterator[bytes]:
+    """
+    CSV bytes for header + rows, a chunk at a time (gzip-framed if asked).
+    """
+    limit = int(chunk_bytes or CSV_EXPORT_CHUNK_BYTES)
+    buf = _Buffer()
+    writer = csv.writer(buf)
+    z = zlib.compressobj(CSV_EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return z.compress(data) if z else data
+
+    if header:
+        writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buf.size >= limit:
+            out = encode(buf.take())
+            if out:  # zlib may hold everything back until it has a block
+                yield out
+
+    out = encode(buf.take())
+    if z:
+        out += z.flush()
+    if out:
+        yield out
+
+
+def response(
+    filename: str,
+    header: Optional[Sequence[str]],
+    rows: Iterable[Sequence],
+    gzip: bool = False,
+) -> Response:
+    """
+    Download response streaming iter_csv(header, rows). Closing the response
+    (client gone) closes the row generator, which hands its DB connection back.
+    """
+    if gzip:
+        filename += ".gz"
+    return Response(
+        stream_with_context(iter_csv(header, rows, gzip=gzip)),
+        mimetype="application/gzip" if gzip else "text/csv",
+        headers={
+            "Content-Disposition": f"attachment;filename={filename}",
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",  # let nginx pass chunks through
+        },
+    )
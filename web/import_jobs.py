@@ -0,0 +1,410 @@
+# web/import_jobs.py
+"""
+Durable CSV import jobs (SQLite table `import_jobs`).
+
+A job row is the only state an import has, so any worker process can answer
+/import-csv-mapped/status/<job_id> and a restart loses nothing:
+
+    job_id = create(user_id, file_path, mapping, mode)
+    run(job_id)        # claim + import, in a background task
+
+run() leases the job like an outbox item. Every chunk the import commits
+also writes the job's counters and resume point (rows_done) in the same
+transaction, and renews the lease. If the process dies mid-import the lease
+runs out and recover() (scheduler, every IMPORT_JOB_SWEEP_SECONDS) claims
+the job again and carries on from the last committed chunk.
+
+Each claim writes a fresh claimed_by token, and every checkpoint and the
+final status update only apply WHERE claimed_by is still that token. A
+worker that stalled past its lease and got taken over finds nothing to
+update, rolls back its chunk and stops (LeaseLost) instead of writing over
+the new owner.
+
+Rejected rows go to the job's error_file (a CSV next to the upload, see
+import_csv._open_errors_file) for download; its size is checkpointed too, so
+a resumed job rewinds it to the last committed chunk.
+
+Jobs only take uploads the upload step saved: resolve_upload() rejects any
+path that isn't an fu_* file directly inside UPLOAD_DIR (the app points it
+at its UPLOAD_FOLDER with set_upload_dir), since the job reads the file,
+writes side files next to it and deletes it when done.
+
+Finished jobs (and their error files) are kept IMPORT_JOB_TTL_HOURS for the
+status/result/download endpoints, then purge_expired() deletes them.
+
+Progress events go to whatever register_notifier() installed (the app's
+Socket.IO rooms): notify(event, job_id, payload) with event one of
+"import_progress", "import_done", "import_error".
+
+Env knobs:
+    IMPORT_JOB_LEASE_SECONDS    a running job with no checkpoint for this long is presumed dead
+    IMPORT_JOB_MAX_ATTEMPTS     runs (first + resumes) before a job is failed for good
+    IMPORT_JOB_TTL_HOURS        how long finished jobs are kept
+    IMPORT_JOB_SWEEP_SECONDS    scheduler interval for recover() + purge_expired()
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from database import session
+from import_csv import import_followups_from_csv, sniff_cache_path
+
+IMPORT_JOB_LEASE_SECONDS = float(os.getenv("IMPORT_JOB_LEASE_SECONDS") or 120)
+IMPORT_JOB_MAX_ATTEMPTS = int(os.getenv("IMPORT_JOB_MAX_ATTEMPTS") or 3)
+IMPORT_JOB_TTL_HOURS = float(os.getenv("IMPORT_JOB_TTL_HOURS") or 24)
+IMPORT_JOB_SWEEP_SECONDS = int(os.getenv("IMPORT_JOB_SWEEP_SECONDS") or 60)
+
+log = logging.getLogger("import_jobs")
+
+UPLOAD_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+_UPLOAD_NAME = re.compile(r"fu_[0-9a-f]{32}_[^/]+")
+
+WORKER_ID = f"{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    """The job was claimed by another worker after this one's lease ran out."""
+
+_notifier: Optional[Callable[[str, str, Dict[str, Any]], None]] = None
+
+
+def register_notifier(fn: Callable[[str, str, Dict[str, Any]], None]) -> None:
+    global _notifier
+    _notifier = fn
+
+
+def _notify(event: str, job_id: str, payload: Dict[str, Any]) -> None:
+    if _notifier is None:
+        return
+    try:
+        _notifier(event, job_id, payload)
+    except Exception:
+        log.exception("[IMPORT] notify %s failed for job %s", event, job_id)
+
+
+def _now(offset_seconds: float = 0) -> str:
+    return (datetime.utcnow() + timedelta(seconds=offset_seconds)).isoformat(timespec="milliseconds")
+
+
+def _pct(done: int, total: int) -> int:
+    return 100 if total <= 0 else min(100, int(done * 100 / total))
+
+
+def _job(row) -> Dict[str, Any]:
+    d = dict(row)
+    d["mapping"] = json.loads(d.get("mapping") or "{}")
+    d["error_sample"] = json.loads(d.get("error_sample") or "[]")
+    d["result"] = json.loads(d["result"]) if d.get("result") else None
+    return d
+
+
+# -------------------------
+# JOB TABLE
+# -------------------------
+
+def set_upload_dir(path: str) -> None:
+    global UPLOAD_DIR
+    UPLOAD_DIR = os.path.realpath(path)
+
+
+def upload_name(file_path: str) -> str:
+    """Name the upload step saves a CSV under (fu_<hex>_<name>)."""
+    return f"fu_{uuid.uuid4().hex}_{os.path.basename(file_path)}"
+
+
+def resolve_upload(file_path: str) -> str:
+    """
+    Real path of an import upload. ValueError for anything else: outside
+    UPLOAD_DIR (symlinks and .. resolved), not named by the upload step, one
+    of a job's side files, or missing.
+    """
+    real = os.path.realpath(file_path or "")
+    name = os.path.basename(real)
+    if (
+        os.path.dirname(real) != UPLOAD_DIR
+        or not _UPLOAD_NAME.fullmatch(name)
+        or name.endswith((".rejected.csv", ".sniff.json"))
+        or not os.path.isfile(real)
+    ):
+        raise ValueError("not an import upload")
+    return real
+
+
+def create(user_id: int, file_path: str, mapping: Dict[str, Any], mode: str = "skip") -> str:
+    file_path = resolve_upload(file_path)
+    job_id = uuid.uuid4().hex
+    now = _now()
+    with session() as conn:
+        conn.execute(
+            """
+            INSERT INTO import_jobs (
+                id, user_id, status, file_path, error_file, mapping, mode, created_at, updated_at
+            )
+            VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)
+            """,
+            (job_id, int(user_id), file_path, f"{file_path}.rejected.csv", json.dumps(mapping or {}), mode, now, now),
+        )
+    return job_id
+
+
+def get(job_id: str, user_id: int | None = None) -> Dict[str, Any] | None:
+    with session() as conn:
+        row = conn.execute("SELECT * FROM import_jobs WHERE id=?", (job_id,)).fetchone()
+    if not row or (user_id is not None and int(row["user_id"]) != int(user_id)):
+        return None
+    return _job(row)
+
+
+def status(job_id: str, user_id: int | None = None) -> Dict[str, Any] | None:
+    """
+    What the status endpoint returns: one primary-key read, no file access.
+    """
+    job = get(job_id, user_id)
+    if not job:
+        return None
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "mode": job["mode"],
+        "progress": {
+            "done": job["rows_done"],
+            "total": job["rows_total"],
+            "pct": 100 if job["status"] == "done" else _pct(job["rows_done"], job["rows_total"]),
+        },
+        "counts": {
+            "inserted": job["inserted"],
+            "updated": job["updated"],
+            "skipped": job["skipped"],
+            "errors": job["error_count"],
+            "rejected": job["rejected"],
+        },
+        "error_sample": job["error_sample"],
+        "result": job["result"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def rejected_file(job_id: str, user_id: int) -> str | None:
+    """
+    Path of a finished job's rejected-rows CSV, if it has any rows.
+    """
+    job = get(job_id, user_id)
+    if not job or job["status"] != "done" or not int(job["rejected"] or 0):
+        return None
+    path = job["error_file"]
+    return path if path and os.path.exists(path) else None
+
+
+def claim(job_id: str | None = None, *, worker_id: str = WORKER_ID) -> Dict[str, Any] | None:
+    """
+    Lease a queued job, or a running one whose lease ran out (its worker
+    died). With job_id, only that job. BEGIN IMMEDIATE keeps two workers
+    from claiming the same job.
+    """
+    now = _now()
+    token = f"{worker_id}:{uuid.uuid4().hex[:12]}"  # unique per claim, even within a process
+    with session() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        claimable = "(status='queued' OR (status='running' AND lease_expires_at <= :now))"
+        if job_id is not None:
+            row = conn.execute(
+                f"SELECT * FROM import_jobs WHERE id=:id AND {claimable}", {"id": job_id, "now": now}
+            ).fetchone()
+        else:
+            row = conn.execute(
+                f"SELECT * FROM import_jobs WHERE {claimable} ORDER BY created_at LIMIT 1", {"now": now}
+            ).fetchone()
+        if not row:
+            return None
+
+        conn.execute(
+            """
+            UPDATE import_jobs
+            SET status='running', attempts=attempts + 1, claimed_by=?, lease_expires_at=?,
+                started_at=COALESCE(started_at, ?), updated_at=?
+            WHERE id=?
+            """,
+            (token, _now(IMPORT_JOB_LEASE_SECONDS), now, now, row["id"]),
+        )
+
+    job = _job(row)
+    job.update(status="running", attempts=int(job["attempts"]) + 1, claimed_by=token)
+    return job
+
+
+def _checkpoint(conn, job_id: str, token: str, state: Dict[str, Any]) -> None:
+    # runs inside the import's chunk transaction; raising rolls the chunk back
+    cur = conn.execute(
+        """
+        UPDATE import_jobs
+        SET rows_done=?, rows_total=?, inserted=?, updated=?, skipped=?,
+            error_count=?, error_sample=?, rejected=?, error_bytes=?, lease_expires_at=?, updated_at=?
+        WHERE id=? AND claimed_by=?
+        """,
+        (
+            state["rows_done"],
+            state["rows_total"],
+            state["inserted"],
+            state["updated"],
+            state["skipped"],
+            state["error_count"],
+            json.dumps(state["errors"]),
+            state["rejected"],
+            state["error_bytes"],
+            _now(IMPORT_JOB_LEASE_SECONDS),
+            _now(),
+            job_id,
+            token,
+        ),
+    )
+    if cur.rowcount == 0:
+        raise LeaseLost(job_id)
+
+
+def _finish(job: Dict[str, Any], status_: str, result: Dict[str, Any], error: str | None = None) -> None:
+    now = _now()
+    with session() as conn:
+        cur = conn.execute(
+            """
+            UPDATE import_jobs
+            SET status=?, result=?, last_error=?, lease_expires_at=NULL, finished_at=?, updated_at=?
+            WHERE id=? AND claimed_by=?
+            """,
+            (status_, json.dumps(result), error, now, now, job["id"], job["claimed_by"]),
+        )
+        if cur.rowcount == 0:
+            raise LeaseLost(job["id"])
+
+
+def _remove_file(path: str | None) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_upload(path: str) -> None:
+    _remove_file(path)
+    _remove_file(sniff_cache_path(path))
+
+
+# -------------------------
+# RUNNING
+# -------------------------
+
+def run(job_id: str | None = None) -> str | None:
+    """
+    Claim a job (this one, or the oldest claimable) and import it, resuming
+    from its last checkpoint. Returns the final status ("lost" if another
+    worker took the job over meanwhile), or None when there was nothing to
+    claim.
+    """
+    job = claim(job_id)
+    if not job:
+        return None
+    job_id = job["id"]
+
+    if int(job["attempts"]) > IMPORT_JOB_MAX_ATTEMPTS:
+        return _fail(job, f"gave up after {IMPORT_JOB_MAX_ATTEMPTS} attempts")
+    if not os.path.exists(job["file_path"]):
+        return _fail(job, "uploaded file is gone")
+
+    resume = None
+    if int(job["rows_done"] or 0) > 0:
+        resume = {
+            "rows_done": job["rows_done"],
+            "inserted": job["inserted"],
+            "updated": job["updated"],
+            "skipped": job["skipped"],
+            "errors": job["error_sample"],
+            "error_count": job["error_count"],
+            "rejected": job["rejected"],
+            "error_bytes": job["error_bytes"],
+        }
+        log.info("[IMPORT] job %s resuming at row %s (attempt %s)", job_id, job["rows_done"], job["attempts"])
+
+    def progress_cb(done: int, total: int) -> None:
+        _notify("import_progress", job_id, {"done": done, "total": total, "pct": _pct(done, total)})
+
+    started = time.monotonic()
+    try:
+        result = import_followups_from_csv(
+            job["file_path"],
+            job["user_id"],
+            mapping=job["mapping"],
+            progress_cb=progress_cb,
+            mode=job["mode"],
+            on_chunk=lambda conn, state: _checkpoint(conn, job_id, job["claimed_by"], state),
+            resume=resume,
+            errors_path=job["error_file"],
+        )
+    except LeaseLost:
+        return _lost(job)
+    except Exception as e:
+        log.exception("[IMPORT] job %s failed", job_id)
+        return _fail(job, f"{type(e).__name__}: {e}")
+
+    result["took_seconds"] = round(time.monotonic() - started, 3)
+    try:
+        _finish(job, "done", result)
+    except LeaseLost:
+        return _lost(job)
+    _remove_upload(job["file_path"])
+    _notify("import_done", job_id, {"result": result})
+    return "done"
+
+
+def _fail(job: Dict[str, Any], error: str) -> str:
+    try:
+        _finish(job, "error", {"error": error}, error)
+    except LeaseLost:
+        return _lost(job)
+    _remove_upload(job["file_path"])
+    _remove_file(job["error_file"])
+    _notify("import_error", job["id"], {"error": error})
+    return "error"
+
+
+def _lost(job: Dict[str, Any]) -> str:
+    # the new owner has the upload, the error file and the job row now
+    log.warning("[IMPORT] job %s was taken over by another worker, stopping", job["id"])
+    return "lost"
+
+
+def recover(max_jobs: int = 5) -> int:
+    """
+    Pick up jobs whose worker died (lease expired) or that were never
+    started. Returns how many were run.
+    """
+    n = 0
+    while n < max_jobs and run() is not None:
+        n += 1
+    return n
+
+
+def purge_expired(ttl_hours: float | None = None) -> int:
+    cutoff = _now(-(IMPORT_JOB_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600)
+    with session() as conn:
+        rows = conn.execute(
+            "SELECT id, file_path, error_file FROM import_jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+            (cutoff,),
+        ).fetchall()
+        conn.executemany("DELETE FROM import_jobs WHERE id=?", [(r["id"],) for r in rows])
+    for r in rows:
+        _remove_upload(r["file_path"])
+        _remove_file(r["error_file"])
+    return len(rows)
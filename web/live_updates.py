@@ -0,0 +1,51 @@
+# web/live_updates.py
+"""
+Live dashboard updates over the app's Socket.IO server.
+
+models_saas publishes followup status transitions (sent, failed, replied,
+passed) from its mark_* functions; this module forwards each batch to the
+owner's room as one "followups_changed" event:
+
+    {"changes": [{"id": 12, "status": "sent", "event": "sent"}, ...]}
+
+The dashboard joins its room with "join_dashboard" and re-fetches only the
+rows it shows (/api/followups/rows), so an idle tab costs no DB queries.
+The room comes from the login session, never from the client.
+
+    init(socketio)   # once, after SocketIO(app)
+
+Events only reach tabs connected to the process that made the change;
+send paths run in the web process (outbox workers, scheduler), so that is
+all of them with a single worker.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List
+
+from flask import session
+from flask_socketio import join_room
+
+from models_saas import register_status_listener
+
+log = logging.getLogger("live_updates")
+
+EVENT = "followups_changed"
+
+
+def room(user_id: int) -> str:
+    return f"user:{int(user_id)}"
+
+
+def init(socketio) -> None:
+    def publish(user_id: int, changes: List[Dict[str, Any]]) -> None:
+        socketio.emit(EVENT, {"changes": changes}, to=room(user_id))
+
+    @socketio.on("join_dashboard")
+    def on_join_dashboard(data=None):
+        uid = session.get("user_id")
+        if uid:
+            join_room(room(uid))
+
+    register_status_listener(publish)
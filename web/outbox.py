@@ -0,0 +1,505 @@
+# web/outbox.py
+"""
+Durable outbound send queue (SQLite table `outbox`).
+
+Every send path enqueues instead of calling Gmail inline:
+
+    item_id = enqueue(user_id, fid, "scheduled", payload, idempotency_key)
+
+Workers claim items with a visibility timeout (lease). A claimed item that
+is not acked before its lease runs out goes back to the queue, so a crashed
+worker never loses a send. Failures are nacked and retried with exponential
+backoff until max_attempts, then the item is "dead" and the handler's fail()
+runs once.
+
+The Gmail response is written to the row (record_result) before any
+followup state is touched. A worker that reclaims an item with a stored
+result skips the send and only re-runs completion, so a crash between
+send_email_gmail and mark_send_success_* does not double-send. An item with
+a stored result never goes dead: the message is out, so fail() must not run
+and completion keeps being retried (at OUTBOX_BACKOFF_MAX_SECONDS once
+max_attempts is used up).
+
+Each claim writes a fresh claimed_by token, and record_result/ack/nack/defer
+only apply WHERE claimed_by is still that token. A worker whose send outlived
+its lease and got taken over finds nothing to update and stops (LeaseLost)
+instead of writing over the new owner.
+
+Handlers are registered per kind:
+
+    register_handler("scheduled", send=..., complete=..., fail=...)
+
+    send(item)             -> dict | None   (None: nothing to send, item is skipped)
+    complete(item, result) -> None          (followup state after a send)
+    fail(item, error)      -> None          (after the last attempt, only if nothing was sent)
+
+Handlers are rate limited by default (web/rate_limit.py): each send takes a
+token from the user's bucket and one unit of their daily quota first. A
+throttled item is deferred (requeued for later, attempts unchanged), never
+failed; the quota unit is given back when nothing ends up being sent.
+
+Env knobs:
+    OUTBOX_WORKERS              items processed at once per process
+    OUTBOX_PER_USER             items in flight for a single user
+    OUTBOX_VISIBILITY_SECONDS   claim lease
+    OUTBOX_MAX_ATTEMPTS         attempts before an item goes dead
+    OUTBOX_BACKOFF_SECONDS      first retry delay, doubled per attempt ...
+    OUTBOX_BACKOFF_MAX_SECONDS  ... up to this
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from database import session
+from web import rate_limit
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS") or 8)
+OUTBOX_PER_USER = int(os.getenv("OUTBOX_PER_USER") or 2)
+OUTBOX_VISIBILITY_SECONDS = float(os.getenv("OUTBOX_VISIBILITY_SECONDS") or 120)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS") or 5)
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS") or 30)
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS") or 3600)
+
+log = logging.getLogger("outbox")
+
+WORKER_ID = f"{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    """The item was claimed by another worker after this one's lease ran out."""
+
+
+@dataclass
+class Handler:
+    send: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+    complete: Callable[[Dict[str, Any], Dict[str, Any]], None]
+    fail: Callable[[Dict[str, Any], str], None]
+    rate_limited: bool = True
+
+
+_handlers: Dict[str, Handler] = {}
+
+
+def register_handler(
+    kind: str,
+    *,
+    send: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    complete: Callable[[Dict[str, Any], Dict[str, Any]], None] = lambda item, result: None,
+    fail: Callable[[Dict[str, Any], str], None] = lambda item, error: None,
+    rate_limited: bool = True,
+) -> None:
+    _handlers[kind] = Handler(send=send, complete=complete, fail=fail, rate_limited=rate_limited)
+
+
+def _now(offset_seconds: float = 0) -> str:
+    return (datetime.utcnow() + timedelta(seconds=offset_seconds)).isoformat(timespec="milliseconds")
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _item(row) -> Dict[str, Any]:
+    d = dict(row)
+    d["payload"] = json.loads(d.get("payload") or "{}")
+    d["result"] = json.loads(d["result"]) if d.get("result") else None
+    return d
+
+
+# -------------------------
+# QUEUE OPERATIONS
+# -------------------------
+
+def enqueue(
+    user_id: int,
+    followup_id: int | None,
+    kind: str,
+    payload: Dict[str, Any] | None,
+    idempotency_key: str,
+    *,
+    delay_seconds: float = 0,
+    max_attempts: int | None = None,
+    conn: sqlite3.Connection | None = None,
+) -> int:
+    """
+    Returns the item id. Enqueueing an idempotency_key that already exists
+    returns the existing item. If that item is dead, skipped (the handler
+    had nothing to send, e.g. the followup was done before it was reopened),
+    or still queued (e.g. waiting out a backoff) with nothing sent yet, it
+    takes the new payload and is due now, so a resend goes out with the
+    latest payload. Items in flight or already sent are left untouched.
+
+    With conn the insert joins the caller's transaction (the caller commits),
+    so a followup state change and its outbox item land together.
+    """
+    if conn is None:
+        with session() as conn:
+            return enqueue(
+                user_id, followup_id, kind, payload, idempotency_key,
+                delay_seconds=delay_seconds, max_attempts=max_attempts, conn=conn,
+            )
+
+    now = _now()
+    conn.execute(
+        """
+        INSERT INTO outbox (
+            user_id, followup_id, kind, idempotency_key, payload,
+            status, attempts, max_attempts, available_at, created_at, updated_at
+        )
+        VALUES (?, ?, ?, ?, ?, 'queued', 0, ?, ?, ?, ?)
+        ON CONFLICT(idempotency_key) DO UPDATE SET
+            payload = excluded.payload,
+            status = 'queued',
+            attempts = 0,
+            max_attempts = excluded.max_attempts,
+            available_at = excluded.available_at,
+            last_error = NULL,
+            updated_at = excluded.updated_at
+        WHERE outbox.status IN ('dead', 'skipped')
+           OR (outbox.status = 'queued' AND outbox.result IS NULL)
+        """,
+        (
+            int(user_id),
+            int(followup_id) if followup_id is not None else None,
+            kind,
+            idempotency_key,
+            json.dumps(payload or {}),
+            int(max_attempts or OUTBOX_MAX_ATTEMPTS),
+            _now(delay_seconds),
+            now,
+            now,
+        ),
+    )
+    row = conn.execute(
+        "SELECT id FROM outbox WHERE idempotency_key=?", (idempotency_key,)
+    ).fetchone()
+    return int(row[0])
+
+
+def claim(limit: int, *, item_id: int | None = None, worker_id: str = WORKER_ID) -> list[Dict[str, Any]]:
+    """
+    Lease up to `limit` claimable items (queued and due, or inflight with an
+    expired lease), at most OUTBOX_PER_USER in flight per user.
+    BEGIN IMMEDIATE makes the read + lease atomic across threads and processes.
+
+    The per-user cap is applied in SQL before the limit: each user's
+    claimable items are numbered in queue order and only the first
+    (OUTBOX_PER_USER - already in flight) count, then users take turns
+    (everyone's 1st item, then 2nd ...), so one big backlog can't fill the
+    head of the queue and starve everybody else.
+    """
+    now = _now()
+    token = f"{worker_id}:{uuid.uuid4().hex[:12]}"  # unique per claim, even within a process
+    with session() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+
+        claimable = """
+            ((status='queued' AND available_at <= :now)
+             OR (status='inflight' AND lease_expires_at <= :now))
+        """
+        if item_id is not None:
+            picked = conn.execute(
+                f"SELECT * FROM outbox WHERE id=:id AND {claimable}",
+                {"id": int(item_id), "now": now},
+            ).fetchall()
+        else:
+            picked = conn.execute(
+                f"""
+                WITH busy AS (
+                    SELECT user_id, COUNT(*) AS n
+                    FROM outbox
+                    WHERE status='inflight' AND lease_expires_at > :now
+                    GROUP BY user_id
+                ),
+                ranked AS (
+                    SELECT id, user_id, available_at,
+                           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY available_at, id) AS rn
+                    FROM outbox
+                    WHERE {claimable}
+                )
+                SELECT o.*
+                FROM ranked r
+                JOIN outbox o ON o.id = r.id
+                LEFT JOIN busy b ON b.user_id = r.user_id
+                WHERE r.rn <= :per_user - COALESCE(b.n, 0)
+                ORDER BY r.rn, r.available_at, r.id
+                LIMIT :n
+                """,
+                {"now": now, "per_user": OUTBOX_PER_USER, "n": int(limit)},
+            ).fetchall()
+
+        if not picked:
+            return []
+
+        lease = _now(OUTBOX_VISIBILITY_SECONDS)
+        conn.executemany(
+            """
+            UPDATE outbox
+            SET status='inflight', claimed_by=?, lease_expires_at=?, updated_at=?
+            WHERE id=?
+            """,
+            [(token, lease, now, int(r["id"])) for r in picked],
+        )
+
+    items = []
+    for r in picked:
+        d = _item(r)
+        d.update(status="inflight", claimed_by=token, lease_expires_at=lease)
+        items.append(d)
+    return items
+
+
+def _fenced(cur, item: Dict[str, Any]) -> None:
+    if cur.rowcount == 0:
+        raise LeaseLost(item["id"])
+
+
+def record_result(item: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """
+    Durable point right after the provider accepted the message.
+    """
+    with session() as conn:
+        cur = conn.execute(
+            "UPDATE outbox SET result=?, sent_at=?, updated_at=? WHERE id=? AND claimed_by=?",
+            (json.dumps(result or {}), _now(), _now(), int(item["id"]), item["claimed_by"]),
+        )
+        _fenced(cur, item)
+
+
+def ack(item: Dict[str, Any], status: str = "done") -> None:
+    """
+    Finish a claimed item: "done" after a send, "skipped" when the handler
+    had nothing to send.
+    """
+    with session() as conn:
+        cur = conn.execute(
+            """
+            UPDATE outbox
+            SET status=?, lease_expires_at=NULL, last_error=NULL, updated_at=?
+            WHERE id=? AND claimed_by=?
+            """,
+            (status, _now(), int(item["id"]), item["claimed_by"]),
+        )
+        _fenced(cur, item)
+
+
+def nack(item: Dict[str, Any], error: str) -> bool:
+    """
+    Count a failed attempt. Returns True when the item is now dead, which
+    never happens once a send result is recorded.
+    """
+    with session() as conn:
+        row = conn.execute(
+            "SELECT attempts, max_attempts, result FROM outbox WHERE id=? AND claimed_by=?",
+            (int(item["id"]), item["claimed_by"]),
+        ).fetchone()
+        if not row:
+            raise LeaseLost(item["id"])
+
+        attempts = int(row["attempts"]) + 1
+        dead = attempts >= int(row["max_attempts"]) and row["result"] is None
+        cur = conn.execute(
+            """
+            UPDATE outbox
+            SET status=?, attempts=?, last_error=?, available_at=?,
+                lease_expires_at=NULL, updated_at=?
+            WHERE id=? AND claimed_by=?
+            """,
+            (
+                "dead" if dead else "queued",
+                attempts,
+                (error or "")[:1000],
+                _now(0 if dead else _backoff(attempts)),
+                _now(),
+                int(item["id"]),
+                item["claimed_by"],
+            ),
+        )
+        _fenced(cur, item)
+    return dead
+
+
+def defer(item: Dict[str, Any], seconds: float, reason: str) -> None:
+    """
+    Put a claimed item back without counting an attempt (rate limits).
+    """
+    with session() as conn:
+        cur = conn.execute(
+            """
+            UPDATE outbox
+            SET status='queued', available_at=?, last_error=?,
+                lease_expires_at=NULL, updated_at=?
+            WHERE id=? AND claimed_by=?
+            """,
+            (_now(seconds), reason, _now(), int(item["id"]), item["claimed_by"]),
+        )
+        _fenced(cur, item)
+
+
+def get_item(item_id: int) -> Dict[str, Any] | None:
+    with session() as conn:
+        row = conn.execute("SELECT * FROM outbox WHERE id=?", (int(item_id),)).fetchone()
+    return _item(row) if row else None
+
+
+def stats() -> Dict[str, int]:
+    with session() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+    return {r[0]: int(r[1]) for r in rows}
+
+
+def purge_done(older_than_days: int = 7) -> int:
+    cutoff = _now(-older_than_days * 86400)
+    with session() as conn:
+        cur = conn.execute("DELETE FROM outbox WHERE status IN ('done','skipped') AND updated_at < ?", (cutoff,))
+        return cur.rowcount or 0
+
+
+# -------------------------
+# WORKERS
+# -------------------------
+
+_pool = ThreadPoolExecutor(max_workers=max(OUTBOX_WORKERS, 1), thread_name_prefix="outbox")
+_drain_lock = threading.Lock()
+_kick_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-kick")
+
+
+def process(item: Dict[str, Any]) -> str:
+    """
+    Run one claimed item through its handler. Returns "done", "skipped"
+    (the handler had nothing to send), "retry", "deferred" (over a send
+    limit), "dead", or "lost" when another worker
+    took the item over meanwhile. Call inside an app context.
+    """
+    try:
+        return _process(item)
+    except LeaseLost:
+        log.warning("[OUTBOX] item=%s lease lost to another worker, stopping", item["id"])
+        return "lost"
+
+
+def _process(item: Dict[str, Any]) -> str:
+    handler = _handlers.get(item["kind"])
+    if handler is None:
+        nack(item, f"no handler for kind {item['kind']!r}")
+        return "retry"
+
+    quota_day = None
+    if handler.rate_limited and item.get("result") is None:
+        try:
+            quota_day = rate_limit.reserve(item["user_id"])
+        except rate_limit.Throttled as t:
+            defer(item, t.retry_after, t.reason)
+            return "deferred"
+
+    try:
+        result = item.get("result")
+        if result is None:
+            try:
+                result = handler.send(item)
+            except Exception:
+                if quota_day:
+                    rate_limit.refund(item["user_id"], quota_day)
+                raise
+            if result is None:
+                if quota_day:
+                    rate_limit.refund(item["user_id"], quota_day)
+                ack(item, "skipped")
+                return "skipped"
+            record_result(item, result)
+
+        handler.complete(item, result)
+        ack(item)
+        return "done"
+
+    except LeaseLost:
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        log.warning("[OUTBOX] item=%s kind=%s attempt failed: %s", item["id"], item["kind"], error)
+        if not nack(item, error):
+            return "retry"
+        try:
+            handler.fail(item, error)
+        except Exception:
+            log.exception("[OUTBOX] item=%s fail handler raised", item["id"])
+        return "dead"
+
+
+def _process_in_app(app, item: Dict[str, Any]) -> str:
+    with app.app_context():
+        return process(item)
+
+
+def deliver_now(app, item_id: int) -> str:
+    """
+    Claim one item and process it in the calling thread (request paths that
+    want to report the outcome). Returns "done", "skipped", "retry",
+    "deferred", "dead", "lost", or the item's current status when a worker already has it.
+    """
+    items = claim(1, item_id=item_id)
+    if not items:
+        item = get_item(item_id)
+        return item["status"] if item else "missing"
+    return _process_in_app(app, items[0])
+
+
+def drain(app, max_seconds: float = 25.0) -> int:
+    """
+    Keep OUTBOX_WORKERS items in flight until the queue has nothing
+    claimable or max_seconds pass. One drain loop per process; returns the
+    number of items processed (0 if another drain is already running).
+    """
+    if not _drain_lock.acquire(blocking=False):
+        return 0
+
+    processed = 0
+    deadline = time.monotonic() + max_seconds
+    try:
+        running: set = set()
+        exhausted = False
+        while True:
+            free = OUTBOX_WORKERS - len(running)
+            if free > 0 and not exhausted and time.monotonic() < deadline:
+                items = claim(free)
+                exhausted = not items
+                running.update(_pool.submit(_process_in_app, app, it) for it in items)
+
+            if not running:
+                break
+
+            done, running = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                processed += 1
+                try:
+                    fut.result()
+                except Exception:
+                    log.exception("[OUTBOX] worker crashed")
+            if done and exhausted:
+                # something finished; a per-user slot may have opened up
+                exhausted = False
+    finally:
+        _drain_lock.release()
+
+    return processed
+
+
+def kick(app) -> None:
+    """
+    Start a drain in the background (no-op if one is already running).
+    """
+    if not _drain_lock.locked():
+        _kick_pool.submit(drain, app)
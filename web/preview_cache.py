@@ -0,0 +1,204 @@
+# web/preview_cache.py
+"""
+Render cache for the live preview endpoints (/preview/<fid>/render-email,
+/scheduler-template/preview).
+
+Editors re-send the same content all the time (undo, toggling the format
+back, two tabs on one followup), so rendered documents are cached by
+
+    (user_id, what, sha1 of every input that reaches the renderer)
+
+where `what` is the followup id or "template". Concurrent requests for a key
+that is being rendered wait for that render instead of starting their own
+(single flight).
+
+Clients send the etag of the document they're showing as `base`; when that
+document is still cached the response is a splice against it
+
+    {"etag": new, "diff": {"start": i, "end": j, "text": "..."}}
+    new_doc = old_doc[:i] + text + old_doc[j:]
+
+instead of the whole document ({"etag", "html"}) if that's smaller, or
+{"etag", "unchanged": true} when it is the same document.
+
+Followup rows are kept PREVIEW_ROW_SECONDS per (user, followup), so typing
+in the preview doesn't re-read the row on every keystroke; the fields being
+edited come from the request anyway.
+
+Env knobs:
+    PREVIEW_CACHE_SIZE     rendered documents kept (LRU)
+    PREVIEW_ROW_SECONDS    how long a followup row is reused
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE") or 1024)
+PREVIEW_ROW_SECONDS = float(os.getenv("PREVIEW_ROW_SECONDS") or 10)
+
+_lock = threading.Lock()
+_rendered: "OrderedDict[tuple, str]" = OrderedDict()  # key -> etag
+_docs: "OrderedDict[tuple, str]" = OrderedDict()  # (user_id, etag) -> html
+_inflight: Dict[tuple, Future] = {}
+_rows: Dict[tuple, tuple] = {}  # (user_id, fid) -> (row, loaded_at)
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "diffs": 0}
+
+
+def content_key(*parts: Any) -> str:
+    """
+    sha1 of the render inputs (JSON-able values; dicts are key-sorted).
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def _store(key: tuple, user_id: int, etag: str, html: str) -> None:
+    # caller holds _lock
+    _rendered[key] = etag
+    _rendered.move_to_end(key)
+    _docs[(user_id, etag)] = html
+    _docs.move_to_end((user_id, etag))
+    while len(_rendered) > PREVIEW_CACHE_SIZE:
+        _rendered.popitem(last=False)
+    while len(_docs) > PREVIEW_CACHE_SIZE:
+        _docs.popitem(last=False)
+
+
+def render(user_id: int, what: Hashable, content: str, build: Callable[[], str]) -> Tuple[str, str]:
+    """
+    (etag, html) for these inputs: cached, joined to an identical render in
+    flight, or built now. build() exceptions reach every waiter.
+    """
+    key = (int(user_id), what, content)
+    with _lock:
+        etag = _rendered.get(key)
+        if etag is not None and (key[0], etag) in _docs:
+            _rendered.move_to_end(key)
+            _stats["hits"] += 1
+            return etag, _docs[(key[0], etag)]
+
+        fut = _inflight.get(key)
+        owner = fut is None
+        if owner:
+            fut = _inflight[key] = Future()
+            _stats["misses"] += 1
+        else:
+            _stats["coalesced"] += 1
+
+    if not owner:
+        return fut.result()
+
+    try:
+        html = build()
+        etag = hashlib.sha1(html.encode("utf-8", "surrogatepass")).hexdigest()
+        with _lock:
+            _store(key, key[0], etag, html)
+        fut.set_result((etag, html))
+        return etag, html
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def _common_prefix(a: str, b: str, limit: int) -> int:
+    # binary search on slice equality (memcmp) instead of a char loop
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _utf16_len(s: str) -> int:
+    return len(s.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def diff(old: str, new: str) -> Dict[str, Any]:
+    """
+    One splice turning old into new: old[:start] + text + old[end:].
+    start/end count UTF-16 code units, like JS string indexes.
+    """
+    start = _common_prefix(old, new, min(len(old), len(new)))
+    tail = _common_suffix(old, new, min(len(old), len(new)) - start)
+    return {
+        "start": _utf16_len(old[:start]),
+        "end": _utf16_len(old[:len(old) - tail]),
+        "text": new[start:len(new) - tail],
+    }
+
+
+def body(user_id: int, etag: str, html: str, base: Optional[str]) -> Dict[str, Any]:
+    """
+    JSON body for a client showing the document `base`: a diff against it
+    when we still have it and the diff is smaller, else the whole document.
+    """
+    out: Dict[str, Any] = {"ok": True, "etag": etag}
+    if base == etag:
+        out["unchanged"] = True
+        return out
+
+    old = None
+    if base:
+        with _lock:
+            old = _docs.get((int(user_id), base))
+    if old is not None:
+        d = diff(old, html)
+        if len(d["text"]) < len(html) // 2:
+            with _lock:
+                _stats["diffs"] += 1
+            out["diff"] = d
+            return out
+
+    out["html"] = html
+    return out
+
+
+def followup_row(user_id: int, fid: int, load: Callable[[], Optional[dict]]) -> Optional[dict]:
+    """
+    The followup row, reused for PREVIEW_ROW_SECONDS. Misses (not found /
+    not theirs) aren't cached.
+    """
+    key = (int(user_id), int(fid))
+    now = time.monotonic()
+    with _lock:
+        hit = _rows.get(key)
+    if hit and now - hit[1] < PREVIEW_ROW_SECONDS:
+        return dict(hit[0])
+
+    row = load()
+    if row is not None:
+        with _lock:
+            if len(_rows) >= PREVIEW_CACHE_SIZE:
+                _rows.clear()
+            _rows[key] = (dict(row), now)
+    return row
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return {"docs": len(_docs), "inflight": len(_inflight), **_stats}
@@ -0,0 +1,108 @@
+# web/rate_limit.py
+"""
+Per-user send limits, enforced by the outbox before every send.
+
+    SEND_RATE_PER_SECOND   token-bucket refill rate per user (default 2/s)
+    SEND_BURST             bucket size, sends allowed back to back (default 5)
+
+The daily quota is settings.daily_limit (get_daily_limit, default 20),
+counted in send_counters one atomic UPDATE per send, so checking it never
+counts log rows. Over either limit, reserve() raises Throttled with the
+number of seconds to wait; the outbox defers the item instead of failing it.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models_saas import get_daily_limit, release_daily_send, reserve_daily_send
+
+SEND_RATE_PER_SECOND = float(os.getenv("SEND_RATE_PER_SECOND") or 2)
+SEND_BURST = float(os.getenv("SEND_BURST") or 5)
+DAILY_LIMIT_CACHE_SECONDS = 60
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self):
+        self.tokens = SEND_BURST
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token; returns 0, or how long until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(SEND_BURST, self.tokens + (now - self.updated) * SEND_RATE_PER_SECOND)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / SEND_RATE_PER_SECOND
+
+    def give_back(self) -> None:
+        self.tokens = min(SEND_BURST, self.tokens + 1)
+
+
+_lock = threading.Lock()
+_buckets: dict[int, _Bucket] = {}
+_limits: dict[int, tuple[int, float]] = {}  # uid -> (daily_limit, loaded_at)
+
+
+def _daily_limit(user_id: int) -> int:
+    now = time.monotonic()
+    with _lock:
+        hit = _limits.get(user_id)
+    if hit and now - hit[1] < DAILY_LIMIT_CACHE_SECONDS:
+        return hit[0]
+
+    limit = get_daily_limit(user_id)
+    with _lock:
+        _limits[user_id] = (limit, now)
+    return limit
+
+
+def _seconds_until_tomorrow() -> float:
+    now = datetime.utcnow()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (tomorrow - now).total_seconds() + 1
+
+
+def reserve(user_id: int) -> str:
+    """
+    Take one send for user_id. Returns the quota day to pass to refund()
+    if the send does not happen; raises Throttled when over a limit.
+    """
+    uid = int(user_id)
+
+    with _lock:
+        bucket = _buckets.get(uid)
+        if bucket is None:
+            bucket = _buckets[uid] = _Bucket()
+        wait = bucket.take()
+    if wait > 0:
+        raise Throttled(wait, "throttled: per-second send rate")
+
+    day = datetime.utcnow().date().isoformat()
+    if not reserve_daily_send(uid, day, _daily_limit(uid)):
+        with _lock:
+            bucket.give_back()
+        raise Throttled(_seconds_until_tomorrow(), "throttled: daily send limit reached")
+
+    return day
+
+
+def refund(user_id: int, day: str) -> None:
+    release_daily_send(int(user_id), day)
+
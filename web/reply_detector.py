@@ -8,6 +8,7 @@ from email.utils import parsedate_to_datetime, parseaddr
 from typing import Any, Callable, Dict, Iterable, List, Optional
 
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 
 @dataclass
@@ -151,6 +152,52 @@ def fetch_thread_messages(service, thread_id: str) -> List[Dict[str, Any]]:
     return thread.get("messages") or []
 
 
+def get_mailbox_history_id(service) -> str:
+    profile = service.users().getProfile(userId="me").execute()
+    return str(profile.get("historyId") or "")
+
+
+def fetch_history_thread_ids(service, start_history_id: str) -> Optional[tuple[set[str], str]]:
+    """
+    Thread ids that got new messages since start_history_id, plus the mailbox's
+    current historyId (the next checkpoint).
+
+    Returns None when Gmail no longer has history that far back (404); the
+    caller has to rescan every tracked thread.
+    """
+    thread_ids: set[str] = set()
+    latest = str(start_history_id)
+    page_token: Optional[str] = None
+
+    while True:
+        params: Dict[str, Any] = {
+            "userId": "me",
+            "startHistoryId": str(start_history_id),
+            "historyTypes": ["messageAdded"],
+            "maxResults": 500,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+
+        try:
+            resp = service.users().history().list(**params).execute()
+        except HttpError as e:
+            if getattr(e.resp, "status", None) == 404:
+                return None
+            raise
+
+        for h in resp.get("history") or []:
+            for added in h.get("messagesAdded") or []:
+                thread_id = (added.get("message") or {}).get("threadId")
+                if thread_id:
+                    thread_ids.add(thread_id)
+
+        latest = str(resp.get("historyId") or latest)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return thread_ids, latest
+
+
 def detect_reply_in_thread(
     service,
     *,
@@ -201,10 +248,16 @@ def run_reply_detection_for_user(
     mark_followup_replied: Callable[..., bool],
     disable_followup_schedule: Callable[[int, int], bool],
     add_notification: Optional[Callable[[int, str], None]] = None,
+    history_id: Optional[str] = None,
+    save_history_id: Optional[Callable[[str], None]] = None,
 ) -> List[ReplyDetectionResult]:
     """
     Scan tracked followups for replies and auto-stop scheduling.
 
+    With save_history_id, only threads that changed since history_id are
+    fetched (full rescan when there is no checkpoint or it has expired), and
+    the new checkpoint is saved after the scan.
+
     Each followup dict should contain at least:
     - id
     - email
@@ -222,6 +275,16 @@ def run_reply_detection_for_user(
     results: List[ReplyDetectionResult] = []
     uid = int(user["id"])
 
+    next_history_id: Optional[str] = None
+    if save_history_id:
+        delta = fetch_history_thread_ids(service, history_id) if history_id else None
+        if delta is None:
+            # read it before the rescan so nothing that lands meanwhile is skipped
+            next_history_id = get_mailbox_history_id(service)
+        else:
+            changed, next_history_id = delta
+            followups = [f for f in followups if (f.get("gmail_thread_id") or "").strip() in changed]
+
     for f in followups:
         fid = int(f["id"])
         status = safe_lower(f.get("status"))
@@ -277,4 +340,7 @@ def run_reply_detection_for_user(
             )
         )
 
+    if save_history_id and next_history_id:
+        save_history_id(next_history_id)
+
     return results
\ No newline at end of file
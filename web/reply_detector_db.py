@@ -4,6 +4,8 @@ from __future__ import annotations
 
 from typing import Any, Dict, List
 
+from models_saas import record_send_event
+
 
 def get_reply_tracked_followups(conn, user_id: int) -> List[Dict[str, Any]]:
     """
@@ -70,8 +72,11 @@ def mark_followup_replied(
             int(user_id),
         ),
     )
+    ok = cur.rowcount > 0
+    if ok:
+        record_send_event(conn, fid, user_id, "replied")
     conn.commit()
-    return cur.rowcount > 0
+    return ok
 
 
 def disable_followup_schedule(conn, fid: int, user_id: int) -> bool:
@@ -3,25 +3,39 @@
 from __future__ import annotations
 
 import atexit
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from apscheduler.schedulers.background import BackgroundScheduler
 from gmail_sync import check_replies_for_user
 from models_saas import save_outbound_gmail_metadata
-from models_saas import get_scheduler_template, get_branding
-from scheduler_render import render_scheduler_html, DEFAULT_SCHEDULER_TEMPLATE
+from database import session
+from email_scheduler import branded_renderer
 from gmail_sync import send_email_gmail
 from web.compute_next import compute_next_send_at
+from web import import_jobs
+from web import outbox
+from web import scheduler_trace as trace
 from web.smart_followups import evaluate_smart_followup
 from web.smart_templates import render_smart_template
 from models_saas import update_smart_followup_state, stop_smart_followup
 from models_saas import (
-    get_all_users,
-    get_due_scheduled,
+    disable_followup_schedule,
+    get_due_queue,
+    get_followup,
+    get_user_by_id,
+    get_reply_poll_users,
     mark_send_failed,
-    mark_schedule_passed,
+    mark_schedule_passed_all,
     set_status_running,
     mark_send_success_once,
     mark_send_success_repeat,
+    repair_user_counters,
+    roll_up_send_events,
 )
 
 scheduler = BackgroundScheduler()
@@ -71,7 +85,7 @@ def send_followup_email(user: dict, f: dict, message: str | None):
 
     if email_format == "text":
         formatted = format_plain_text_message(raw_message)
-        branding = get_branding(user.get("id")) or {}
+        branding = branded_renderer(user).branding
         html_body = render_text_email_html(user, f, formatted, branding)
 
         send_meta = send_email_gmail(
@@ -100,29 +114,570 @@ def send_followup_email(user: dict, f: dict, message: str | None):
     return send_meta
 
 
+# =========================
+# TICK -> OUTBOX
+# =========================
+# The tick only enqueues due items into the durable outbox (web/outbox.py);
+# outbox workers send them with retries + backoff, OUTBOX_WORKERS at a time
+# and OUTBOX_PER_USER per user. Users the tick doesn't get to enqueue before
+# the deadline are carried over and go first next tick. Env knobs:
+#   SCHED_GMAIL_CONCURRENCY       Gmail API calls in flight across all users
+#   SCHED_TICK_DEADLINE_SECONDS   how long a tick (or drain run) keeps enqueueing/draining
+#   SCHED_DUE_LIMIT               due rows fetched per tick, across all users
+#   SCHED_DUE_PER_USER            due rows fetched per user per tick
+#   OUTBOX_POLL_SECONDS           drain job interval (retries, sends queued from the web app)
+SCHED_GMAIL_CONCURRENCY = int(os.getenv("SCHED_GMAIL_CONCURRENCY") or 8)
+SCHED_TICK_DEADLINE_SECONDS = float(os.getenv("SCHED_TICK_DEADLINE_SECONDS") or 25)
+SCHED_DUE_LIMIT = int(os.getenv("SCHED_DUE_LIMIT") or 5000)
+SCHED_DUE_PER_USER = int(os.getenv("SCHED_DUE_PER_USER") or 50)
+OUTBOX_POLL_SECONDS = int(os.getenv("OUTBOX_POLL_SECONDS") or 10)
+
+_gmail_slots = threading.BoundedSemaphore(max(SCHED_GMAIL_CONCURRENCY, 1))
+
+_carry_lock = threading.Lock()
+_carried_over: list[int] = []  # user ids not reached before the last deadline
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "ticks": 0,
+    "ticks_skipped": 0,
+    "users_processed": 0,
+    "users_carried_over": 0,
+    "last_tick_seconds": 0.0,
+    "last_tick_users": 0,
+    "last_tick_enqueued": 0,
+    "last_tick_processed": 0,
+    "user_seconds": deque(maxlen=1000),  # recent per-user enqueue times
+    "send_seconds": deque(maxlen=1000),  # recent outbox sends, load to Gmail accepted
+    "drains_skipped": 0,
+    "reply_checks": 0,
+    "reply_runs_skipped": 0,
+}
+
+_SKIP_COUNTERS = {
+    "scheduled_sends": "ticks_skipped",
+    "outbox_drain": "drains_skipped",
+    "reply_detection": "reply_runs_skipped",
+}
+
+
+@contextmanager
+def _gmail_slot():
+    with _gmail_slots:
+        yield
+
+
+def _on_tick_skipped(event) -> None:
+    # max_instances=1 + coalesce=True drop runs silently; count them instead.
+    key = _SKIP_COUNTERS.get(event.job_id)
+    if key:
+        with _metrics_lock:
+            _metrics[key] += 1
+
+
+def _record_time(key: str, seconds: float) -> None:
+    with _metrics_lock:
+        if key == "user_seconds":
+            _metrics["users_processed"] += 1
+        _metrics[key].append(seconds)
+
+
+def get_scheduler_metrics() -> dict:
+    with _metrics_lock:
+        snap = {k: v for k, v in _metrics.items() if not isinstance(v, deque)}
+        samples = {k: sorted(v) for k, v in _metrics.items() if isinstance(v, deque)}
+
+    for key, times in samples.items():
+        if times:
+            snap[f"{key}_p50"] = times[len(times) // 2]
+            snap[f"{key}_p99"] = times[min(len(times) - 1, int(len(times) * 0.99))]
+            snap[f"{key}_max"] = times[-1]
+    with _carry_lock:
+        snap["carried_over_pending"] = len(_carried_over)
+
+    try:
+        for status, n in outbox.stats().items():
+            snap[f"outbox_{status}"] = n
+    except Exception:
+        pass
+    return snap
+
+
+def _work_for_tick(tick: str) -> tuple[list[tuple[dict, list[dict]]], bool]:
+    """
+    (user, due items) for every user with due sends, from one global
+    due-queue query instead of one query per user. Anyone carried over from
+    the previous tick comes first. The flag is True when the query hit
+    SCHED_DUE_LIMIT, i.e. some due rows were left out of this tick.
+    """
+    work: dict[int, tuple[dict, list[dict]]] = {}
+
+    with trace.span("fetch"):
+        due = get_due_queue(tick, per_user_limit=SCHED_DUE_PER_USER, limit=SCHED_DUE_LIMIT) or []
+    truncated = len(due) >= SCHED_DUE_LIMIT
+
+    for f in due:
+        owner = f.pop("user")
+        work.setdefault(int(owner["id"]), (owner, []))[1].append(f)
+
+    with _carry_lock:
+        carried = list(_carried_over)
+        _carried_over.clear()
+
+    if not carried:
+        return list(work.values()), truncated
+
+    rank = {uid: i for i, uid in enumerate(carried)}
+    return sorted(work.values(), key=lambda w: rank.get(int(w[0]["id"]), len(rank))), truncated
+
+
+def _carry_over(uids: list[int]) -> None:
+    if not uids:
+        return
+    with _carry_lock:
+        for uid in uids:
+            if uid not in _carried_over:
+                _carried_over.append(uid)
+    with _metrics_lock:
+        _metrics["users_carried_over"] += len(uids)
+
+
+def _enqueue_due(u: dict, items: list[dict], tick: str) -> int:
+    uid = int(u["id"])
+    current_app.logger.info(
+        f"[SCHED][USER {uid}] due followups: {len(items)}"
+    )
+    trace.sample_dump(
+        f"[SCHED][USER {uid}] due",
+        lambda: [(f.get("id"), f.get("status"), f.get("next_send_at")) for f in items],
+    )
+
+    if not (u.get("gmail_token") or "").strip():
+        for f in items:
+            current_app.logger.warning(
+                f"[SCHED][USER {uid}][F {f['id']}] Gmail not connected"
+            )
+            mark_send_failed(int(f["id"]), uid, "Gmail not connected")
+        return 0
+
+    enqueued = 0
+    for f in items:
+        fid = int(f["id"])
+
+        # Mark running (takes it out of the due queue while it waits in the
+        # outbox) and enqueue in one transaction: a crash in between would
+        # leave it 'running' with nothing queued, never sent
+        try:
+            with session() as conn:
+                set_status_running(fid, uid, conn=conn)
+                # one outbox item per occurrence, however many ticks see it
+                outbox.enqueue(
+                    uid,
+                    fid,
+                    "scheduled",
+                    {"tick": tick},
+                    f"sched:{fid}:{f.get('next_send_at') or tick}",
+                    conn=conn,
+                )
+        except Exception:
+            current_app.logger.exception(
+                f"[SCHED][USER {uid}][F {fid}] enqueue failed"
+            )
+            continue
+        enqueued += 1
+
+    return enqueued
+
+
+def _send_scheduled(item: dict) -> dict | None:
+    """
+    outbox "scheduled" handler: smart decision, render, send.
+    Returns the Gmail send meta, or None when there is nothing to send.
+    """
+    started = time.monotonic()
+    uid = int(item["user_id"])
+    fid = int(item["followup_id"])
+    current_app.logger.info(
+        f"[SCHED][USER {uid}][F {fid}] START sending"
+    )
+
+    u = get_user_by_id(uid)
+    f = get_followup(fid, uid)
+    if not u or not f:
+        return None
+
+    # stopped, replied or rescheduled while it sat in the outbox
+    if (
+        (f.get("status") or "") not in ("running", "scheduled", "pending")
+        or int(f.get("schedule_enabled") or 0) != 1
+        or _reply_landed(fid)
+    ):
+        current_app.logger.info(
+            f"[SCHED][USER {uid}][F {fid}] no longer due (status={f.get('status')}), dropped"
+        )
+        return None
+
+    if not (u.get("gmail_token") or "").strip():
+        current_app.logger.warning(
+            f"[SCHED][USER {uid}][F {fid}] Gmail not connected"
+        )
+        mark_send_failed(fid, uid, "Gmail not connected")
+        return None
+
+    # template + branding, shared with the user's other sends
+    renderer = branded_renderer(u)
+
+    # =========================
+    # ✅ SMART FOLLOW-UP LOGIC
+    # =========================
+    smart_enabled = int(f.get("smart_enabled") or 0) == 1
+
+    if smart_enabled:
+        decision = evaluate_smart_followup(f)
+
+        current_app.logger.info(
+            "[SMART][USER %s][F %s] should_send=%s stage=%s template=%s note=%s",
+            uid,
+            fid,
+            decision.should_send,
+            decision.stage,
+            decision.template_key,
+            decision.decision_note,
+        )
+
+        update_smart_followup_state(
+            fid=fid,
+            user_id=uid,
+            stage=decision.stage,
+            template_key=decision.template_key,
+            decision_note=decision.decision_note,
+        )
+
+        if decision.stop_reason:
+            stop_smart_followup(fid, uid, decision.stop_reason)
+            return None
+
+        if not decision.should_send:
+            current_app.logger.info(
+                f"[SMART][USER {uid}][F {fid}] skipped (no send)"
+            )
+
+            # ✅ move next send forward (avoid infinite loop)
+            repeat = (f.get("schedule_repeat") or "once").strip().lower()
+
+            if repeat != "once":
+                next_at = compute_next_send_at(
+                    start_date=(f.get("schedule_start_date") or "")[:10] or datetime.utcnow().date().isoformat(),
+                    send_time=(f.get("schedule_send_time") or "09:00"),
+                    repeat=repeat,
+                    rel_value=f.get("schedule_rel_value"),
+                    rel_unit=f.get("schedule_rel_unit"),
+                    input_tz="Africa/Lagos",
+                )
+
+                mark_send_success_repeat(fid, uid, next_at)
+
+            return None
+
+        context = {
+            "name": f.get("client_name") or "there",
+            "type": f.get("followup_type") or "follow-up",
+            "sender": renderer.branding.get("company_name")
+            or "Your Company",
+        }
+
+        smart_message = render_smart_template(
+            decision.template_key, context
+        )
+
+        f = dict(f)
+        f["message_override"] = smart_message
+
+    # =========================
+    # BUILD EMAIL
+    # =========================
+    with trace.span("render", user_id=uid):
+        body_html = renderer.render(f)
+
+    # the reply job may have stopped this followup while we were rendering
+    if _reply_landed(fid):
+        current_app.logger.info(
+            f"[SCHED][USER {uid}][F {fid}] reply landed, send cancelled"
+        )
+        trace.incr("sched_sends_total", result="cancelled_reply")
+        return None
+
+    # SEND EMAIL
+    with _gmail_slot(), trace.span("send", user_id=uid):
+        send_meta = send_followup_email(u, f, body_html)
+    trace.incr("sched_sends_total", result="ok")
+    _record_time("send_seconds", time.monotonic() - started)
+
+    return send_meta or {}
+
+
+def _complete_scheduled(item: dict, send_meta: dict) -> None:
+    """
+    outbox "scheduled" handler: followup state after Gmail accepted the send.
+    """
+    uid = int(item["user_id"])
+    fid = int(item["followup_id"])
+    tick = (item.get("payload") or {}).get("tick") or now_iso()
+    f = get_followup(fid, uid) or {}
+
+    if send_meta:
+        current_app.logger.info(
+            f"[SCHED][USER {uid}][F {fid}] SENT OK"
+        )
+
+        save_outbound_gmail_metadata(
+            fid=fid,
+            user_id=uid,
+            gmail_message_id=send_meta.get("message_id") or "",
+            gmail_thread_id=send_meta.get("thread_id") or "",
+        )
+
+    if _reply_landed(fid):
+        # reply arrived while we were sending: keep it stopped, don't reschedule
+        disable_followup_schedule(fid, uid)
+        return
+
+    # =========================
+    # STEP 4: HANDLE REPEAT
+    # =========================
+    repeat = (f.get("schedule_repeat") or "once").strip().lower()
+
+    if repeat == "once":
+        with trace.span("mark", user_id=uid):
+            mark_send_success_once(fid, uid)
+        return
+
+    start_date = (
+        (f.get("schedule_start_date") or "").strip()
+        or ((f.get("next_send_at") or "")[:10] if (f.get("next_send_at") or "").strip() else "")
+        or (f.get("due_date") or "").strip()
+    )
+
+    if not start_date:
+        start_date = datetime.utcnow().date().isoformat()
+
+    next_at = compute_next_send_at(
+        start_date=start_date,
+        send_time=(f.get("schedule_send_time") or "09:00"),
+        repeat=repeat,
+        rel_value=f.get("schedule_rel_value"),
+        rel_unit=f.get("schedule_rel_unit"),
+        input_tz="Africa/Lagos",
+        send_time_2=f.get("schedule_send_time_2"),
+        interval=f.get("schedule_interval"),
+        byweekday=f.get("schedule_byweekday"),
+    )
+
+    if next_at and next_at < tick:
+        next_at = (
+            datetime.now(TZ) + timedelta(seconds=60)
+        ).replace(tzinfo=None).isoformat(timespec="seconds")
+
+    with trace.span("mark", user_id=uid):
+        mark_send_success_repeat(fid, uid, next_at)
+
+
+def _fail_scheduled(item: dict, error: str) -> None:
+    uid = int(item["user_id"])
+    fid = int(item["followup_id"])
+    current_app.logger.error(
+        f"[SCHED][USER {uid}][F {fid}] SEND FAILED after {item.get('attempts', 0) + 1} attempts: {error}"
+    )
+    trace.incr("sched_sends_total", result="failed")
+    mark_send_failed(fid, uid, error)
+
+
+outbox.register_handler(
+    "scheduled",
+    send=_send_scheduled,
+    complete=_complete_scheduled,
+    fail=_fail_scheduled,
+)
+
+
 def run_scheduled_sends(app) -> None:
     with app.app_context():
         tick = now_iso()
+        tick_started = time.monotonic()
         current_app.logger.info(f"[SCHED] ===== TICK START @ {tick} =====")
 
-        users = get_all_users() or []
-        current_app.logger.info(f"[SCHED] total users: {len(users)}")
+        work, truncated = _work_for_tick(tick)
+        current_app.logger.info(f"[SCHED] users with work: {len(work)}")
+
+        enqueued = 0
+        carried: list[int] = []
+        handled: list[int] = []
+        for i, (u, items) in enumerate(work):
+            if time.monotonic() - tick_started > SCHED_TICK_DEADLINE_SECONDS:
+                carried = [int(w[0]["id"]) for w in work[i:]]
+                break
+            user_started = time.monotonic()
+            try:
+                enqueued += _enqueue_due(u, items, tick)
+                # a user at the per-user cap may have more overdue rows we never saw
+                if len(items) < SCHED_DUE_PER_USER:
+                    handled.append(int(u["id"]))
+            except Exception:
+                current_app.logger.exception(f"[SCHED][USER {u['id']}] enqueue FAILED")
+            _record_time("user_seconds", time.monotonic() - user_started)
+
+        _carry_over(carried)
+
+        # =========================
+        # STEP 5: CLEANUP (queued items are 'running' and left alone)
+        # =========================
+        # Only for users this tick saw in full. If the global limit cut the
+        # queue or anyone was carried over, rows we never fetched could look
+        # overdue, so skip the pass and let the next tick catch up first.
+        grace_cutoff = (
+            datetime.now() - timedelta(minutes=2)
+        ).isoformat(timespec="seconds")
+
+        if truncated or carried:
+            current_app.logger.info(
+                f"[SCHED] passed-marking skipped (truncated={truncated} carried_over={len(carried)})"
+            )
+        else:
+            try:
+                with trace.span("mark"):
+                    mark_schedule_passed_all(grace_cutoff, handled)
+            except Exception:
+                current_app.logger.exception("[SCHED] mark_schedule_passed_all FAILED")
+
+        remaining = max(SCHED_TICK_DEADLINE_SECONDS - (time.monotonic() - tick_started), 1.0)
+        processed = outbox.drain(app, max_seconds=remaining)
+
+        took = time.monotonic() - tick_started
+        with _metrics_lock:
+            _metrics["ticks"] += 1
+            _metrics["last_tick_seconds"] = took
+            _metrics["last_tick_users"] = len(work) - len(carried)
+            _metrics["last_tick_enqueued"] = enqueued
+            _metrics["last_tick_processed"] = processed
+
+        current_app.logger.info(
+            f"[SCHED] ===== TICK END ===== users={len(work) - len(carried)} carried_over={len(carried)} "
+            f"enqueued={enqueued} processed={processed} took={took:.2f}s"
+        )
+
 
+def run_outbox_drain(app) -> None:
+    with app.app_context():
+        processed = outbox.drain(app, max_seconds=SCHED_TICK_DEADLINE_SECONDS)
+        if processed:
+            current_app.logger.info(f"[OUTBOX] drained {processed} item(s)")
+
+
+# =========================
+# REPLY DETECTION JOB
+# =========================
+# Runs apart from the send tick so slow Gmail reads never hold up due sends.
+# Each user gets an adaptive interval:
+#   REPLY_MIN_INTERVAL            while they have a tracked thread sent within REPLY_HOT_SECONDS
+#   x2 after every quiet check    once their threads are older, up to REPLY_MAX_INTERVAL
+# A new send (last_tracked_send_at moves) or a reply resets it.
+# Replies found here are remembered in-process so a send already in flight
+# for that followup is cancelled (see _send_scheduled).
+REPLY_POLL_SECONDS = int(os.getenv("REPLY_POLL_SECONDS") or 15)
+REPLY_WORKERS = int(os.getenv("REPLY_WORKERS") or 4)
+REPLY_MIN_INTERVAL = float(os.getenv("REPLY_MIN_INTERVAL") or 30)
+REPLY_MAX_INTERVAL = float(os.getenv("REPLY_MAX_INTERVAL") or 1800)
+REPLY_HOT_SECONDS = float(os.getenv("REPLY_HOT_SECONDS") or 3600)
+
+_reply_pool = ThreadPoolExecutor(max_workers=max(REPLY_WORKERS, 1), thread_name_prefix="sched-reply")
+
+_reply_lock = threading.Lock()
+_reply_state: dict[int, dict] = {}  # uid -> {"next_at", "quiet", "last_send", "running"}
+_replied_fids: OrderedDict[int, None] = OrderedDict()  # newest last
+_REPLIED_FIDS_MAX = 10_000
+
+
+def _reply_landed(fid: int) -> bool:
+    with _reply_lock:
+        return int(fid) in _replied_fids
+
+
+def _note_replied(fid: int) -> None:
+    with _reply_lock:
+        _replied_fids[int(fid)] = None
+        while len(_replied_fids) > _REPLIED_FIDS_MAX:
+            _replied_fids.popitem(last=False)
+
+
+def _reply_interval(state: dict) -> float:
+    try:
+        age = (datetime.now() - datetime.fromisoformat(state["last_send"])).total_seconds()
+    except (TypeError, ValueError):
+        age = REPLY_HOT_SECONDS
+    if age < REPLY_HOT_SECONDS:
+        return REPLY_MIN_INTERVAL
+    return min(REPLY_MAX_INTERVAL, REPLY_MIN_INTERVAL * 2 ** state["quiet"])
+
+
+def _users_due_for_reply_check(now: float) -> list[dict]:
+    users = get_reply_poll_users() or []
+    due = []
+
+    with _reply_lock:
+        tracked = set()
         for u in users:
             uid = int(u["id"])
-            current_app.logger.info(f"[SCHED][USER {uid}] processing")
-
-            # =========================
-            # STEP 1: REPLY DETECTION
-            # =========================
+            tracked.add(uid)
+            last_send = u.get("last_tracked_send_at")
+
+            state = _reply_state.get(uid)
+            if state is None or state["last_send"] != last_send:
+                # first sight or a new send since the last check: poll now, reset backoff
+                state = _reply_state[uid] = {
+                    "next_at": now,
+                    "quiet": 0,
+                    "last_send": last_send,
+                    "running": state["running"] if state else False,
+                }
+
+            if state["next_at"] <= now and not state["running"]:
+                state["running"] = True
+                due.append(u)
+
+        # nothing left to watch for these
+        for uid in [uid for uid, st in _reply_state.items() if uid not in tracked and not st["running"]]:
+            del _reply_state[uid]
+
+    return due
+
+
+def _reschedule_reply_check(uid: int, replies: int) -> None:
+    with _reply_lock:
+        state = _reply_state.get(uid)
+        if state is None:
+            return
+        state["running"] = False
+        state["quiet"] = 0 if replies else state["quiet"] + 1
+        state["next_at"] = time.monotonic() + _reply_interval(state)
+
+
+def _check_replies_one(app, u: dict) -> None:
+    uid = int(u["id"])
+    reply_results = []
+    try:
+        with app.app_context():
             try:
-                current_app.logger.debug(f"[SCHED][USER {uid}] checking replies...")
-                reply_results = check_replies_for_user(u)
-                for r in reply_results or []:
+                current_app.logger.debug(f"[REPLY][USER {uid}] checking replies...")
+                with _gmail_slot(), trace.span("reply_detection", user_id=uid):
+                    reply_results = check_replies_for_user(u) or []
+                trace.incr("sched_replies_total", len(reply_results))
+
+                for r in reply_results:
                     fid = r.get("followup_id")
                     if not fid:
                         continue
 
+                    _note_replied(fid)
                     current_app.logger.info(
                         f"[REPLY][USER {uid}][F {fid}] reply detected → stopping automation"
                     )
@@ -131,196 +686,96 @@ def run_scheduled_sends(app) -> None:
 
                 if reply_results:
                     current_app.logger.info(
-                        f"[SCHED][USER {uid}] replies detected: {len(reply_results)}"
+                        f"[REPLY][USER {uid}] replies detected: {len(reply_results)}"
                     )
                 else:
-                    current_app.logger.debug(f"[SCHED][USER {uid}] no replies found")
+                    current_app.logger.debug(f"[REPLY][USER {uid}] no replies found")
 
             except Exception:
                 current_app.logger.exception(
-                    f"[SCHED][USER {uid}] reply detection FAILED"
-                )
-
-            # =========================
-            # STEP 2: FETCH DUE ITEMS
-            # =========================
-            items = get_due_scheduled(uid, tick) or []
-            current_app.logger.info(
-                f"[SCHED][USER {uid}] due followups: {len(items)}"
-            )
-
-            # =========================
-            # STEP 3: SEND LOOP
-            # =========================
-            for f in items:
-                fid = int(f["id"])
-                current_app.logger.info(
-                    f"[SCHED][USER {uid}][F {fid}] START sending"
+                    f"[REPLY][USER {uid}] reply detection FAILED"
                 )
+    finally:
+        _reschedule_reply_check(uid, len(reply_results))
 
-                try:
-                    if not (u.get("gmail_token") or "").strip():
-                        current_app.logger.warning(
-                            f"[SCHED][USER {uid}][F {fid}] Gmail not connected"
-                        )
-                        mark_send_failed(fid, uid, "Gmail not connected")
-                        continue
-
-                    # Mark running
-                    try:
-                        set_status_running(fid, uid)
-                    except Exception:
-                        current_app.logger.warning(
-                            f"[SCHED][USER {uid}][F {fid}] failed to set running"
-                        )
-
-                    # =========================
-                    # ✅ SMART FOLLOW-UP LOGIC
-                    # =========================
-                    smart_enabled = int(f.get("smart_enabled") or 0) == 1
-
-                    if smart_enabled:
-                        decision = evaluate_smart_followup(f)
-
-                        current_app.logger.info(
-                            "[SMART][USER %s][F %s] should_send=%s stage=%s template=%s note=%s",
-                            uid,
-                            fid,
-                            decision.should_send,
-                            decision.stage,
-                            decision.template_key,
-                            decision.decision_note,
-                        )
-
-                        update_smart_followup_state(
-                            fid=fid,
-                            user_id=uid,
-                            stage=decision.stage,
-                            template_key=decision.template_key,
-                            decision_note=decision.decision_note,
-                        )
-
-                        if decision.stop_reason:
-                            stop_smart_followup(fid, uid, decision.stop_reason)
-                            continue
-
-                        if not decision.should_send:
-                            current_app.logger.info(
-                                f"[SMART][USER {uid}][F {fid}] skipped (no send)"
-                            )
-
-                            # ✅ move next send forward (avoid infinite loop)
-                            repeat = (f.get("schedule_repeat") or "once").strip().lower()
-
-                            if repeat != "once":
-                                next_at = compute_next_send_at(
-                                    start_date=(f.get("schedule_start_date") or "")[:10] or datetime.utcnow().date().isoformat(),
-                                    send_time=(f.get("schedule_send_time") or "09:00"),
-                                    repeat=repeat,
-                                    rel_value=f.get("schedule_rel_value"),
-                                    rel_unit=f.get("schedule_rel_unit"),
-                                    input_tz="Africa/Lagos",
-                                )
-
-                                mark_send_success_repeat(fid, uid, next_at)
-
-                            continue
-
-                        context = {
-                            "name": f.get("client_name") or "there",
-                            "type": f.get("followup_type") or "follow-up",
-                            "sender": (get_branding(uid) or {}).get("company_name")
-                            or "Your Company",
-                        }
-
-                        smart_message = render_smart_template(
-                            decision.template_key, context
-                        )
-
-                        f = dict(f)
-                        f["message_override"] = smart_message
-
-                    # =========================
-                    # BUILD EMAIL
-                    # =========================
-                    tmpl = get_scheduler_template(uid) or DEFAULT_SCHEDULER_TEMPLATE
-                    branding = get_branding(uid)
-
-                    body_html = render_scheduler_html(
-                        tmpl,
-                        user=u,
-                        followup=f,
-                        branding=branding,
-                    )
 
-                    # SEND EMAIL
-                    send_meta = send_followup_email(u, f, body_html)
-
-                    if send_meta:
-                        current_app.logger.info(
-                            f"[SCHED][USER {uid}][F {fid}] SENT OK"
-                        )
-
-                        save_outbound_gmail_metadata(
-                            fid=fid,
-                            user_id=uid,
-                            gmail_message_id=send_meta.get("message_id") or "",
-                            gmail_thread_id=send_meta.get("thread_id") or "",
-                        )
+def run_reply_detection(app) -> None:
+    with app.app_context():
+        started = time.monotonic()
+        users = _users_due_for_reply_check(started)
+        if not users:
+            return
 
-                    # =========================
-                    # STEP 4: HANDLE REPEAT
-                    # =========================
-                    repeat = (f.get("schedule_repeat") or "once").strip().lower()
+        futures = [_reply_pool.submit(_check_replies_one, app, u) for u in users]
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception:
+                current_app.logger.exception("[REPLY] check FAILED")
 
-                    if repeat == "once":
-                        mark_send_success_once(fid, uid)
-                        continue
+        with _metrics_lock:
+            _metrics["reply_checks"] += len(users)
 
-                    start_date = (
-                        (f.get("schedule_start_date") or "").strip()
-                        or ((f.get("next_send_at") or "")[:10] if (f.get("next_send_at") or "").strip() else "")
-                        or (f.get("due_date") or "").strip()
-                    )
+        current_app.logger.info(
+            f"[REPLY] checked users={len(users)} took={time.monotonic() - started:.2f}s"
+        )
 
-                    if not start_date:
-                        start_date = datetime.utcnow().date().isoformat()
-
-                    next_at = compute_next_send_at(
-                        start_date=start_date,
-                        send_time=(f.get("schedule_send_time") or "09:00"),
-                        repeat=repeat,
-                        rel_value=f.get("schedule_rel_value"),
-                        rel_unit=f.get("schedule_rel_unit"),
-                        input_tz="Africa/Lagos",
-                        send_time_2=f.get("schedule_send_time_2"),
-                        interval=f.get("schedule_interval"),
-                        byweekday=f.get("schedule_byweekday"),
-                    )
 
-                    if next_at and next_at < tick:
-                        next_at = (
-                            datetime.now(TZ) + timedelta(seconds=60)
-                        ).replace(tzinfo=None).isoformat(timespec="seconds")
+# =========================
+# IMPORT JOB SWEEP
+# =========================
+# Resumes CSV imports whose worker died mid-file (from their last committed
+# chunk) and drops finished jobs past IMPORT_JOB_TTL_HOURS.
+def run_import_jobs_sweep(app) -> None:
+    with app.app_context():
+        try:
+            resumed = import_jobs.recover()
+            purged = import_jobs.purge_expired()
+        except Exception:
+            current_app.logger.exception("[IMPORT] sweep FAILED")
+            return
+        if resumed or purged:
+            current_app.logger.info(f"[IMPORT] sweep resumed={resumed} purged={purged}")
+
+
+# =========================
+# COUNTER REPAIR
+# =========================
+# user_counters is kept by triggers; this recounts it and fixes drift from
+# writes that bypassed them (restores, manual SQL). Nothing to fix is the
+# normal case, so anything it does fix is logged as a warning.
+COUNTERS_REPAIR_SECONDS = int(os.getenv("COUNTERS_REPAIR_SECONDS") or 3600)
+
+
+def run_counters_repair(app) -> None:
+    with app.app_context():
+        try:
+            fixes = repair_user_counters()
+        except Exception:
+            current_app.logger.exception("[COUNTERS] repair FAILED")
+            return
+        if fixes:
+            current_app.logger.warning(f"[COUNTERS] repaired {len(fixes)} drifted counters, e.g. {fixes[:5]}")
 
-                    mark_send_success_repeat(fid, uid, next_at)
 
-                except Exception as e:
-                    current_app.logger.exception(
-                        f"[SCHED][USER {uid}][F {fid}] SEND FAILED"
-                    )
-                    mark_send_failed(fid, uid, f"{type(e).__name__}: {e}")
+# =========================
+# ANALYTICS ROLLUP
+# =========================
+# Folds new send_events into the hourly/daily rollups /analytics reads.
+# Whatever it hasn't reached yet is counted from the log at read time, so
+# the interval only bounds how much of that tail a page view scans.
+ANALYTICS_ROLLUP_SECONDS = int(os.getenv("ANALYTICS_ROLLUP_SECONDS") or 60)
 
-            # =========================
-            # STEP 5: CLEANUP
-            # =========================
-            grace_cutoff = (
-                datetime.now() - timedelta(minutes=2)
-            ).isoformat(timespec="seconds")
 
-            mark_schedule_passed(uid, grace_cutoff)
-
-        current_app.logger.info(f"[SCHED] ===== TICK END =====")
+def run_analytics_rollup(app) -> None:
+    with app.app_context():
+        try:
+            folded = roll_up_send_events()
+        except Exception:
+            current_app.logger.exception("[ANALYTICS] rollup FAILED")
+            return
+        if folded:
+            current_app.logger.info(f"[ANALYTICS] rolled up {folded} send events")
 
 
 def start_scheduler(app) -> None:
@@ -341,7 +796,72 @@ def start_scheduler(app) -> None:
         misfire_grace_time=60,
     )
 
+    scheduler.add_job(
+        run_outbox_drain,
+        "interval",
+        seconds=OUTBOX_POLL_SECONDS,
+        args=[app],
+        id="outbox_drain",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=60,
+    )
+
+    scheduler.add_job(
+        run_reply_detection,
+        "interval",
+        seconds=REPLY_POLL_SECONDS,
+        args=[app],
+        id="reply_detection",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=60,
+    )
+
+    scheduler.add_job(
+        run_import_jobs_sweep,
+        "interval",
+        seconds=import_jobs.IMPORT_JOB_SWEEP_SECONDS,
+        args=[app],
+        id="import_jobs_sweep",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=60,
+    )
+
+    scheduler.add_job(
+        run_counters_repair,
+        "interval",
+        seconds=COUNTERS_REPAIR_SECONDS,
+        args=[app],
+        id="counters_repair",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=60,
+    )
+
+    scheduler.add_job(
+        run_analytics_rollup,
+        "interval",
+        seconds=ANALYTICS_ROLLUP_SECONDS,
+        args=[app],
+        id="analytics_rollup",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=60,
+    )
+
+    scheduler.add_listener(_on_tick_skipped, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
     scheduler.start()
     _started = True
-    print("[SCHEDULER] Started (scheduled_sends every 30s)")
+    print(
+        f"[SCHEDULER] Started (scheduled_sends every 30s, outbox_drain every {OUTBOX_POLL_SECONDS}s, "
+        f"reply_detection every {REPLY_POLL_SECONDS}s, import_jobs_sweep every {import_jobs.IMPORT_JOB_SWEEP_SECONDS}s, "
+        f"counters_repair every {COUNTERS_REPAIR_SECONDS}s, analytics_rollup every {ANALYTICS_ROLLUP_SECONDS}s)"
+    )
     atexit.register(lambda: scheduler.shutdown())
\ No newline at end of file
@@ -0,0 +1,178 @@
+# web/scheduler_trace.py
+"""
+Opt-in tracing for the scheduler tick.
+
+    SCHED_TRACE=1               turn it on (default off)
+    SCHED_TRACE_SAMPLE=0.01     fraction of sample_dump() calls that log their rows
+    SCHED_METRICS_TOKEN=...     bearer token a scraper can use for /metrics/scheduler
+                                (otherwise only the logged-in admin can read it)
+
+When disabled, span() returns a shared no-op context manager and every other
+helper returns immediately, so instrumented code pays one attribute check.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+ENABLED = (os.getenv("SCHED_TRACE") or "").strip().lower() in ("1", "true", "yes", "on")
+SAMPLE_RATE = float(os.getenv("SCHED_TRACE_SAMPLE") or 0.01)
+
+log = logging.getLogger("scheduler.trace")
+
+# seconds; Prometheus-style cumulative buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by (name, labels). Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+
+    def incr(self, name: str, n: float = 1, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + n
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(buckets)
+            hist.observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        lines: list[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_fmt_labels(key)} {value:g}")
+
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in series.items():
+                    running = 0
+                    for bound, c in zip(hist.buckets, hist.counts):
+                        running += c
+                        lines.append(f"{name}_bucket{_fmt_labels(key, ('le', f'{bound:g}'))} {running}")
+                    lines.append(f"{name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{_fmt_labels(key)} {hist.total:.6f}")
+                    lines.append(f"{name}_count{_fmt_labels(key)} {hist.count}")
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value):g}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def _timed_span(phase: str, labels: Dict[str, Any]) -> Iterator[None]:
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        took = time.perf_counter() - started
+        registry.observe("sched_phase_seconds", took, phase=phase)
+        if failed:
+            registry.incr("sched_phase_errors_total", phase=phase)
+        log.debug("[TRACE] phase=%s took=%.4fs failed=%s %s", phase, took, failed, labels)
+
+
+def span(phase: str, **labels: Any):
+    """
+    with span("send", user_id=uid, followup_id=fid):
+        ...
+
+    Phases used by the scheduler: reply_detection, fetch, render, send, mark.
+    """
+    if not ENABLED:
+        return _NOOP_SPAN
+    return _timed_span(phase, labels)
+
+
+def incr(name: str, n: float = 1, **labels: Any) -> None:
+    if ENABLED:
+        registry.incr(name, n, **labels)
+
+
+def sample_dump(label: str, rows: Callable[[], Any]) -> None:
+    """
+    Log rows() for a sampled fraction of calls. rows is only evaluated when
+    the sample hits, so callers can pass an expensive query.
+    """
+    if not ENABLED or random.random() >= SAMPLE_RATE:
+        return
+    try:
+        log.info("[TRACE][DUMP] %s %s", label, rows())
+    except Exception:
+        log.exception("[TRACE][DUMP] %s failed", label)